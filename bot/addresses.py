@@ -0,0 +1,124 @@
+"""
+住民の住所からゴミ収集地区を決める
+自治会ごとに AddressDistrict の「町名・班名」からトライ木を作り、住所の先頭から一文字ずつたどって
+最も長く一致したものを採用します（住所の長さ分の手間だけで済みます）。
+結果は住民ごとにキャッシュします。
+"""
+import threading
+import unicodedata
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from members.models import AiMember
+
+from . import caching
+from .models import AddressDistrict
+
+MEMBER_NAMESPACE = "member_region"
+# 住所の変更はそのプロセスでしか捨てられないため、ほかのプロセスでもこの秒数で読み直す
+MEMBER_CACHE_SECONDS = 60 * 60
+# 自治会ごとの対応表の版（address_districts:<自治会ID>）
+TRIE_VERSION = "address_districts"
+
+# トライ木の節点で、そこまでの文字列に対応する地区コードを入れるキー
+_END = ""
+
+_lock = threading.Lock()
+_tries = {}
+
+
+def normalize(text):
+    """全角・半角の違いと空白を吸収する"""
+    return "".join(unicodedata.normalize('NFKC', text or "").split())
+
+
+def build_trie(pairs):
+    root = {}
+    for prefix, code in pairs:
+        node = root
+        for ch in normalize(prefix):
+            node = node.setdefault(ch, {})
+        node[_END] = code
+    return root
+
+
+def match(trie, address):
+    """最長一致した地区コード。どれにも当てはまらなければ None"""
+    node = trie
+    found = node.get(_END)
+    for ch in normalize(address):
+        node = node.get(ch)
+        if node is None:
+            break
+        found = node.get(_END, found)
+    return found
+
+
+def get_trie(politician_id):
+    caching.check()
+    trie = _tries.get(politician_id)
+    if trie is None:
+        trie = build_trie(AddressDistrict.objects.filter(politician_id=politician_id).values_list('prefix', 'region_id'))
+        with _lock:
+            _tries[politician_id] = trie
+    return trie
+
+
+def _member_key(line_user_id):
+    return caching.make_key(MEMBER_NAMESPACE, line_user_id)
+
+
+def member_region(politician, line_user_id):
+    """
+    住民の地区コード
+    対応表が無い自治会は、住民の情報を読まずに自治会の地区を返します
+    """
+    trie = get_trie(politician.pk)
+    if not trie:
+        return politician.gomi_region_id
+
+    regions = cache.get(_member_key(line_user_id)) or {}
+    if politician.pk in regions:
+        return regions[politician.pk] or politician.gomi_region_id
+
+    address = AiMember.objects.filter(pk=line_user_id).values_list('address', flat=True).first()
+    code = match(trie, address)
+    _remember(politician, line_user_id, code)
+    return code or politician.gomi_region_id
+
+
+def assign_member(politician, line_user_id, address):
+    """登録時に住所から地区を求めてキャッシュしておく"""
+    trie = get_trie(politician.pk)
+    if trie:
+        _remember(politician, line_user_id, match(trie, address))
+
+
+def _remember(politician, line_user_id, code):
+    # 対応表に当てはまらない住民は None を入れ、自治会の地区は読み出し時に補う
+    regions = cache.get(_member_key(line_user_id)) or {}
+    regions[politician.pk] = code
+    cache.set(_member_key(line_user_id), regions, MEMBER_CACHE_SECONDS)
+
+
+def forget_member(line_user_id):
+    cache.delete(_member_key(line_user_id))
+
+
+def _drop_trie(part):
+    with _lock:
+        if part is None:
+            _tries.clear()
+        else:
+            _tries.pop(int(part), None)
+
+
+def invalidate(politician_id, using=DEFAULT_DB_ALIAS):
+    """対応表が変わったら、トライ木と住民ごとの結果を捨てる"""
+    caching.bump(TRIE_VERSION, politician_id, using=using)
+    # 住民ごとの結果は自治会単位では探せないため、名前空間ごと無効にする
+    caching.bump(MEMBER_NAMESPACE, using=using)
+
+
+caching.on_change(TRIE_VERSION, _drop_trie)
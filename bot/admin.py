@@ -1,10 +1,32 @@
 from django.contrib import admin
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils.html import format_html, format_html_join
 from import_export import resources, fields
 from import_export.admin import ImportExportModelAdmin
-from import_export.widgets import DateWidget
+from import_export.widgets import DateWidget, ForeignKeyWidget
 
 # 古いGarbageScheduleは削除し、GarbageCalendarを含めてインポートします
-from .models import Politician, Event, Course, CourseContent, UserProgress, CourseAssignment, MessageLog, GarbageCalendar
+from core.paginator import EstimatedCountPaginator
+from . import course_stats, courses
+from .models import CourseProgressStat, Politician, Event, Course, CourseContent, UserProgress, CourseAssignment, MessageLog, GarbageCalendar, OutboundDeadLetter, GarbageRule, GarbageRuleException, Region, AddressDistrict, DiagnosticsSetting
+
+# 進捗集計（CourseProgressStat）を表にする。rows は (見出し, 案内ID, ステップごとの人数)
+def progress_table(rows):
+    lines = []
+    for label, course_id, histogram in rows:
+        index = courses.get_course_index(course_id)
+        summary = course_stats.summarize(histogram, index.last_order if index else 0)
+        titles = {c.order: c.title for c in index.contents} if index else {}
+        detail = "、".join(f"{titles.get(order, order) if order else '未確認'}: {n}人" for order, n in summary.histogram.items())
+        lines.append((label, summary.started, summary.completed, detail))
+    if not lines:
+        return "まだ利用者はいません"
+    return format_html(
+        '<table><tr><th>{}</th><th>開始</th><th>完了</th><th>確認済みのステップごとの人数</th></tr>{}</table>',
+        "対象",
+        format_html_join('', '<tr><td>{}</td><td>{}人</td><td>{}人</td><td>{}</td></tr>', lines),
+    )
 
 # 自治会の編集画面の中に「案内の紐付け」を出す設定
 class CourseAssignmentInline(admin.TabularInline):
@@ -20,21 +42,41 @@ class CourseContentInline(admin.StackedInline):
     verbose_name = "メッセージ内容（ステップ）"
     verbose_name_plural = "メッセージ内容（ステップ）"
 
+    def get_queryset(self, request):
+        # 各ステップの表示名（__str__）で案内のタイトルを使うため、まとめて読む
+        return super().get_queryset(request).select_related('course')
+
 @admin.register(Politician)
 class PoliticianAdmin(admin.ModelAdmin):
     list_display = ('name', 'slug', 'gomi_region', 'has_api_key')
+    list_select_related = ('gomi_region',)
+    autocomplete_fields = ('gomi_region',)
+    search_fields = ('name', 'slug')
     # 自治会の編集画面に「案内の紐付け」を表示
     inlines = [CourseAssignmentInline]
+    readonly_fields = ('course_progress',)
     
     fieldsets = (
         ('基本情報', {'fields': ('name', 'slug')}),
-        ('LINE連携設定', {'fields': ('line_channel_secret', 'line_access_token')}),
+        ('LINE連携設定', {'fields': ('line_channel_secret', 'line_access_token', 'webhook_weight')}),
         ('地域設定', {'fields': ('gomi_region',)}),
         ('AI（頭脳）設定', {
             'fields': ('openai_api_key', 'ai_model_name', 'system_prompt', 'openai_assistant_id'),
         }),
+        ('案内の進捗', {'fields': ('course_progress',)}),
     )
 
+    def course_progress(self, obj):
+        if obj.pk is None:
+            return "-"
+        histograms = course_stats.histograms(politician_id=obj.pk)
+        titles = dict(Course.objects.filter(pk__in=[course_id for _, course_id in histograms]).values_list('pk', 'title'))
+        return progress_table(
+            (titles.get(course_id, course_id), course_id, histogram)
+            for (_, course_id), histogram in sorted(histograms.items())
+        )
+    course_progress.short_description = "案内ごとの進捗"
+
     def has_api_key(self, obj):
         return bool(obj.openai_api_key)
     has_api_key.boolean = True
@@ -42,22 +84,142 @@ class PoliticianAdmin(admin.ModelAdmin):
 
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
-    list_display = ('title',)
+    list_display = ('title', 'started_residents', 'completed_residents')
     # 案内の編集画面に「メッセージ内容」を表示
     inlines = [CourseContentInline]
+    readonly_fields = ('progress_summary',)
+    search_fields = ('title',)
+
+    def get_queryset(self, request):
+        # 一覧の人数は集計テーブルから1回のクエリで出す
+        last_order = CourseContent.objects.filter(course=OuterRef('pk')).order_by('-order').values('order')[:1]
+        residents = CourseProgressStat.objects.filter(course=OuterRef('pk')).values('course').annotate(n=Sum('residents')).values('n')
+        return super().get_queryset(request).annotate(
+            _last_order=Subquery(last_order),
+            _started=Coalesce(Subquery(residents), 0),
+            _completed=Coalesce(Subquery(residents.filter(last_completed_order__gte=OuterRef('_last_order'))), 0),
+        )
+
+    def started_residents(self, obj):
+        return obj._started
+    started_residents.short_description = "開始した人数"
+    started_residents.admin_order_field = '_started'
+
+    def completed_residents(self, obj):
+        return obj._completed
+    completed_residents.short_description = "完了した人数"
+    completed_residents.admin_order_field = '_completed'
+
+    def progress_summary(self, obj):
+        if obj.pk is None:
+            return "-"
+        histograms = course_stats.histograms(course_id=obj.pk)
+        names = dict(Politician.objects.filter(pk__in=[politician_id for politician_id, _ in histograms]).values_list('pk', 'name'))
+        return progress_table(
+            (names.get(politician_id, politician_id), obj.pk, histogram)
+            for (politician_id, _), histogram in sorted(histograms.items())
+        )
+    progress_summary.short_description = "自治会ごとの進捗"
 
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
     list_display = ('title', 'politician', 'date')
     list_filter = ('politician',)
+    list_select_related = ('politician',)
 
 @admin.register(UserProgress)
 class UserProgressAdmin(admin.ModelAdmin):
     list_display = ('line_user_id', 'politician', 'current_course', 'updated_at')
+    list_filter = ('politician',)
+    list_select_related = ('politician', 'current_course')
+    autocomplete_fields = ('politician', 'current_course')
+    search_fields = ('=line_user_id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def save_model(self, request, obj, form, change):
+        # 管理画面での修正も進捗集計に反映する
+        previous = None
+        if change:
+            previous = UserProgress.objects.filter(pk=obj.pk).values_list('politician_id', 'current_course_id', 'last_completed_order').first()
+        super().save_model(request, obj, form, change)
+        current = (obj.politician_id, obj.current_course_id, obj.last_completed_order)
+        if previous != current:
+            if previous:
+                course_stats.record(previous[0], previous[1], previous[2], None)
+            course_stats.record(obj.politician_id, obj.current_course_id, None, obj.last_completed_order)
 
 @admin.register(MessageLog)
 class MessageLogAdmin(admin.ModelAdmin):
     list_display = ('member', 'role', 'created_at')
+    list_filter = ('role', 'is_escalated')
+    list_select_related = ('member',)
+    autocomplete_fields = ('member',)
+    search_fields = ('=member__line_user_id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+@admin.register(OutboundDeadLetter)
+class OutboundDeadLetterAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'politician', 'kind', 'status_code', 'attempts')
+    list_filter = ('kind', 'status_code', 'politician')
+    list_select_related = ('politician',)
+    readonly_fields = ('politician', 'kind', 'target', 'payload', 'status_code', 'error', 'attempts', 'created_at')
+
+# 遅いリクエストの記録・プロファイラの切り替え（1行だけ）
+@admin.register(DiagnosticsSetting)
+class DiagnosticsSettingAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'slow_request_ms', 'profile_enabled', 'profile_politician', 'profile_percent', 'updated_at')
+    autocomplete_fields = ('profile_politician',)
+
+    def has_add_permission(self, request):
+        return not DiagnosticsSetting.objects.exists()
+
+    def save_model(self, request, obj, form, change):
+        obj.pk = 1
+        super().save_model(request, obj, form, change)
+
+# === ゴミ収集地区（Excelからまとめて登録できます） ===
+
+class RegionResource(resources.ModelResource):
+    code = fields.Field(attribute='code', column_name='地区コード')
+    municipality = fields.Field(attribute='municipality', column_name='市町村')
+    district = fields.Field(attribute='district', column_name='地区')
+
+    class Meta:
+        model = Region
+        import_id_fields = ('code',)
+        fields = ('code', 'municipality', 'district')
+        skip_unchanged = True
+
+@admin.register(Region)
+class RegionAdmin(ImportExportModelAdmin):
+    resource_class = RegionResource
+    list_display = ('code', 'municipality', 'district')
+    list_filter = ('municipality',)
+    search_fields = ('code', 'municipality', 'district')
+
+# === 住所（町名・班名）と収集地区の対応表 ===
+
+class AddressDistrictResource(resources.ModelResource):
+    politician = fields.Field(attribute='politician', column_name='自治会スラグ', widget=ForeignKeyWidget(Politician, field='slug'))
+    prefix = fields.Field(attribute='prefix', column_name='町名・班名')
+    region = fields.Field(attribute='region', column_name='地区コード', widget=ForeignKeyWidget(Region, field='code'))
+
+    class Meta:
+        model = AddressDistrict
+        import_id_fields = ('politician', 'prefix')
+        fields = ('politician', 'prefix', 'region')
+        skip_unchanged = True
+
+@admin.register(AddressDistrict)
+class AddressDistrictAdmin(ImportExportModelAdmin):
+    resource_class = AddressDistrictResource
+    list_display = ('prefix', 'politician', 'region')
+    list_filter = ('politician',)
+    list_select_related = ('politician', 'region')
+    search_fields = ('prefix',)
+    autocomplete_fields = ('region',)
 
 # === ここから GarbageCalendar 用のインポート設定 ===
 
@@ -67,6 +229,7 @@ class GarbageCalendarResource(resources.ModelResource):
     municipality = fields.Field(attribute='municipality', column_name='市町村')
     district = fields.Field(attribute='district', column_name='地区')
     garbage_type = fields.Field(attribute='garbage_type', column_name='ごみ種別')
+    notes = fields.Field(attribute='notes', column_name='注意事項')
     other = fields.Field(attribute='other', column_name='その他')
 
     class Meta:
@@ -83,3 +246,20 @@ class GarbageCalendarAdmin(ImportExportModelAdmin):
     list_filter = ('municipality', 'district')
     search_fields = ('garbage_type', 'notes')
     date_hierarchy = 'collection_date'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+# === 繰り返しの収集ルール ===
+
+class GarbageRuleExceptionInline(admin.TabularInline):
+    model = GarbageRuleException
+    extra = 1
+    verbose_name = "例外日（休み・振替）"
+    verbose_name_plural = "例外日（休み・振替）"
+
+@admin.register(GarbageRule)
+class GarbageRuleAdmin(admin.ModelAdmin):
+    list_display = ('municipality', 'district', 'garbage_type', 'weekdays', 'nth_weeks', 'valid_from', 'valid_until')
+    list_filter = ('municipality', 'district')
+    inlines = [GarbageRuleExceptionInline]
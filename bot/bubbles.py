@@ -0,0 +1,138 @@
+"""
+LINEに返すFlexメッセージの定義
+モジュール読み込み時に一度だけコンパイルされます（bot/flex.py）
+"""
+from .flex import FlexTemplate, RawSlot, Slot, Template
+
+# === ゴミ出しカレンダー ===
+
+GARBAGE_SPAN = Template({"type": "span", "text": Slot("text"), "color": Slot("color"), "weight": "bold"})
+GARBAGE_NOTE_SPAN = Template({"type": "span", "text": Slot("text"), "color": "#888888", "size": "xs"})
+GARBAGE_SEPARATOR_SPAN = Template({"type": "span", "text": " / ", "color": "#CCCCCC"}).render()
+
+# 1日分の行
+GARBAGE_ROW = Template({
+    "type": "box",
+    "layout": "horizontal",
+    "spacing": "sm",
+    "margin": "md",
+    "contents": [
+        {"type": "text", "text": Slot("date"), "size": "sm", "weight": "bold", "color": "#555555", "flex": 3},
+        {"type": "text", "contents": RawSlot("spans"), "size": "sm", "flex": 5, "wrap": True},
+    ],
+})
+GARBAGE_ROW_SEPARATOR = Template({"type": "separator", "margin": "md"}).render()
+
+GARBAGE_CALENDAR = FlexTemplate("ゴミ出しカレンダー", {
+    "type": "bubble",
+    "size": "mega",
+    "header": {
+        "type": "box", "layout": "vertical", "backgroundColor": "#1DB446",
+        "contents": [
+            {"type": "text", "text": "📅 ゴミ収集カレンダー", "weight": "bold", "size": "lg", "color": "#FFFFFF"},
+            {"type": "text", "text": Slot("subtitle"), "size": "xs", "color": "#E5F7ED", "margin": "sm"},
+        ],
+    },
+    "body": {
+        "type": "box", "layout": "vertical", "spacing": "sm",
+        "contents": RawSlot("rows"),
+    },
+})
+
+# === 案内（教材）一覧 ===
+# ボタンはpostback（bot/postback.py）。タップがトークに流れず、テキスト処理も通りません
+
+COURSE_BUBBLE = Template({
+    "type": "bubble",
+    "body": {
+        "type": "box", "layout": "vertical",
+        "contents": [
+            {"type": "text", "text": "自治会のご案内", "color": "#1DB446", "size": "sm", "weight": "bold"},
+            {"type": "text", "text": Slot("title"), "weight": "bold", "size": "xl", "margin": "md", "wrap": True},
+        ],
+    },
+    "footer": {
+        "type": "box", "layout": "vertical",
+        "contents": [
+            {
+                "type": "button", "style": "primary", "color": "#1DB446",
+                "action": {"type": "postback", "label": "確認を始める", "data": Slot("start_data")},
+            },
+        ],
+    },
+})
+
+# 件数が多い自治会向けの「次へ」バブル
+COURSE_NEXT_PAGE = Template({
+    "type": "bubble",
+    "body": {
+        "type": "box", "layout": "vertical", "justifyContent": "center",
+        "contents": [
+            {"type": "text", "text": "ほかの案内もあります", "weight": "bold", "size": "md", "align": "center", "wrap": True},
+            {"type": "text", "text": Slot("page_label"), "size": "sm", "color": "#888888", "align": "center", "margin": "md"},
+        ],
+    },
+    "footer": {
+        "type": "box", "layout": "vertical",
+        "contents": [
+            {
+                "type": "button", "style": "secondary",
+                "action": {"type": "postback", "label": "次へ", "data": Slot("next_data")},
+            },
+        ],
+    },
+})
+
+COURSE_CAROUSEL = FlexTemplate("案内一覧", {"type": "carousel", "contents": RawSlot("bubbles")})
+
+# === 案内の進行 ===
+
+PROGRESS_SAVED = FlexTemplate("次に進みますか？", {
+    "type": "bubble",
+    "body": {
+        "type": "box", "layout": "vertical",
+        "contents": [
+            {"type": "text", "text": "✅ 記録を保存しました", "weight": "bold", "color": "#1DB446", "size": "md"},
+            {"type": "text", "text": "続けて次の案内に進みますか？", "wrap": True, "size": "sm", "margin": "md"},
+        ],
+    },
+    "footer": {
+        "type": "box", "layout": "vertical", "spacing": "sm",
+        "contents": [
+            {"type": "button", "style": "primary", "color": "#1DB446", "action": {"type": "postback", "label": "次に進む", "data": Slot("next_data")}},
+            {"type": "button", "style": "secondary", "action": {"type": "postback", "label": "一旦終了する", "data": Slot("end_data")}},
+        ],
+    },
+})
+
+STEP_BUTTONS = FlexTemplate("確認完了ボタン", {
+    "type": "bubble",
+    "body": {
+        "type": "box", "layout": "vertical",
+        "contents": [{"type": "text", "text": "確認が終わったらボタンを押して記録しましょう👇", "wrap": True, "size": "sm", "color": "#666666"}],
+    },
+    "footer": {
+        "type": "box", "layout": "horizontal", "spacing": "sm",
+        "contents": [
+            {"type": "button", "style": "primary", "color": "#1DB446", "action": {"type": "postback", "label": "確認完了", "data": Slot("done_data")}},
+            {"type": "button", "style": "secondary", "action": {"type": "postback", "label": "スキップ", "data": Slot("skip_data")}},
+        ],
+    },
+})
+
+COURSE_COMPLETED = FlexTemplate("全確認完了", {
+    "type": "bubble",
+    "body": {
+        "type": "box", "layout": "vertical",
+        "contents": [
+            {"type": "text", "text": "🎉 すべて確認済みです", "weight": "bold", "color": "#1DB446", "size": "md"},
+            {"type": "text", "text": Slot("message"), "wrap": True, "size": "sm", "margin": "md"},
+        ],
+    },
+    "footer": {
+        "type": "box", "layout": "vertical", "spacing": "sm",
+        "contents": [
+            {"type": "button", "style": "primary", "color": "#1DB446", "action": {"type": "postback", "label": "復習リストを見る", "data": Slot("review_data")}},
+        ],
+    },
+})
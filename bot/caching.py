@@ -0,0 +1,100 @@
+"""
+キャッシュのキー管理と、プロセスをまたいだ無効化
+変更があった対象の版番号（CacheVersion）をDBで上げ、各プロセスは CACHE_VERSION_CHECK_SECONDS 秒に1回
+すべての版番号をまとめて読んで、変わったものだけ手元のキャッシュを捨てます。
+- make_key(): 名前空間の版番号をキーに含めるので、bump() すると名前空間のキーがまとめて無効になる
+- on_change(): プロセス内インデックスなど、キーを使わないキャッシュを捨てる関数を登録する
+外部のキャッシュサーバーが無くても、複数のワーカーで管理画面の変更が数秒以内に反映されます。
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CacheVersion
+
+_lock = threading.Lock()
+_versions = {}
+_checked_at = None
+_listeners = defaultdict(list)
+
+
+def _name(namespace, part=None):
+    return namespace if part is None else f"{namespace}:{part}"
+
+
+def on_change(namespace, func):
+    """namespace（または namespace:part）の版が上がった時に func(part) を呼ぶ。part は文字列か None"""
+    _listeners[namespace].append(func)
+
+
+def _notify(names):
+    for name in names:
+        namespace, _, part = name.partition(":")
+        for func in _listeners.get(namespace, ()):
+            func(part or None)
+
+
+def check(force=False):
+    """
+    ほかのプロセスでの変更を確かめる
+    DBを読むのは CACHE_VERSION_CHECK_SECONDS 秒に1回だけ（それ以外は何もしない）
+    """
+    global _checked_at
+    now = time.monotonic()
+    with _lock:
+        interval = getattr(settings, 'CACHE_VERSION_CHECK_SECONDS', 2)
+        if not force and _checked_at is not None and now - _checked_at < interval:
+            return
+        first = _checked_at is None
+        # 読んでいる間にほかのスレッドが重ねて読まないよう、先に時刻を進める
+        _checked_at = now
+    try:
+        latest = dict(CacheVersion.objects.values_list('name', 'version'))
+    except DatabaseError:
+        return
+    with _lock:
+        changed = [] if first else [name for name, version in latest.items() if _versions.get(name, 0) != version]
+        _versions.update(latest)
+    _notify(changed)
+
+
+def forget():
+    """手元の版番号を忘れる（次の check() で読み直す。テスト用）"""
+    global _checked_at
+    with _lock:
+        _versions.clear()
+        _checked_at = None
+
+
+def bump(namespace, part=None, using=DEFAULT_DB_ALIAS):
+    """
+    版を上げる。このプロセスのキャッシュはすぐ、ほかのプロセスは次の check() で捨てられる
+    using には変更を書き込んだDB（シグナルの using）を渡す
+    """
+    name = _name(namespace, part)
+    rows = CacheVersion.objects.using(using).filter(name=name)
+    if not rows.update(version=F('version') + 1, updated_at=timezone.now()):
+        # 初めての対象だけ行を作る（同時に作られても片方は無視され、続く update で加算される）
+        CacheVersion.objects.using(using).bulk_create([CacheVersion(name=name)], ignore_conflicts=True)
+        rows.update(version=F('version') + 1, updated_at=timezone.now())
+    version = rows.values_list('version', flat=True).first()
+    with _lock:
+        _versions[name] = version
+    _notify([name])
+    # トランザクションの途中でほかのスレッドが古い内容を読み直した場合に備え、確定後にもう一度捨てる
+    if connections[using].in_atomic_block:
+        transaction.on_commit(lambda: _notify([name]), using=using)
+
+
+def generation(namespace):
+    check()
+    return _versions.get(namespace, 0)
+
+
+def make_key(namespace, *parts):
+    return ":".join([namespace, str(generation(namespace))] + [str(p) for p in parts])
@@ -0,0 +1,78 @@
+"""
+案内の進捗集計（CourseProgressStat）
+住民の進捗が進むたびに「確認済みのステップごとの人数」を増減させておき、
+管理画面では UserProgress を数え直さずにこの集計だけを読みます。
+集計がずれた場合は manage.py rebuild_course_stats で UserProgress から作り直せます。
+"""
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import CourseProgressStat, UserProgress
+
+Summary = namedtuple('Summary', 'started completed histogram')
+
+
+def _add(politician_id, course_id, order, delta):
+    rows = CourseProgressStat.objects.filter(politician_id=politician_id, course_id=course_id, last_completed_order=order)
+    # 減らすのは行がある場合だけ（自治会・案内ごと削除中で集計がもう無い場合など）
+    if rows.update(residents=F('residents') + delta) or delta < 0:
+        return
+    # 初めてのステップだけ行を作る（同時に作られても片方は無視され、続く update で加算される）
+    CourseProgressStat.objects.bulk_create(
+        [CourseProgressStat(politician_id=politician_id, course_id=course_id, last_completed_order=order)],
+        ignore_conflicts=True,
+    )
+    rows.update(residents=F('residents') + delta)
+
+
+def record(politician_id, course_id, old_order, new_order):
+    """
+    進捗の変化を集計に反映する
+    old_order が None なら新しく始めた住民、new_order が None なら進捗が消えた住民
+    """
+    with transaction.atomic():
+        if old_order is not None:
+            _add(politician_id, course_id, old_order, -1)
+        if new_order is not None:
+            _add(politician_id, course_id, new_order, 1)
+
+
+def summarize(histogram, last_order):
+    started = sum(histogram.values())
+    completed = sum(n for order, n in histogram.items() if last_order and order >= last_order)
+    return Summary(started, completed, dict(sorted(histogram.items())))
+
+
+def histograms(**filters):
+    """{(自治会ID, 案内ID): {確認済みのステップ: 人数}}"""
+    result = defaultdict(dict)
+    rows = CourseProgressStat.objects.filter(residents__gt=0, **filters).values_list(
+        'politician_id', 'course_id', 'last_completed_order', 'residents',
+    )
+    for politician_id, course_id, order, residents in rows:
+        result[(politician_id, course_id)][order] = residents
+    return result
+
+
+def rebuild():
+    """UserProgress から集計を作り直す。作り直した行数を返す"""
+    rows = (
+        UserProgress.objects.values('politician_id', 'current_course_id', 'last_completed_order')
+        .annotate(residents=Count('pk'))
+        .order_by()
+    )
+    stats = [
+        CourseProgressStat(
+            politician_id=row['politician_id'],
+            course_id=row['current_course_id'],
+            last_completed_order=row['last_completed_order'],
+            residents=row['residents'],
+        )
+        for row in rows.iterator()
+    ]
+    with transaction.atomic():
+        CourseProgressStat.objects.all().delete()
+        CourseProgressStat.objects.bulk_create(stats, batch_size=1000)
+    return len(stats)
@@ -0,0 +1,191 @@
+"""
+案内（教材）まわりの読み出し
+自治会ごとの一覧はJOIN1回で取得し、描画済みのカルーセルをページ単位でキャッシュします。
+各案内のステップは順番に並べた配列としてプロセス内に持ち、「N番の次」は二分探索で求めます。
+"""
+import bisect
+import threading
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from . import bubbles, caching, flex, postback
+from .models import Course, CourseAssignment, CourseContent
+
+LIST_NAMESPACE = "course_list"
+# 案内ごとのステップ一覧の版（course:<案内ID>）
+INDEX_VERSION = "course"
+
+# 1ページ目以降、最後のページ以外は「次へ」バブルに1枠使う
+PAGE_SIZE = flex.MAX_CAROUSEL_BUBBLES - 1
+# 変更時は版番号で捨てるが、使われなくなったページがいつまでも残らないよう期限も付ける
+LIST_CACHE_SECONDS = 60 * 60 * 24
+
+
+def assigned_courses(politician):
+    """自治会に割り当てられた案内の (course_id, title) を表示順で返す"""
+    key = caching.make_key(LIST_NAMESPACE, politician.pk, "courses")
+    courses = cache.get(key)
+    if courses is None:
+        courses = list(
+            CourseAssignment.objects.filter(politician=politician)
+            .order_by('order', 'id')
+            .values_list('course_id', 'course__title')
+        )
+        cache.set(key, courses, LIST_CACHE_SECONDS)
+    return courses
+
+
+def paginate(count, page):
+    """ページ番号から (開始位置, 終了位置, 総ページ数) を求める"""
+    if count <= flex.MAX_CAROUSEL_BUBBLES:
+        return 0, count, 1
+    pages = (count + PAGE_SIZE - 1) // PAGE_SIZE
+    page = min(max(page, 1), pages)
+    start = (page - 1) * PAGE_SIZE
+    return start, min(start + PAGE_SIZE, count), pages
+
+
+def render_course_page(courses, page):
+    start, end, pages = paginate(len(courses), page)
+    items = [
+        bubbles.COURSE_BUBBLE.render(title=title, start_data=postback.course("教材開始", course_id))
+        for course_id, title in courses[start:end]
+    ]
+    if end < len(courses):
+        current = start // PAGE_SIZE + 1
+        items.append(bubbles.COURSE_NEXT_PAGE.render(
+            page_label=f"{current} / {pages} ページ",
+            next_data=postback.list_page(current + 1),
+        ))
+    return flex.messages(bubbles.COURSE_CAROUSEL.render(bubbles=flex.join_bubbles(items)))
+
+
+def get_course_list_payload(politician, page=1):
+    """
+    案内一覧カルーセルの送信用JSON。案内が無ければ None
+    割り当てか案内が変更されるまではキャッシュから返します
+    """
+    courses = assigned_courses(politician)
+    if not courses:
+        return None
+    # 住民が送ってきたページ番号はそのまま使わず、実在するページに丸めてからキーにする
+    start, _, _ = paginate(len(courses), page)
+    page = start // PAGE_SIZE + 1
+    key = caching.make_key(LIST_NAMESPACE, politician.pk, "page", page)
+    payload = cache.get(key)
+    if payload is None:
+        payload = render_course_page(courses, page)
+        cache.set(key, payload, LIST_CACHE_SECONDS)
+    return payload
+
+
+def parse_list_command(user_text, commands):
+    """「案内一覧」「案内一覧:2」などを (コマンド, ページ) に分解する。該当しなければ None"""
+    command, _, page = user_text.partition(":")
+    if command not in commands:
+        return None
+    if not page:
+        return command, 1
+    if not page.isdigit():
+        return None
+    return command, int(page)
+
+
+def invalidate_course_list(using=DEFAULT_DB_ALIAS):
+    caching.bump(LIST_NAMESPACE, using=using)
+
+
+# === 案内ごとのステップ一覧（プロセス内インデックス） ===
+
+ContentItem = namedtuple('ContentItem', 'id order title message_text video_url')
+
+
+class CourseIndex:
+    """1つの案内のステップを order 順に並べたもの"""
+
+    __slots__ = ('course_id', 'title', 'contents', 'orders', 'by_id')
+
+    def __init__(self, course_id, title, contents):
+        self.course_id = course_id
+        self.title = title
+        self.contents = contents
+        self.orders = [c.order for c in contents]
+        self.by_id = {c.id: c for c in contents}
+
+    def next_after(self, order):
+        """order より後の最初のステップ。無ければ None"""
+        i = bisect.bisect_right(self.orders, order)
+        return self.contents[i] if i < len(self.contents) else None
+
+    def completed(self, order):
+        """order までに確認済みのステップ"""
+        return self.contents[:bisect.bisect_right(self.orders, order)]
+
+    def content(self, content_id):
+        return self.by_id.get(content_id)
+
+    @property
+    def last_order(self):
+        return self.orders[-1] if self.orders else 0
+
+
+_index_lock = threading.Lock()
+_course_index = {}
+
+
+def get_course_index(course_id):
+    """案内のインデックスを返す。初回だけDBから読み込み、以降はメモリから"""
+    caching.check()
+    index = _course_index.get(course_id)
+    if index is not None:
+        return index
+
+    title = Course.objects.filter(pk=course_id).values_list('title', flat=True).first()
+    if title is None:
+        return None
+    contents = [
+        ContentItem(*row)
+        for row in CourseContent.objects.filter(course_id=course_id)
+        .order_by('order', 'id')
+        .values_list('id', 'order', 'title', 'message_text', 'video_url')
+    ]
+    index = CourseIndex(course_id, title, contents)
+    with _index_lock:
+        _course_index[course_id] = index
+    return index
+
+
+def invalidate_course_index(course_id=None):
+    """このプロセスのインデックスを捨てる（course_id が None ならすべて）"""
+    with _index_lock:
+        if course_id is None:
+            _course_index.clear()
+        else:
+            _course_index.pop(course_id, None)
+
+
+def course_changed(course_id, using=DEFAULT_DB_ALIAS):
+    """案内・ステップが変わったことを全プロセスに知らせる"""
+    caching.bump(INDEX_VERSION, course_id, using=using)
+
+
+caching.on_change(INDEX_VERSION, lambda part: invalidate_course_index(int(part) if part else None))
+
+
+def resolve_course(politician, ref):
+    """
+    ボタンに埋め込まれた案内の指定（ID）を、自治会に割り当て済みの案内IDに解決する
+    旧形式（タイトル）のボタンも、その自治会の案内の中からだけ探します
+    """
+    courses = assigned_courses(politician)
+    if isinstance(ref, int) or ref.isdigit():
+        course_id = int(ref)
+        for assigned_id, _ in courses:
+            if assigned_id == course_id:
+                return course_id
+    for course_id, title in courses:
+        if title == ref:
+            return course_id
+    return None
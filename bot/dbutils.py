@@ -0,0 +1,22 @@
+"""
+管理コマンドで共通に使うDBまわりの小さな道具
+"""
+from contextlib import contextmanager
+
+from django.db import models
+
+
+@contextmanager
+def keep_timestamps(model):
+    """auto_now / auto_now_add で日時が上書きされないよう、コピー・復元の間だけ外す"""
+    saved = []
+    for field in model._meta.concrete_fields:
+        if isinstance(field, models.DateField) and (field.auto_now or field.auto_now_add):
+            saved.append((field, field.auto_now, field.auto_now_add))
+            field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now = auto_now
+            field.auto_now_add = auto_now_add
@@ -0,0 +1,217 @@
+"""
+遅いリクエストの記録とサンプリングプロファイラ
+- 設定した時間を超えたリクエスト（とキューに積んだ webhook の処理）は、自治会・コマンド・段階ごとの時間・SQLの一覧を
+  1行のJSONでログに出します
+- プロファイラを有効にすると、対象のリクエストの間だけ一定間隔でスタックを採り、
+  flamegraph.pl / speedscope で読める形式（collapsed stacks）で PROFILE_DIR に書き出します
+設定は管理画面の「診断設定」（DiagnosticsSetting）か manage.py diagnostics で変更でき、
+各プロセスは SETTINGS_TTL 秒ごとに読み直すので再起動は不要です。
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger('bot.slow_request')
+
+SETTINGS_TTL = 5
+# ログに載せるSQLの数と長さの上限
+MAX_QUERIES = 100
+MAX_SQL_LENGTH = 500
+
+_lock = threading.Lock()
+_current = {'loaded_at': None, 'setting': None}
+
+
+def current():
+    """診断設定（DiagnosticsSetting）。DBは SETTINGS_TTL 秒に1回だけ読む"""
+    now = time.monotonic()
+    with _lock:
+        if _current['loaded_at'] is not None and now - _current['loaded_at'] < SETTINGS_TTL:
+            return _current['setting']
+    from .models import DiagnosticsSetting
+    try:
+        setting = DiagnosticsSetting.objects.select_related('profile_politician').filter(pk=1).first()
+    except DatabaseError:
+        # DBに問題があっても、記録のためにリクエストを止めない（既定の設定で動く）
+        setting = None
+    if setting is None:
+        setting = DiagnosticsSetting(pk=1)
+    with _lock:
+        _current.update(loaded_at=now, setting=setting)
+    return setting
+
+
+def reload():
+    """次の current() で読み直す（設定を保存したプロセスではすぐに反映する）"""
+    with _lock:
+        _current['loaded_at'] = None
+
+
+def politician_slug(request):
+    """webhook の URL に含まれる自治会のスラグ（それ以外のURLでは None）"""
+    try:
+        return resolve(request.path_info).kwargs.get('politician_slug')
+    except Resolver404:
+        return None
+
+
+def should_profile(setting, slug):
+    if not setting.profile_enabled:
+        return False
+    if setting.profile_politician_id and (setting.profile_politician is None or setting.profile_politician.slug != slug):
+        return False
+    return random.random() * 100 < setting.profile_percent
+
+
+def _frame_name(code):
+    filename = code.co_filename
+    if 'site-packages' in filename:
+        filename = filename.rsplit('site-packages' + os.sep, 1)[-1]
+    elif filename.startswith(str(settings.BASE_DIR)):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    別スレッドから対象スレッドのスタックを interval 秒ごとに採る
+    対象の処理には手を入れないので、プロファイル中の遅れはスタックを採る間のGILの分だけです
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        """flamegraph.pl に渡せる「関数;関数;関数 回数」の行"""
+        return ''.join(f'{stack} {n}\n' for stack, n in self.stacks.most_common())
+
+
+class QueryRecorder:
+    """connection.execute_wrapper() に渡して、SQLと所要時間を記録する"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append({'sql': sql[:MAX_SQL_LENGTH], 'ms': round(elapsed * 1000, 2)})
+
+
+def write_profile(profiler, slug, elapsed):
+    directory = getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+    os.makedirs(directory, exist_ok=True)
+    stamp = timezone.localtime().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(directory, f'{stamp}_{slug or "other"}_{elapsed * 1000:.0f}ms_{threading.get_ident()}.folded')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(profiler.collapsed())
+    return path
+
+
+@contextmanager
+def traced(slug, **fields):
+    """
+    with の中の処理を、遅ければログに出し、対象ならプロファイルする（リクエストとキューの処理で共通）
+    fields はログの先頭に載せる項目。with の中で返された辞書に追加もできる（応答のステータスなど）
+    """
+    setting = current()
+    slow_ms = setting.slow_request_ms
+    profiler = None
+    if should_profile(setting, slug):
+        profiler = SamplingProfiler(interval=getattr(settings, 'PROFILE_INTERVAL_MS', 5) / 1000)
+    if not slow_ms and profiler is None:
+        yield fields
+        return
+
+    queries = QueryRecorder()
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        records = stack.enter_context(metrics.recording())
+        stack.enter_context(connection.execute_wrapper(queries))
+        if profiler is not None:
+            stack.enter_context(profiler)
+        yield fields
+    elapsed = time.perf_counter() - started
+
+    profile_path = write_profile(profiler, slug, elapsed) if profiler is not None else None
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        logger.warning(json.dumps(
+            summarize(fields, slug, elapsed, records, queries, profile_path),
+            ensure_ascii=False,
+        ))
+
+
+class DiagnosticsMiddleware:
+    """遅いリクエストの記録と、対象リクエストのプロファイル"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with traced(politician_slug(request), method=request.method, path=request.path) as fields:
+            response = self.get_response(request)
+            fields['status'] = response.status_code
+        return response
+
+
+def summarize(fields, slug, elapsed, records, queries, profile_path=None):
+    stages = defaultdict(float)
+    commands = []
+    for name, labels, value in records:
+        if name == 'webhook_stage_seconds':
+            stages[labels['stage']] += value
+        elif name == 'webhook_event_seconds':
+            commands.append({'command': labels['command'], 'ms': round(value * 1000, 2)})
+    return {
+        **fields,
+        'politician': slug,
+        'ms': round(elapsed * 1000, 2),
+        'commands': commands,
+        'stages': {stage: round(seconds * 1000, 2) for stage, seconds in sorted(stages.items())},
+        'db': {'count': queries.count, 'ms': round(queries.seconds * 1000, 2)},
+        'queries': queries.queries,
+        'profile': profile_path,
+    }
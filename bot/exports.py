@@ -0,0 +1,126 @@
+"""
+管理者向けのCSV出力
+1行ずつ書き出しながら送るので、件数が多くてもメモリ使用量は一定です。
+  /bot/export/<種類>.csv?politician=<自治会スラグ>&since=2025-04-01&until=2025-04-30
+"""
+import csv
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import DateTimeField, Q
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+
+from members.models import AiMember
+
+from .models import GarbageCalendar, MessageLog, Politician, Region, UserProgress
+
+CHUNK_SIZE = 2000
+
+# name: (モデル, 期間で絞る列, [(見出し, 列)], 自治会で絞る関数)
+Export = namedtuple('Export', 'model date_field columns tenant_filter')
+
+
+def regions_of(politician):
+    codes = set(politician.address_districts.values_list('region_id', flat=True))
+    if politician.gomi_region_id:
+        codes.add(politician.gomi_region_id)
+    q = Q(pk__in=[])
+    for region in Region.objects.filter(code__in=codes):
+        q |= Q(municipality=region.municipality, district=region.district)
+    return q
+
+
+EXPORTS = {
+    'aimember': Export(
+        AiMember, 'created_at',
+        [("LINEユーザーID", 'line_user_id'), ("自治会", 'politician__slug'), ("LINE表示名", 'display_name'), ("氏名", 'real_name'),
+         ("住所", 'address'), ("電話番号", 'phone_number'), ("既存名簿ID", 'existing_member_id'),
+         ("加入承認", 'is_approved'), ("登録ステップ", 'registration_step'), ("登録日時", 'created_at')],
+        lambda politician: Q(politician=politician),
+    ),
+    'userprogress': Export(
+        UserProgress, 'updated_at',
+        [("LINEユーザーID", 'line_user_id'), ("自治会", 'politician__slug'), ("案内", 'current_course__title'),
+         ("確認済みのステップ", 'last_completed_order'), ("更新日時", 'updated_at')],
+        lambda politician: Q(politician=politician),
+    ),
+    'messagelog': Export(
+        MessageLog, 'created_at',
+        [("LINEユーザーID", 'member_id'), ("発言者", 'role'), ("内容", 'text'),
+         ("担当者へ引き継ぎ", 'is_escalated'), ("日時", 'created_at')],
+        lambda politician: Q(member__politician=politician),
+    ),
+    'garbagecalendar': Export(
+        GarbageCalendar, 'collection_date',
+        [("日付", 'collection_date'), ("市町村", 'municipality'), ("地区", 'district'),
+         ("ごみ種別", 'garbage_type'), ("注意事項", 'notes'), ("その他", 'other')],
+        regions_of,
+    ),
+}
+
+
+class Echo:
+    """csv.writer の書き込み先。書いた1行をそのまま返す"""
+
+    def write(self, value):
+        return value
+
+
+def format_value(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+    if value is None:
+        return ''
+    return value
+
+
+def stream_rows(export, queryset):
+    writer = csv.writer(Echo())
+    # Excelで開いても文字化けしないよう、先頭にBOMを付ける
+    yield '\ufeff' + writer.writerow([header for header, _ in export.columns])
+    fields = [field for _, field in export.columns]
+    for row in queryset.values_list(*fields).iterator(chunk_size=CHUNK_SIZE):
+        yield writer.writerow([format_value(v) for v in row])
+
+
+def date_range(export, since, until):
+    """?since= / ?until=（両端含む）を絞り込み条件にする"""
+    q = Q()
+    is_datetime = isinstance(export.model._meta.get_field(export.date_field), DateTimeField)
+    if since:
+        start = timezone.make_aware(datetime.combine(since, time.min)) if is_datetime else since
+        q &= Q(**{f'{export.date_field}__gte': start})
+    if until:
+        if is_datetime:
+            end = timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min))
+            q &= Q(**{f'{export.date_field}__lt': end})
+        else:
+            q &= Q(**{f'{export.date_field}__lte': until})
+    return q
+
+
+@staff_member_required
+def export_csv(request, name):
+    export = EXPORTS.get(name)
+    if export is None:
+        raise Http404
+    try:
+        since = date.fromisoformat(request.GET['since']) if request.GET.get('since') else None
+        until = date.fromisoformat(request.GET['until']) if request.GET.get('until') else None
+    except ValueError:
+        return HttpResponseBadRequest("since / until は YYYY-MM-DD で指定してください")
+
+    queryset = export.model._base_manager.filter(date_range(export, since, until))
+    slug = request.GET.get('politician')
+    if slug:
+        politician = Politician.objects.filter(slug=slug).first()
+        if politician is None:
+            raise Http404
+        queryset = queryset.filter(export.tenant_filter(politician))
+
+    filename = "_".join(part for part in (name, slug, since and since.isoformat(), until and until.isoformat()) if part)
+    response = StreamingHttpResponse(stream_rows(export, queryset.order_by('pk')), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
@@ -0,0 +1,142 @@
+"""
+Flexメッセージのテンプレート
+起動時に一度だけJSON文字列へコンパイルし、リクエストごとは差し込み（文字列の連結）だけで済ませます。
+できあがるのは送信用のJSON文字列なので、そのまま outbound.send_reply() に渡せます。
+"""
+import json
+import re
+
+# LINE Messaging API の上限
+MAX_ALT_TEXT = 400
+MAX_BUBBLE_BYTES = 30 * 1024
+MAX_CAROUSEL_BYTES = 50 * 1024
+MAX_CAROUSEL_BUBBLES = 12
+MAX_MESSAGES = 5
+
+_SLOT_RE = re.compile(r'"\\u0000(\w+)(\\u0001)?\\u0000"')
+
+
+class FlexSizeError(ValueError):
+    """LINEの上限（サイズ・バブル数など）を超えた"""
+
+
+class Slot:
+    """文字列を差し込む場所（JSONエスケープして入ります）"""
+
+    raw = False
+
+    def __init__(self, name):
+        self.name = name
+
+    def marker(self):
+        return f"\x00{self.name}\x00"
+
+
+class RawSlot(Slot):
+    """JSON断片をそのまま差し込む場所（コンポーネントの配列など）"""
+
+    raw = True
+
+    def marker(self):
+        return f"\x00{self.name}\x01\x00"
+
+
+def _replace_slots(node):
+    if isinstance(node, Slot):
+        return node.marker()
+    if isinstance(node, dict):
+        return {k: _replace_slots(v) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_replace_slots(v) for v in node]
+    return node
+
+
+def dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def _byte_len(text):
+    return len(text.encode('utf-8'))
+
+
+def _count_bubbles(contents):
+    if contents.get("type") != "carousel":
+        return 1
+    inner = contents.get("contents")
+    # スロットになっている場合は描画時（join_bubbles）に確認する
+    return len(inner) if isinstance(inner, list) else 0
+
+
+class Template:
+    """
+    名前付きスロットを持つJSONテンプレート
+    render() はキーワード引数でスロットを埋めたJSON文字列を返します
+    """
+
+    def __init__(self, obj):
+        compiled = dumps(_replace_slots(obj))
+        self.parts = []
+        self.slots = []
+        pos = 0
+        for m in _SLOT_RE.finditer(compiled):
+            self.parts.append(compiled[pos:m.start()])
+            self.slots.append((m.group(1), bool(m.group(2))))
+            pos = m.end()
+        self.parts.append(compiled[pos:])
+        self.base_bytes = sum(_byte_len(p) for p in self.parts)
+
+    def render(self, **values):
+        out = [self.parts[0]]
+        for (name, raw), part in zip(self.slots, self.parts[1:]):
+            value = values[name]
+            out.append(value if raw else dumps(value))
+            out.append(part)
+        return "".join(out)
+
+
+class FlexTemplate(Template):
+    """
+    Flexメッセージ1通分のテンプレート
+    コンパイル時にスロットを除いた骨格がLINEの上限に収まるか、描画時に完成品が収まるかを確認します
+    """
+
+    def __init__(self, alt_text, contents):
+        self.limit = MAX_CAROUSEL_BYTES if contents.get("type") == "carousel" else MAX_BUBBLE_BYTES
+        if not isinstance(alt_text, Slot) and len(alt_text) > MAX_ALT_TEXT:
+            raise FlexSizeError(f"altText が {MAX_ALT_TEXT} 文字を超えています")
+        if _count_bubbles(contents) > MAX_CAROUSEL_BUBBLES:
+            raise FlexSizeError(f"カルーセルのバブルは {MAX_CAROUSEL_BUBBLES} 個までです")
+        super().__init__({"type": "flex", "altText": alt_text, "contents": contents})
+        if self.base_bytes > self.limit:
+            raise FlexSizeError(f"テンプレートが {self.limit} バイトを超えています")
+
+    def render(self, **values):
+        text = super().render(**values)
+        if self.slots and _byte_len(text) > self.limit:
+            raise FlexSizeError(f"Flexメッセージが {self.limit} バイトを超えています")
+        return text
+
+
+def join_array(items):
+    """描画済みのJSON断片をJSON配列にする（カルーセルの中身など）"""
+    return "[" + ",".join(items) + "]"
+
+
+def join_bubbles(bubbles):
+    if len(bubbles) > MAX_CAROUSEL_BUBBLES:
+        raise FlexSizeError(f"カルーセルのバブルは {MAX_CAROUSEL_BUBBLES} 個までです")
+    for bubble in bubbles:
+        if _byte_len(bubble) > MAX_BUBBLE_BYTES:
+            raise FlexSizeError(f"バブルが {MAX_BUBBLE_BYTES} バイトを超えています")
+    return join_array(bubbles)
+
+
+def text_message(text):
+    return dumps({"type": "text", "text": text})
+
+
+def messages(*items):
+    """送信用のmessages配列（JSON文字列）を作る"""
+    if len(items) > MAX_MESSAGES:
+        raise FlexSizeError(f"一度に送れるメッセージは {MAX_MESSAGES} 件までです")
+    return join_array(items)
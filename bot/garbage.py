@@ -0,0 +1,102 @@
+"""
+ゴミ収集予定の組み立て
+繰り返しルール（GarbageRule）を指定期間だけ展開し、日付ごとに登録された GarbageCalendar と合わせて返します。
+同じ日・同じ種別が両方にある場合は GarbageCalendar（個別の登録）を優先します。
+"""
+from collections import namedtuple
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from . import caching
+from .models import GarbageCalendar, GarbageRule
+
+RULES_NAMESPACE = "garbage_rules"
+WEEKDAY_CHARS = "月火水木金土日"
+
+ScheduleItem = namedtuple('ScheduleItem', 'collection_date garbage_type notes')
+
+# 展開用にルールを最小限の形にしたもの
+CompiledRule = namedtuple('CompiledRule', 'garbage_type weekdays nth_weeks valid_from valid_until notes skips moves')
+
+
+def parse_weekdays(text):
+    return frozenset(WEEKDAY_CHARS.index(ch) for ch in text if ch in WEEKDAY_CHARS)
+
+
+def parse_nth_weeks(text):
+    return frozenset(int(n) for n in text.replace('・', ',').split(',') if n.strip().isdigit())
+
+
+def compile_rule(rule, exceptions):
+    skips = {}
+    moves = {}
+    for ex in exceptions:
+        skips[ex.date] = ex
+        if ex.replacement_date:
+            moves[ex.replacement_date] = ex.notes
+    return CompiledRule(
+        rule.garbage_type,
+        parse_weekdays(rule.weekdays),
+        parse_nth_weeks(rule.nth_weeks),
+        rule.valid_from,
+        rule.valid_until,
+        rule.notes,
+        frozenset(skips),
+        moves,
+    )
+
+
+def get_rules(municipality, district):
+    """地区のルール（例外日込み）。変更されるまではキャッシュから返す"""
+    key = caching.make_key(RULES_NAMESPACE, municipality, district)
+    rules = cache.get(key)
+    if rules is None:
+        rules = [
+            compile_rule(rule, rule.exceptions.all())
+            for rule in GarbageRule.objects.filter(municipality=municipality, district=district).prefetch_related('exceptions')
+        ]
+        cache.set(key, rules, None)
+    return rules
+
+
+def _matches(rule, day):
+    if day.weekday() not in rule.weekdays:
+        return False
+    if rule.nth_weeks and (day.day - 1) // 7 + 1 not in rule.nth_weeks:
+        return False
+    return True
+
+
+def expand_rule(rule, start, end):
+    """ルールを start〜end（両端含む）の期間で展開する"""
+    day = start
+    while day <= end:
+        in_range = (rule.valid_from is None or day >= rule.valid_from) and (rule.valid_until is None or day <= rule.valid_until)
+        if in_range and day not in rule.skips and _matches(rule, day):
+            yield ScheduleItem(day, rule.garbage_type, rule.notes)
+        if day in rule.moves:
+            yield ScheduleItem(day, rule.garbage_type, rule.moves[day] or rule.notes)
+        day += timedelta(days=1)
+
+
+def get_schedule(municipality, district, start, end):
+    """start〜end の収集予定を日付順に返す"""
+    items = {}
+    for rule in get_rules(municipality, district):
+        for item in expand_rule(rule, start, end):
+            items[(item.collection_date, item.garbage_type)] = item
+
+    explicit = GarbageCalendar.objects.filter(
+        municipality=municipality, district=district,
+        collection_date__gte=start, collection_date__lte=end,
+    ).values_list('collection_date', 'garbage_type', 'notes')
+    for row in explicit:
+        items[(row[0], row[1])] = ScheduleItem(*row)
+
+    return sorted(items.values(), key=lambda item: item.collection_date)
+
+
+def invalidate_rules(using=DEFAULT_DB_ALIAS):
+    caching.bump(RULES_NAMESPACE, using=using)
@@ -0,0 +1,165 @@
+import gzip
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import DateTimeField
+from django.utils import timezone
+
+from bot.dbutils import keep_timestamps
+from bot.models import GarbageCalendar, MessageLog
+
+# 退避の対象: 名前 → (モデル, 古さを判定する日付の列)
+TABLES = {
+    'messagelog': (MessageLog, 'created_at'),
+    'garbagecalendar': (GarbageCalendar, 'collection_date'),
+}
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """日時はマイクロ秒まで残す（DjangoJSONEncoder はミリ秒で切り捨てるため、復元すると値が変わる）"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def as_date(value):
+    if isinstance(value, datetime):
+        return timezone.localdate(value)
+    return value
+
+
+def horizon(model, date_field, days):
+    """これより古い行を退避する境界"""
+    if isinstance(model._meta.get_field(date_field), DateTimeField):
+        return timezone.now() - timedelta(days=days)
+    return timezone.localdate() - timedelta(days=days)
+
+
+def write_archive(directory, model, rows, date_field):
+    """1チャンク分を gzip の JSON Lines で保存する。ファイル名に日付の範囲を入れて、復元時に絞り込めるようにする"""
+    dates = [as_date(row[date_field]) for row in rows]
+    name = f"{min(dates):%Y%m%d}_{max(dates):%Y%m%d}_{rows[0][model._meta.pk.attname]}.jsonl.gz"
+    path = directory / name
+    tmp = path.with_suffix('.tmp')
+    with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, cls=ArchiveEncoder, ensure_ascii=False))
+            f.write('\n')
+    # 書き終えてから名前を付けるので、途中で止まっても壊れたファイルは残らない
+    os.replace(tmp, path)
+    return path
+
+
+def archive_files(directory, since, until):
+    for path in sorted(directory.glob('*.jsonl.gz')):
+        first, last = path.name.split('_')[:2]
+        first = datetime.strptime(first, '%Y%m%d').date()
+        last = datetime.strptime(last, '%Y%m%d').date()
+        if (since and last < since) or (until and first > until):
+            continue
+        yield path
+
+
+class Command(BaseCommand):
+    help = "MessageLog と過去の GarbageCalendar の古い行を、少しずつ圧縮ファイルへ退避して削除します（--restore で期間を指定して戻せます）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', choices=TABLES, action='append', help="対象のテーブル（省略時はすべて）")
+        parser.add_argument('--days', type=int, help="残す日数（省略時は settings.ARCHIVE_RETENTION_DAYS）")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="1回のトランザクションで退避する行数")
+        parser.add_argument('--sleep', type=float, default=0.2, help="チャンクごとの待ち時間（秒）。他の処理にDBを譲るため")
+        parser.add_argument('--max-chunks', type=int, help="この回数で打ち切る（夜間に少しずつ進める場合）")
+        parser.add_argument('--dry-run', action='store_true', help="対象の件数だけ表示する")
+        parser.add_argument('--restore', action='store_true', help="退避したファイルからDBへ戻す")
+        parser.add_argument('--since', type=date.fromisoformat, help="復元する期間の開始日（YYYY-MM-DD）")
+        parser.add_argument('--until', type=date.fromisoformat, help="復元する期間の終了日（YYYY-MM-DD）")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size は1以上を指定してください")
+        root = Path(settings.ARCHIVE_DIR)
+        for name in options['table'] or TABLES:
+            model, date_field = TABLES[name]
+            directory = root / name
+            if options['restore']:
+                self.restore(model, date_field, directory, options['since'], options['until'])
+            else:
+                days = options['days'] if options['days'] is not None else settings.ARCHIVE_RETENTION_DAYS[name]
+                self.archive(name, model, date_field, directory, days, options)
+
+    def archive(self, name, model, date_field, directory, days, options):
+        cutoff = horizon(model, date_field, days)
+        old = model._base_manager.filter(**{f'{date_field}__lt': cutoff})
+        if options['dry_run']:
+            self.stdout.write(f"{name}: {old.count()}件が退避の対象です（{days}日より前）")
+            return
+
+        directory.mkdir(parents=True, exist_ok=True)
+        fields = [f.attname for f in model._meta.concrete_fields]
+        moved = chunks = 0
+        started = time.monotonic()
+        while options['max_chunks'] is None or chunks < options['max_chunks']:
+            # 主キー順に少しずつ取り出し、ファイルに書けたものだけを短いトランザクションで消す
+            rows = list(old.order_by('pk').values(*fields)[:options['chunk_size']])
+            if not rows:
+                break
+            write_archive(directory, model, rows, date_field)
+            pks = [row[model._meta.pk.attname] for row in rows]
+            # delete() なのでシグナル（キャッシュの無効化など）も通る。受け手も参照する行も無ければ1文で消える
+            with transaction.atomic():
+                model._base_manager.filter(pk__in=pks).delete()
+            moved += len(rows)
+            chunks += 1
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"{name}: {moved}件を退避しました（{chunks}チャンク, {elapsed:.1f}秒）"))
+
+    def restore(self, model, date_field, directory, since, until):
+        if not directory.exists():
+            self.stdout.write(f"{model._meta.label}: 退避ファイルがありません")
+            return
+        fields = {f.attname: f for f in model._meta.concrete_fields}
+        restored = skipped = 0
+        for path in archive_files(directory, since, until):
+            objs = []
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    row = {name: fields[name].to_python(value) for name, value in json.loads(line).items()}
+                    day = as_date(row[date_field])
+                    if (since and day < since) or (until and day > until):
+                        continue
+                    objs.append(model(**row))
+            objs, missing = self.drop_orphans(model, objs)
+            skipped += missing
+            # 同じ行がすでにある場合（復元済みなど）はそのままにする
+            with keep_timestamps(model), transaction.atomic():
+                model._base_manager.bulk_create(objs, ignore_conflicts=True)
+            restored += len(objs)
+        message = f"{model._meta.label}: {restored}件を復元しました"
+        if skipped:
+            message += f"（参照先が削除済みの {skipped}件は除外）"
+        self.stdout.write(self.style.SUCCESS(message))
+
+    def drop_orphans(self, model, objs):
+        """参照先（住民など）がもう無い行は戻せないので除く"""
+        total = len(objs)
+        for field in model._meta.concrete_fields:
+            if not field.is_relation or not objs:
+                continue
+            target = field.target_field.name
+            wanted = {getattr(obj, field.attname) for obj in objs} - {None}
+            existing = set(
+                field.related_model._base_manager.filter(**{f'{target}__in': wanted}).values_list(target, flat=True)
+            )
+            objs = [obj for obj in objs if getattr(obj, field.attname) is None or getattr(obj, field.attname) in existing]
+        return objs, total - len(objs)
@@ -0,0 +1,75 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.metrics import percentile
+
+# 新しいプロセスで core.wsgi を読み込み、最初のリクエストを返すまでを計る（IIS の再起動直後と同じ状態）
+CHILD = r'''
+import io, json, os, sys, time
+started = time.perf_counter()
+import core.wsgi
+ready = time.perf_counter() - started
+time.sleep(float(sys.argv[1]))
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': '/metrics', 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost', 'SERVER_PORT': '443', 'HTTP_HOST': 'localhost', 'HTTP_X_FORWARDED_PROTO': 'https',
+    'HTTP_AUTHORIZATION': 'Bearer ' + os.environ['METRICS_TOKEN'],
+    'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'https', 'wsgi.version': (1, 0),
+    'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+}
+statuses = []
+began = time.perf_counter()
+b''.join(core.wsgi.application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+first = time.perf_counter() - began
+began = time.perf_counter()
+import openai
+ai = time.perf_counter() - began
+print(json.dumps({'ready': ready, 'first': first, 'ai': ai, 'status': statuses[0]}))
+'''
+
+COLUMNS = (('ready', "起動"), ('first', "最初の応答"), ('ai', "AIの初回読み込み"))
+
+
+class Command(BaseCommand):
+    help = "新しいプロセスを起動して、最初のリクエストに応答するまでの時間を起動時の読み込み（WARMUP_ON_START）の有無で比較します"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="設定ごとの起動回数")
+        parser.add_argument('--wait', type=float, default=0, help="起動してから最初のリクエストが届くまでの時間（ミリ秒）")
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1 or options['wait'] < 0:
+            raise CommandError("--runs は1以上、--wait は0以上を指定してください")
+        self.stdout.write(f"起動から最初のリクエストまで {options['wait']:.0f}ms / 各 {options['runs']}回の中央値")
+        # 計測用のプロセスが本番のDBに触れないよう、空のDBを渡す（DBを使わない /metrics に送る）
+        with tempfile.TemporaryDirectory(prefix='bench_cold_start_') as workdir:
+            env = {
+                **os.environ,
+                'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings'),
+                'DATABASE_URL': f"sqlite:///{Path(workdir) / 'cold.sqlite3'}",
+                'METRICS_TOKEN': 'bench_cold_start',
+            }
+            for warmup in (False, True):
+                results = [self.run_once({**env, 'WARMUP_ON_START': str(warmup)}, options['wait']) for _ in range(options['runs'])]
+                self.report("読み込みあり" if warmup else "読み込みなし", results)
+
+    def run_once(self, env, wait):
+        proc = subprocess.run(
+            [sys.executable, '-c', CHILD, str(wait / 1000)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise CommandError(f"計測用のプロセスが失敗しました:\n{proc.stderr}")
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    def report(self, label, results):
+        medians = {key: percentile(sorted(r[key] * 1000 for r in results), 50) for key, _ in COLUMNS}
+        cells = "  ".join(f"{title} {medians[key]:7.1f}ms" for key, title in COLUMNS)
+        self.stdout.write(f"{label:<8} {cells}  （応答 {results[0]['status']}）")
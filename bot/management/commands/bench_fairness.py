@@ -0,0 +1,71 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.metrics import percentile
+from bot.scheduler import TenantScheduler
+
+MODES = ('fifo', 'fair')
+
+
+class Command(BaseCommand):
+    help = (
+        "1つの自治会に大量のメッセージが集中している間の、ほかの自治会の待ち時間（p50/p99）を"
+        "1本のキュー（fifo）と自治会ごとのスケジューラ（fair）で比較します（処理は一定時間待つだけの模擬）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'WEBHOOK_WORKERS', 8), help="ワーカーの数")
+        parser.add_argument('--cap', type=int, default=getattr(settings, 'WEBHOOK_TENANT_CONCURRENCY', 4), help="1つの自治会が同時に使えるワーカーの数")
+        parser.add_argument('--burst', type=int, default=500, help="集中した自治会に一度に届くメッセージの数")
+        parser.add_argument('--tenants', type=int, default=5, help="ほかの自治会の数")
+        parser.add_argument('--rate', type=float, default=10, help="ほかの自治会1つあたりの毎秒のメッセージ数")
+        parser.add_argument('--duration', type=float, default=3, help="ほかの自治会がメッセージを送り続ける秒数")
+        parser.add_argument('--work', type=float, default=20, help="1件の処理時間（ミリ秒）")
+        parser.add_argument('--mode', choices=MODES, action='append', help="計測する方式（省略時は両方）")
+
+    def handle(self, *args, **options):
+        if min(options['workers'], options['cap'], options['tenants']) < 1 or options['rate'] <= 0:
+            raise CommandError("--workers / --cap / --tenants / --rate は1以上を指定してください")
+        self.stdout.write(
+            f"ワーカー {options['workers']} / 上限 {options['cap']} / 集中 {options['burst']}件"
+            f" / ほかの自治会 {options['tenants']}×{options['rate']:.0f}件/秒 / 処理 {options['work']:.0f}ms"
+        )
+        for mode in options['mode'] or MODES:
+            self.run_mode(mode, options)
+
+    def run_mode(self, mode, options):
+        fair = mode == 'fair'
+        scheduler = TenantScheduler(options['workers'], options['cap'] if fair else options['workers'], close_connections=False)
+        work = options['work'] / 1000
+        latencies = {'big': [], 'small': []}
+        lock = threading.Lock()
+
+        def job(kind, submitted):
+            def run():
+                time.sleep(work)
+                with lock:
+                    latencies[kind].append(time.monotonic() - submitted)
+            return run
+
+        began = time.monotonic()
+        for _ in range(options['burst']):
+            scheduler.submit('big' if fair else 'all', job('big', time.monotonic()))
+        interval = 1 / (options['rate'] * options['tenants'])
+        i = 0
+        while time.monotonic() - began < options['duration']:
+            tenant = f"small{i % options['tenants']}"
+            scheduler.submit(tenant if fair else 'all', job('small', time.monotonic()))
+            i += 1
+            time.sleep(interval)
+        scheduler.wait_idle()
+        elapsed = time.monotonic() - began
+
+        for kind, label in (('small', "ほかの自治会"), ('big', "集中した自治会")):
+            ms = sorted(v * 1000 for v in latencies[kind])
+            self.stdout.write(
+                f"{mode:<5} {label:<8} {len(ms):>5}件  p50 {percentile(ms, 50):8.1f}ms  p99 {percentile(ms, 99):8.1f}ms"
+            )
+        self.stdout.write(f"{mode:<5} すべて終わるまで {elapsed:.1f}秒")
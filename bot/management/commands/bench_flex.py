@@ -0,0 +1,104 @@
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+from linebot.models import FlexSendMessage
+
+from bot import bubbles, flex, postback
+
+GARBAGE_TYPES = ["可燃ごみ", "プラスチック", "資源ごみ", "不燃ごみ"]
+
+
+def legacy_calendar(days):
+    """従来どおり辞書を組み立てて FlexSendMessage 経由でJSONにする"""
+    contents = []
+    for d in range(days):
+        spans = [
+            {"type": "span", "text": GARBAGE_TYPES[d % 4], "color": "#FF3B30", "weight": "bold"},
+            {"type": "span", "text": "(8時30分まで)", "color": "#888888", "size": "xs"},
+        ]
+        contents.append({
+            "type": "box", "layout": "horizontal", "spacing": "sm", "margin": "md",
+            "contents": [
+                {"type": "text", "text": f"3/{d + 1}(月)", "size": "sm", "weight": "bold", "color": "#555555", "flex": 3},
+                {"type": "text", "contents": spans, "size": "sm", "flex": 5, "wrap": True},
+            ],
+        })
+        contents.append({"type": "separator", "margin": "md"})
+    bubble = {
+        "type": "bubble", "size": "mega",
+        "header": {
+            "type": "box", "layout": "vertical", "backgroundColor": "#1DB446",
+            "contents": [
+                {"type": "text", "text": "📅 ゴミ収集カレンダー", "weight": "bold", "size": "lg", "color": "#FFFFFF"},
+                {"type": "text", "text": "宮崎市 北A地区（直近30日）", "size": "xs", "color": "#E5F7ED", "margin": "sm"},
+            ],
+        },
+        "body": {"type": "box", "layout": "vertical", "spacing": "sm", "contents": contents},
+    }
+    message = FlexSendMessage(alt_text="ゴミ出しカレンダー", contents=bubble)
+    return json.dumps([message.as_json_dict()])
+
+
+def template_calendar(days):
+    rows = []
+    for d in range(days):
+        spans = flex.join_array([
+            bubbles.GARBAGE_SPAN.render(text=GARBAGE_TYPES[d % 4], color="#FF3B30"),
+            bubbles.GARBAGE_NOTE_SPAN.render(text="(8時30分まで)"),
+        ])
+        rows.append(bubbles.GARBAGE_ROW.render(date=f"3/{d + 1}(月)", spans=spans))
+        rows.append(bubbles.GARBAGE_ROW_SEPARATOR)
+    return flex.messages(bubbles.GARBAGE_CALENDAR.render(
+        subtitle="宮崎市 北A地区（直近30日）", rows=flex.join_array(rows),
+    ))
+
+
+def legacy_carousel(count):
+    contents = []
+    for i in range(count):
+        contents.append({
+            "type": "bubble",
+            "body": {"type": "box", "layout": "vertical", "contents": [
+                {"type": "text", "text": "自治会のご案内", "color": "#1DB446", "size": "sm", "weight": "bold"},
+                {"type": "text", "text": f"案内{i}", "weight": "bold", "size": "xl", "margin": "md", "wrap": True},
+            ]},
+            "footer": {"type": "box", "layout": "vertical", "contents": [
+                {"type": "button", "style": "primary", "color": "#1DB446",
+                 "action": {"type": "postback", "label": "確認を始める", "data": postback.course("教材開始", i + 1)}},
+            ]},
+        })
+    message = FlexSendMessage(alt_text="案内一覧", contents={"type": "carousel", "contents": contents})
+    return json.dumps([message.as_json_dict()])
+
+
+def template_carousel(count):
+    items = [bubbles.COURSE_BUBBLE.render(title=f"案内{i}", start_data=postback.course("教材開始", i + 1)) for i in range(count)]
+    return flex.messages(bubbles.COURSE_CAROUSEL.render(bubbles=flex.join_bubbles(items)))
+
+
+class Command(BaseCommand):
+    help = "Flexメッセージの組み立て方式（従来の辞書+SDK / コンパイル済みテンプレート）を比較します"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=2000, help="1ケースあたりの実行回数")
+        parser.add_argument('--days', type=int, default=20, help="カレンダーの行数")
+
+    def handle(self, *args, **options):
+        number = options['number']
+        days = options['days']
+        cases = [
+            (f"カレンダー({days}日)", lambda: legacy_calendar(days), lambda: template_calendar(days)),
+            ("案内カルーセル(12件)", lambda: legacy_carousel(12), lambda: template_carousel(12)),
+        ]
+        for label, legacy, template in cases:
+            # 出力が同じ内容であることを先に確認しておく
+            if json.loads(legacy()) != json.loads(template()):
+                self.stderr.write(self.style.ERROR(f"{label}: 出力が一致しません"))
+                continue
+            legacy_us = min(timeit.repeat(legacy, number=number, repeat=3)) / number * 1e6
+            template_us = min(timeit.repeat(template, number=number, repeat=3)) / number * 1e6
+            self.stdout.write(
+                f"{label}: 従来 {legacy_us:.1f}µs / テンプレート {template_us:.1f}µs "
+                f"（{legacy_us / template_us:.1f}倍）"
+            )
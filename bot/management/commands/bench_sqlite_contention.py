@@ -0,0 +1,130 @@
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from bot.metrics import percentile
+from bot.models import Course, Politician, UserProgress
+from members.models import AiMember
+
+MODES = ('default', 'tuned')
+
+
+def simulate_webhook(alias, politician, course, line_user_id, step):
+    """1回分の書き込み（住民情報の更新と案内の進捗更新）を webhook と同じ順で行う"""
+    with transaction.atomic(using=alias):
+        member = AiMember.objects.using(alias).get(pk=line_user_id)
+        member.display_name = f"住民{step}"
+        member.save(using=alias, update_fields=['display_name'])
+        progress, _ = UserProgress.objects.using(alias).get_or_create(
+            line_user_id=line_user_id,
+            current_course=course,
+            defaults={'politician': politician},
+        )
+        UserProgress.objects.using(alias).filter(pk=progress.pk).update(last_completed_order=step)
+
+
+class Command(BaseCommand):
+    help = "SQLite に同時に書き込む住民を模擬し、ロックエラーの件数と応答時間（p50/p95/p99）を設定ごとに比較します"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--residents', type=int, default=20, help="同時に操作する住民（スレッド）の数")
+        parser.add_argument('--ops', type=int, default=50, help="住民1人あたりの操作回数")
+        parser.add_argument('--think', type=float, default=0.0, help="操作と操作の間の待ち時間（ミリ秒）")
+        parser.add_argument('--mode', choices=MODES, action='append', help="計測する設定（省略時は両方）")
+
+    def handle(self, *args, **options):
+        if options['residents'] < 1 or options['ops'] < 1:
+            raise CommandError("--residents と --ops は1以上を指定してください")
+        # 本番のDBは使わず、一時ディレクトリに作ったDBで計測する
+        workdir = Path(tempfile.mkdtemp(prefix='bench_sqlite_'))
+        try:
+            for mode in options['mode'] or MODES:
+                self.run_mode(mode, workdir / f'{mode}.sqlite3', options)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def run_mode(self, mode, path, options):
+        alias = f'bench_{mode}'
+        config = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(path)}
+        if mode == 'tuned':
+            config['OPTIONS'] = dict(settings.SQLITE_TUNED_OPTIONS)
+        connections.settings[alias] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            alias: config,
+        })[alias]
+        try:
+            call_command('migrate', database=alias, verbosity=0)
+            politician, course, user_ids = self.seed(alias, options['residents'])
+            latencies, locked, elapsed = self.run_residents(alias, politician, course, user_ids, options)
+        finally:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        self.report(mode, latencies, locked, elapsed)
+
+    def seed(self, alias, residents):
+        politician = Politician.objects.using(alias).create(
+            name="計測用自治会", slug="bench", line_channel_secret="-", line_access_token="-",
+        )
+        course = Course.objects.using(alias).create(title="計測用の案内")
+        user_ids = [f"Ubench{i:05d}" for i in range(residents)]
+        AiMember.objects.using(alias).bulk_create([AiMember(line_user_id=uid) for uid in user_ids])
+        return politician, course, user_ids
+
+    def run_residents(self, alias, politician, course, user_ids, options):
+        latencies = []
+        locked = []
+        lock = threading.Lock()
+        start = threading.Barrier(len(user_ids))
+        think = options['think'] / 1000
+
+        def resident(line_user_id):
+            mine = []
+            errors = 0
+            try:
+                start.wait()
+                for step in range(1, options['ops'] + 1):
+                    began = time.perf_counter()
+                    try:
+                        simulate_webhook(alias, politician, course, line_user_id, step)
+                    except OperationalError as e:
+                        if 'locked' not in str(e):
+                            raise
+                        errors += 1
+                    else:
+                        mine.append(time.perf_counter() - began)
+                    if think:
+                        time.sleep(think)
+            finally:
+                connections[alias].close()
+                with lock:
+                    latencies.extend(mine)
+                    locked.append(errors)
+
+        threads = [threading.Thread(target=resident, args=(uid,)) for uid in user_ids]
+        began = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return sorted(latencies), sum(locked), time.perf_counter() - began
+
+    def report(self, mode, latencies, locked, elapsed):
+        total = len(latencies) + locked
+        ms = [v * 1000 for v in latencies]
+        self.stdout.write(self.style.MIGRATE_HEADING(f"[{mode}]"))
+        self.stdout.write(
+            f"  操作 {total}回 / 成功 {len(latencies)} / ロックエラー {locked}（{locked / total:.1%}）"
+            f" / {len(latencies) / elapsed:,.0f}件/秒"
+        )
+        self.stdout.write(
+            f"  応答時間(ms) p50 {percentile(ms, 50):.1f} / p95 {percentile(ms, 95):.1f}"
+            f" / p99 {percentile(ms, 99):.1f} / 最大 {ms[-1] if ms else 0:.1f}"
+        )
@@ -0,0 +1,190 @@
+import logging
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from bot import outbound, postback, scheduler
+from bot.metrics import percentile
+from bot.models import Course, CourseAssignment, CourseContent, GarbageCalendar, Politician, Region
+from bot.testing import FakeLineServer, FakeOpenAIServer, follow_event, post_webhook, postback_event, text_event
+from members.models import AiMember
+
+PATHS = ('calendar', 'course_list', 'course_flow', 'registration', 'ai')
+GARBAGE_TYPES = ("可燃ごみ", "プラスチック", "資源ごみ", "不燃ごみ")
+STEPS = 5
+
+
+class Scenario:
+    """計測用の自治会・住民・案内を用意し、経路ごとに送る webhook の並びを作る"""
+
+    def __init__(self, residents):
+        # 共有キャッシュに前回の住民の状態が残っていても影響しないよう、実行ごとにIDを変える
+        self.run_id = uuid.uuid4().hex[:6]
+        region = Region.objects.create(code=f'bench-{self.run_id}', municipality="計測市", district="中央地区")
+        self.politician = Politician.objects.create(
+            name="計測用自治会", slug=f'bench-{self.run_id}', line_channel_secret='bench-secret',
+            line_access_token='bench-token', openai_api_key='sk-bench', gomi_region=region,
+        )
+        today = timezone.localdate()
+        GarbageCalendar.objects.bulk_create([
+            GarbageCalendar(municipality=region.municipality, district=region.district,
+                            collection_date=today + timedelta(days=d), garbage_type=GARBAGE_TYPES[d % 4])
+            for d in range(31)
+        ])
+        self.course = Course.objects.create(title="防災の案内")
+        CourseAssignment.objects.create(politician=self.politician, course=self.course)
+        self.contents = [
+            CourseContent.objects.create(course=self.course, order=i + 1, title=f"ステップ{i + 1}", message_text="本文")
+            for i in range(STEPS)
+        ]
+        self.residents = [f'U{self.run_id}{i:05d}' for i in range(residents)]
+        AiMember.objects.bulk_create([AiMember(line_user_id=uid, registration_step=3) for uid in self.residents])
+
+    def events(self, path, i):
+        """i 回目に送るイベントの並び（同じ住民のイベントは順に送る）"""
+        uid = self.residents[i % len(self.residents)]
+        if path == 'calendar':
+            return [text_event(uid, "ゴミ出しカレンダー")]
+        if path == 'course_list':
+            return [text_event(uid, "案内一覧")]
+        if path == 'course_flow':
+            content = self.contents[(i // len(self.residents)) % STEPS]
+            return [
+                postback_event(uid, postback.course("教材開始", self.course.pk)),
+                postback_event(uid, postback.course("教材進捗", self.course.pk, content.pk)),
+            ]
+        if path == 'registration':
+            new_uid = f'R{self.run_id}{i:06d}'
+            return [
+                follow_event(new_uid),
+                text_event(new_uid, "こんにちは"),
+                text_event(new_uid, "宮崎 太郎"),
+                text_event(new_uid, "北町1丁目 3班"),
+            ]
+        return [text_event(uid, "明日は何のごみの日ですか？")]
+
+
+class Command(BaseCommand):
+    help = "署名付きの webhook をローカルの LINE・OpenAI の代わりのサーバーに向けて送り、経路ごとの処理件数と p50/p95/p99 を計測します（外部には接続しません）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', choices=PATHS, action='append', help="計測する経路（省略時はすべて）")
+        parser.add_argument('--requests', type=int, default=200, help="経路ごとの回数")
+        parser.add_argument('--concurrency', type=int, default=4, help="同時に送る数")
+        parser.add_argument('--residents', type=int, default=50, help="登録済みの住民の数")
+        parser.add_argument('--warmup', type=int, default=5, help="計測に含めない最初の回数")
+        parser.add_argument('--line-latency', type=float, default=30, help="LINE APIの応答時間（ミリ秒）")
+        parser.add_argument('--openai-latency', type=float, default=800, help="OpenAIの応答時間（ミリ秒）")
+        parser.add_argument('--queue', action='store_true', help="処理を自治会ごとのキュー、返信を送信キュー経由にする（webhookの応答時間に処理・返信を含めない）")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1 or options['residents'] < 1:
+            raise CommandError("--requests / --concurrency / --residents は1以上を指定してください")
+        # 本番のDBには書き込まず、テスト用のDBを作って計測する
+        connection = connections[DEFAULT_DB_ALIAS]
+        with tempfile.TemporaryDirectory(prefix='bench_webhook_') as workdir:
+            if connection.vendor == 'sqlite':
+                connection.settings_dict.setdefault('TEST', {})['NAME'] = str(Path(workdir) / 'bench.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            # 500 になったリクエストのエラーログで結果が埋もれないようにする（件数は集計に出る）
+            logging.disable(logging.ERROR)
+            try:
+                self.run(options)
+            finally:
+                logging.disable(logging.NOTSET)
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        with FakeLineServer(options['line_latency'] / 1000) as line, \
+                FakeOpenAIServer(options['openai_latency'] / 1000) as openai, \
+                override_settings(
+                    LINE_API_ENDPOINT=line.url,
+                    LINE_OUTBOUND_SYNC=not options['queue'],
+                    WEBHOOK_SYNC=not options['queue'],
+                    OPENAI_BASE_URL=f'{openai.url}/v1',
+                    SECURE_SSL_REDIRECT=False,
+                ):
+            scenario = Scenario(options['residents'])
+            self.stdout.write(
+                f"同時 {options['concurrency']} / LINE {options['line_latency']:.0f}ms"
+                f" / OpenAI {options['openai_latency']:.0f}ms / {'キュー経由' if options['queue'] else 'その場で処理・送信'}"
+            )
+            for path in options['path'] or PATHS:
+                self.run_path(path, scenario, options, warmup=True)
+                self.wait_for_queue(options)
+                line.reset()
+                latencies, failures, elapsed = self.run_path(path, scenario, options)
+                self.wait_for_queue(options)
+                failures += sum(1 for messages in line.messages() if is_error_reply(messages))
+                self.report(path, latencies, failures, elapsed)
+
+    def run_path(self, path, scenario, options, warmup=False):
+        jobs = queue.Queue()
+        if warmup:
+            iterations = range(options['requests'], options['requests'] + options['warmup'])
+        else:
+            iterations = range(options['requests'])
+        for i in iterations:
+            jobs.put(scenario.events(path, i))
+        latencies = []
+        failures = defaultdict(int)
+        lock = threading.Lock()
+
+        def worker():
+            # 例外（DBのロックなど）は 500 として数え、計測を続ける
+            client = Client(raise_request_exception=False)
+            mine = []
+            try:
+                while True:
+                    try:
+                        events = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    for event in events:
+                        began = time.perf_counter()
+                        response = post_webhook(client, scenario.politician, event)
+                        mine.append(time.perf_counter() - began)
+                        if response.status_code != 200:
+                            failures[response.status_code] += 1
+            finally:
+                connections.close_all()
+                with lock:
+                    latencies.extend(mine)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        began = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return sorted(latencies), sum(failures.values()), time.perf_counter() - began
+
+    def wait_for_queue(self, options, timeout=30):
+        if not options['queue']:
+            return
+        deadline = time.monotonic() + timeout
+        scheduler.scheduler.wait_idle(timeout)
+        while sum(outbound.registry.depth().values()) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def report(self, path, latencies, failures, elapsed):
+        ms = [v * 1000 for v in latencies]
+        self.stdout.write(
+            f"{path:<13} {len(ms):>5}件  エラー {failures:>3}  {len(ms) / elapsed:>7.1f}件/秒"
+            f"  p50 {percentile(ms, 50):7.1f}ms  p95 {percentile(ms, 95):7.1f}ms  p99 {percentile(ms, 99):7.1f}ms"
+        )
+
+
+def is_error_reply(messages):
+    return any(m.get('type') == 'text' and m.get('text', '').startswith(("エラー:", "AIエラー")) for m in messages)
@@ -0,0 +1,119 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from bot.dbutils import keep_timestamps
+
+SOURCE_ALIAS = 'sqlite_source'
+
+
+def copy_order():
+    """外部キーの参照先から順に並べたモデル（自動生成の多対多テーブルも含む）"""
+    # sort_dependencies は natural_key を持つモデルへの参照しか見ないため、外部キーをたどって並べる
+    ordered = []
+
+    def visit(model, visiting):
+        if model in ordered or model in visiting:
+            return
+        visiting.add(model)
+        for field in model._meta.concrete_fields:
+            if field.is_relation and field.related_model is not model:
+                visit(field.related_model._meta.concrete_model, visiting)
+        ordered.append(model)
+
+    for model in apps.get_models(include_auto_created=True):
+        if model._meta.proxy or not model._meta.managed:
+            continue
+        visit(model, set())
+    return ordered
+
+
+class Command(BaseCommand):
+    help = "既存の SQLite データベースの内容を、現在の DATABASES['default']（PostgreSQL）へ分割してコピーし、件数を照合します"
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="コピー元の db.sqlite3 のパス")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--clear', action='store_true', help="コピー先の既存データ（migrate で作られた contenttypes 等を含む）を先に削除する")
+        parser.add_argument('--verify-only', action='store_true', help="コピーせず件数の照合だけ行う")
+
+    def handle(self, *args, **options):
+        target = connections[DEFAULT_DB_ALIAS]
+        if target.vendor != 'postgresql':
+            raise CommandError("コピー先（DATABASES['default']）が PostgreSQL ではありません。DATABASE_URL を設定してください")
+
+        # コピー元を一時的な接続として登録する（configure_settings は default も必要とする）
+        connections.settings[SOURCE_ALIAS] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            SOURCE_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': options['source']},
+        })[SOURCE_ALIAS]
+
+        ordered = copy_order()
+        if not options['verify_only']:
+            self.prepare_target(ordered, options['clear'])
+            for model in ordered:
+                self.copy_model(model, options['batch_size'])
+            self.reset_sequences(target, ordered)
+
+        if not self.verify(ordered):
+            raise CommandError("件数が一致しないテーブルがあります")
+        self.stdout.write(self.style.SUCCESS("コピーと照合が完了しました"))
+
+    def prepare_target(self, ordered, clear):
+        non_empty = [m._meta.db_table for m in ordered if m._default_manager.using(DEFAULT_DB_ALIAS).exists()]
+        if not non_empty:
+            return
+        if not clear:
+            raise CommandError(
+                "コピー先にデータがあります（" + ", ".join(non_empty) + "）。"
+                "migrate 直後のDBであれば --clear を付けて実行してください"
+            )
+        # migrate 直後の中身（contenttypes 等）を消すだけなので、シグナルを通さず1テーブル1文で消す
+        # （シグナルを通すと、キャッシュの版番号などを消している途中のDBに書き込んでしまう）
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            for model in reversed(ordered):
+                model._base_manager.using(DEFAULT_DB_ALIAS).all()._raw_delete(DEFAULT_DB_ALIAS)
+
+    def copy_model(self, model, batch_size):
+        label = model._meta.label
+        started = time.monotonic()
+        copied = 0
+        source_qs = model._base_manager.using(SOURCE_ALIAS).order_by('pk')
+        with keep_timestamps(model):
+            batch = []
+            for obj in source_qs.iterator(chunk_size=batch_size):
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    copied += self.write_batch(model, batch)
+                    batch = []
+            copied += self.write_batch(model, batch)
+        if copied:
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"  {label}: {copied}件（{elapsed:.1f}秒）")
+
+    def write_batch(self, model, batch):
+        if not batch:
+            return 0
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            model._base_manager.using(DEFAULT_DB_ALIAS).bulk_create(batch)
+        return len(batch)
+
+    def reset_sequences(self, target, ordered):
+        # 明示したIDで挿入したため、自動採番の続きの番号を合わせる
+        statements = target.ops.sequence_reset_sql(no_style(), ordered)
+        with target.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def verify(self, ordered):
+        ok = True
+        for model in ordered:
+            source_count = model._base_manager.using(SOURCE_ALIAS).count()
+            target_count = model._base_manager.using(DEFAULT_DB_ALIAS).count()
+            if source_count != target_count:
+                ok = False
+                self.stderr.write(f"  {model._meta.label}: コピー元 {source_count}件 / コピー先 {target_count}件")
+        return ok
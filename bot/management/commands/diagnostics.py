@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.models import DiagnosticsSetting, Politician
+
+
+class Command(BaseCommand):
+    help = "遅いリクエストの記録・プロファイラの設定を表示・変更します（動いているサーバーにも数秒で反映されます）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slow-ms', type=int, help="遅いリクエストとして記録する時間（ミリ秒）。0で記録しない")
+        parser.add_argument('--profile', choices=('on', 'off'), help="プロファイラを使うかどうか")
+        parser.add_argument('--politician', help="プロファイルする自治会のスラグ（空文字ですべて）")
+        parser.add_argument('--percent', type=int, help="対象のリクエストのうちプロファイルする割合（1〜100）")
+
+    def handle(self, *args, **options):
+        setting, _ = DiagnosticsSetting.objects.get_or_create(pk=1)
+        if options['slow_ms'] is not None:
+            if options['slow_ms'] < 0:
+                raise CommandError("--slow-ms は0以上を指定してください")
+            setting.slow_request_ms = options['slow_ms']
+        if options['profile'] is not None:
+            setting.profile_enabled = options['profile'] == 'on'
+        if options['politician'] is not None:
+            if options['politician']:
+                setting.profile_politician = Politician.objects.filter(slug=options['politician']).first()
+                if setting.profile_politician is None:
+                    raise CommandError(f"自治会 {options['politician']} が見つかりません")
+            else:
+                setting.profile_politician = None
+        if options['percent'] is not None:
+            if not 1 <= options['percent'] <= 100:
+                raise CommandError("--percent は1〜100で指定してください")
+            setting.profile_percent = options['percent']
+        setting.save()
+
+        slow = f"{setting.slow_request_ms}ms 以上" if setting.slow_request_ms else "記録しない"
+        if setting.profile_enabled:
+            target = setting.profile_politician.slug if setting.profile_politician else "すべて"
+            profile = f"対象 {target} の {setting.profile_percent}%"
+        else:
+            profile = "使わない"
+        self.stdout.write(f"遅いリクエスト: {slow} / プロファイラ: {profile}")
@@ -0,0 +1,180 @@
+import csv
+import functools
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from bot.models import GarbageCalendar
+
+# 管理画面のインポート（GarbageCalendarResource）と同じ列名
+COLUMNS = {
+    '日付': 'collection_date',
+    '市町村': 'municipality',
+    '地区': 'district',
+    'ごみ種別': 'garbage_type',
+    '注意事項': 'notes',
+    'notes': 'notes',
+    'その他': 'other',
+}
+REQUIRED = ('collection_date', 'municipality', 'district', 'garbage_type')
+# 既にある行で上書きする項目（ファイルに列がある項目だけ上書きし、無い列の値は残す）
+OPTIONAL = ('notes', 'other')
+UNIQUE_FIELDS = ['municipality', 'district', 'collection_date', 'garbage_type']
+DATE_FORMATS = ('%Y/%m/%d', '%Y-%m-%d', '%Y/%m/%d %H:%M:%S', '%Y-%m-%d %H:%M:%S')
+
+
+class RowError(ValueError):
+    pass
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return _parse_date_text(str(value).strip())
+
+
+# 1年分のカレンダーでも日付の種類は365通りなので、解析結果を使い回す
+@functools.lru_cache(maxsize=4096)
+def _parse_date_text(text):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise RowError(f"日付の形式が不正です: {text}")
+
+
+def iter_csv(path, encoding):
+    with open(path, newline='', encoding=encoding) as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        yield header
+        yield from reader
+
+
+def iter_xlsx(path, sheet):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise CommandError("XLSXの読み込みには openpyxl が必要です（pip install openpyxl）")
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet else wb.worksheets[0]
+        yield from ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def build_row(header_map, values):
+    row = {}
+    for i, field in header_map.items():
+        value = values[i] if i < len(values) else None
+        if isinstance(value, str):
+            value = value.strip()
+        row[field] = value if value not in ('', None) else None
+
+    for field in REQUIRED:
+        if row.get(field) is None:
+            raise RowError(f"{field} が空です")
+    row['collection_date'] = parse_date(row['collection_date'])
+    for field in ('municipality', 'district', 'garbage_type'):
+        row[field] = str(row[field])
+        max_length = GarbageCalendar._meta.get_field(field).max_length
+        if len(row[field]) > max_length:
+            raise RowError(f"{field} が {max_length} 文字を超えています")
+    for field in OPTIONAL:
+        if row.get(field) is not None:
+            row[field] = str(row[field])
+    return row
+
+
+class Command(BaseCommand):
+    help = "ゴミ収集カレンダー（CSV/XLSX）を一括で取り込みます。同じ市町村・地区・日付・種別の行は上書きします"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="CSV または XLSX ファイル")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--encoding', default='utf-8-sig', help="CSVの文字コード（Excelの既定CSVなら cp932）")
+        parser.add_argument('--sheet', help="XLSXのシート名（省略時は先頭のシート）")
+        parser.add_argument('--dry-run', action='store_true', help="検証のみ行い、DBには書き込まない")
+        parser.add_argument('--max-errors', type=int, default=20, help="表示するエラー行の上限")
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        started = time.monotonic()
+        total = written = errors = 0
+
+        for path in options['paths']:
+            path = Path(path)
+            if not path.exists():
+                raise CommandError(f"ファイルが見つかりません: {path}")
+            if path.suffix.lower() in ('.xlsx', '.xlsm'):
+                rows = iter_xlsx(path, options['sheet'])
+            else:
+                rows = iter_csv(path, options['encoding'])
+
+            header = next(rows, None)
+            if header is None:
+                continue
+            header_map = {i: COLUMNS[str(name).strip()] for i, name in enumerate(header) if name and str(name).strip() in COLUMNS}
+            missing = [name for name, field in COLUMNS.items() if field in REQUIRED and field not in header_map.values()]
+            if missing:
+                raise CommandError(f"{path.name}: 必須の列がありません: {', '.join(missing)}")
+            update_fields = [field for field in OPTIONAL if field in header_map.values()]
+
+            batch = {}
+            for line_no, values in enumerate(rows, start=2):
+                if not any(v not in (None, '') for v in values):
+                    continue
+                total += 1
+                try:
+                    row = build_row(header_map, values)
+                except RowError as e:
+                    errors += 1
+                    if errors <= options['max_errors']:
+                        self.stderr.write(f"{path.name}:{line_no}: {e}")
+                    continue
+                # 同じキーがファイル内で重複した場合は後の行を採用する
+                batch[tuple(row[f] for f in UNIQUE_FIELDS)] = row
+                if len(batch) >= options['batch_size']:
+                    written += self.flush(batch, update_fields, options['dry_run'])
+                    batch = {}
+                    self.progress(total, started)
+            written += self.flush(batch, update_fields, options['dry_run'])
+
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed else 0
+        verb = "検証" if options['dry_run'] else "取り込み"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb}完了: {total}行（反映 {written} / エラー {errors}）{elapsed:.1f}秒, {rate:,.0f}行/秒"
+        ))
+
+    def flush(self, batch, update_fields, dry_run):
+        if not batch or dry_run:
+            return len(batch)
+        objs = [GarbageCalendar(**row) for row in batch.values()]
+        with transaction.atomic():
+            if update_fields:
+                GarbageCalendar.objects.bulk_create(
+                    objs,
+                    update_conflicts=True,
+                    unique_fields=UNIQUE_FIELDS,
+                    update_fields=update_fields,
+                )
+            else:
+                # 上書きする列が無いファイルは、新しい行を足すだけ
+                GarbageCalendar.objects.bulk_create(objs, ignore_conflicts=True)
+        return len(objs)
+
+    def progress(self, total, started):
+        if self.verbosity < 2:
+            return
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"  {total}行 処理済み（{total / elapsed:,.0f}行/秒）")
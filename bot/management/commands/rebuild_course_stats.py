@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from bot import course_stats
+
+
+class Command(BaseCommand):
+    help = "案内の進捗集計（CourseProgressStat）を UserProgress から作り直します"
+
+    def handle(self, *args, **options):
+        count = course_stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"進捗集計を作り直しました（{count}行）"))
@@ -0,0 +1,58 @@
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from core.static import COMPRESSIBLE, ENCODINGS, brotli
+
+
+def size_of(path):
+    return os.path.getsize(path) if os.path.isfile(path) else None
+
+
+class Command(BaseCommand):
+    help = "collectstatic で作った静的ファイルについて、圧縮済みの .gz / .br でどれだけ転送量が減るかを表示します"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help="減った量が多い順に表示するファイルの数")
+
+    def handle(self, *args, **options):
+        root = settings.STATIC_ROOT
+        if not root or not os.path.isdir(root):
+            raise CommandError(f"STATIC_ROOT（{root}）がありません。先に manage.py collectstatic を実行してください")
+        # ハッシュ付きの名前があれば、実際に配信されるそちらだけを数える
+        names = sorted(set(getattr(staticfiles_storage, 'hashed_files', {}).values()))
+        if not names:
+            self.stdout.write(self.style.WARNING("ハッシュ付きの名前がありません（collectstatic 前か、別の保存方式です）"))
+            names = sorted(
+                os.path.relpath(os.path.join(d, f), root)
+                for d, _, files in os.walk(root) for f in files if not f.endswith(('.gz', '.br'))
+            )
+
+        total = sent = 0
+        rows = []
+        for name in names:
+            path = os.path.join(root, name)
+            original = size_of(path)
+            if original is None:
+                continue
+            sizes = {encoding: size_of(path + suffix) for encoding, suffix in ENCODINGS}
+            best = min([s for s in sizes.values() if s is not None] or [original])
+            total += original
+            sent += best
+            rows.append((original - best, name, original, sizes))
+
+        saved = total - sent
+        rate = saved / total * 100 if total else 0
+        self.stdout.write(f"{len(rows)}ファイル  元の大きさ {total / 1024:,.0f}KB → 送る大きさ {sent / 1024:,.0f}KB（{saved / 1024:,.0f}KB・{rate:.0f}% 減）")
+        if brotli is None:
+            self.stdout.write("brotli が入っていないため .br は作られていません（gzip のみ）")
+        for diff, name, original, sizes in sorted(rows, reverse=True)[:options['top']]:
+            if not diff:
+                break
+            variants = "  ".join(f"{encoding} {size / 1024:,.1f}KB" for encoding, size in sizes.items() if size is not None)
+            self.stdout.write(f"  {name}  {original / 1024:,.1f}KB → {variants}")
+        compressible = [name for _, name, _, sizes in rows if name.endswith(COMPRESSIBLE)]
+        if compressible and not saved:
+            self.stdout.write(self.style.WARNING("圧縮版が1つもありません。STORAGES の staticfiles を確かめて collectstatic をやり直してください"))
@@ -0,0 +1,163 @@
+"""
+プロセス内で集計する簡易メトリクス
+送信キューなどから呼ばれるため、ロック1つで済む軽い実装にしています
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# レイテンシ用のバケット境界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 件数（SQLの回数など）用のバケット境界
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+# 読み出す時に値を求めるゲージ（名前 → [(ラベル, 値)] を返す関数）
+_gauges = {}
+# recording() の中だけ、このスレッドで記録した値を集める
+_local = threading.local()
+
+
+def _key(name, labels):
+    if not labels:
+        return (name, ())
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    """カウンタを加算する"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, bounds=DEFAULT_BUCKETS, **labels):
+    """ヒストグラムに1件記録する。同じ名前では同じ bounds を使うこと"""
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = {'bounds': bounds, 'buckets': [0] * (len(bounds) + 1), 'sum': 0.0, 'count': 0}
+        h['buckets'][bisect.bisect_left(bounds, value)] += 1
+        h['sum'] += value
+        h['count'] += 1
+    records = getattr(_local, 'records', None)
+    if records is not None:
+        records.append((name, labels, value))
+
+
+def gauge(name, func):
+    """キューの長さなど、その時点の値を表示する時に func() で求める。func は [(ラベルの辞書, 値)] を返す"""
+    with _lock:
+        _gauges[name] = func
+
+
+@contextmanager
+def timer(name, **labels):
+    """with の中の処理時間をヒストグラムに記録する"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+@contextmanager
+def recording():
+    """with の中で同じスレッドが observe() した値を (名前, ラベル, 値) の一覧で返す（遅いリクエストの内訳用）"""
+    records = []
+    _local.records = records
+    try:
+        yield records
+    finally:
+        _local.records = None
+
+
+class QueryCounter:
+    """
+    connection.execute_wrapper() に渡して、SQLの回数と合計時間を数える
+    1リクエストの間だけ付けて使います
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+def snapshot():
+    """現在値のコピーを返す（表示・テスト用）"""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'histograms': {
+                k: {'bounds': v['bounds'], 'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count']}
+                for k, v in _histograms.items()
+            },
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def percentile(sorted_values, p):
+    """昇順に並べた値の p パーセンタイル（ベンチマークの表示用。空なら0）"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[index]
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pairs
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def render_prometheus():
+    """Prometheus のテキスト形式に書き出す"""
+    data = snapshot()
+    lines = []
+    typed = set()
+    with _lock:
+        gauges = sorted(_gauges.items())
+    for name, func in gauges:
+        lines.append(f'# TYPE {name} gauge')
+        typed.add(name)
+        for labels, value in func():
+            lines.append(f'{name}{_labels(sorted(labels.items()))} {value}')
+    for (name, labels), value in sorted(data['counters'].items()):
+        if name not in typed:
+            lines.append(f'# TYPE {name} counter')
+            typed.add(name)
+        lines.append(f'{name}{_labels(labels)} {value}')
+    for (name, labels), h in sorted(data['histograms'].items()):
+        if name not in typed:
+            lines.append(f'# TYPE {name} histogram')
+            typed.add(name)
+        cumulative = 0
+        for bound, n in zip(h['bounds'], h['buckets']):
+            cumulative += n
+            lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {h["count"]}')
+        lines.append(f'{name}_sum{_labels(labels)} {h["sum"]}')
+        lines.append(f'{name}_count{_labels(labels)} {h["count"]}')
+    return '\n'.join(lines) + '\n'
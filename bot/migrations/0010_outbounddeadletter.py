@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_garbagecalendar_delete_garbageschedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundDeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('reply', '応答'), ('push', 'プッシュ')], max_length=10, verbose_name='種別')),
+                ('target', models.CharField(max_length=255, verbose_name='送信先（replyToken / ユーザーID）')),
+                ('payload', models.TextField(verbose_name='メッセージ(JSON)')),
+                ('status_code', models.IntegerField(blank=True, null=True, verbose_name='HTTPステータス')),
+                ('error', models.TextField(blank=True, verbose_name='エラー内容')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='試行回数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='記録日時')),
+                ('politician', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='bot.politician', verbose_name='自治会')),
+            ],
+            options={
+                'verbose_name': '送信失敗メッセージ',
+                'verbose_name_plural': '送信失敗メッセージ一覧',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_outbounddeadletter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GarbageRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('municipality', models.CharField(max_length=50, verbose_name='市町村')),
+                ('district', models.CharField(max_length=50, verbose_name='地区')),
+                ('garbage_type', models.CharField(max_length=100, verbose_name='ゴミ種別')),
+                ('weekdays', models.CharField(help_text='収集する曜日を並べて入力（例：月木）', max_length=7, verbose_name='曜日')),
+                ('nth_weeks', models.CharField(blank=True, help_text='空欄なら毎週。第2・第4なら「2,4」', max_length=20, verbose_name='第n週')),
+                ('valid_from', models.DateField(blank=True, null=True, verbose_name='適用開始日')),
+                ('valid_until', models.DateField(blank=True, null=True, verbose_name='適用終了日')),
+                ('notes', models.TextField(blank=True, null=True, verbose_name='注意事項等')),
+            ],
+            options={
+                'verbose_name': 'ゴミ収集ルール',
+                'verbose_name_plural': 'ゴミ収集ルール',
+                'indexes': [models.Index(fields=['municipality', 'district'], name='bot_garbagerule_area_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='GarbageRuleException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='対象日（休み）')),
+                ('replacement_date', models.DateField(blank=True, help_text='空欄ならその日は収集なし', null=True, verbose_name='振替日')),
+                ('notes', models.TextField(blank=True, null=True, verbose_name='注意事項等')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='bot.garbagerule', verbose_name='収集ルール')),
+            ],
+            options={
+                'verbose_name': '収集ルールの例外日',
+                'verbose_name_plural': '収集ルールの例外日',
+                'ordering': ['date'],
+                'unique_together': {('rule', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# 以前 bot/views.py の REGION_MAP と Politician.GOMI_REGION_CHOICES に書かれていた地区
+INITIAL_REGIONS = [
+    ('miyazaki_kita_a', '宮崎市', '北A地区'),
+    ('miyazaki_kita_b', '宮崎市', '北B地区'),
+    ('miyazaki_minami_a', '宮崎市', '南A地区'),
+    ('miyazaki_minami_b', '宮崎市', '南B地区'),
+]
+
+
+def create_initial_regions(apps, schema_editor):
+    Region = apps.get_model('bot', 'Region')
+    Politician = apps.get_model('bot', 'Politician')
+    db_alias = schema_editor.connection.alias
+    for code, municipality, district in INITIAL_REGIONS:
+        Region.objects.using(db_alias).get_or_create(code=code, defaults={'municipality': municipality, 'district': district})
+    # 外部キーにする前に、登録の無いコードは未設定に戻す
+    codes = [code for code, _, _ in INITIAL_REGIONS]
+    Politician.objects.using(db_alias).exclude(gomi_region__isnull=True).exclude(gomi_region__in=codes).update(gomi_region=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0011_garbagerule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Region',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.SlugField(unique=True, verbose_name='地区コード')),
+                ('municipality', models.CharField(max_length=50, verbose_name='市町村')),
+                ('district', models.CharField(max_length=50, verbose_name='地区')),
+            ],
+            options={
+                'verbose_name': 'ゴミ収集地区',
+                'verbose_name_plural': 'ゴミ収集地区一覧',
+                'ordering': ['municipality', 'district'],
+                'unique_together': {('municipality', 'district')},
+            },
+        ),
+        migrations.RunPython(create_initial_regions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='politician',
+            name='gomi_region',
+            field=models.ForeignKey(blank=True, db_column='gomi_region', null=True, on_delete=django.db.models.deletion.SET_NULL, to='bot.region', to_field='code', verbose_name='ゴミ収集地区グループ'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0012_region'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AddressDistrict',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(help_text='登録住所の先頭がこの文字で始まる住民に適用（例：北町1丁目、3班）', max_length=100, verbose_name='町名・班名')),
+                ('politician', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='address_districts', to='bot.politician', verbose_name='自治会')),
+                ('region', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bot.region', to_field='code', verbose_name='ゴミ収集地区')),
+            ],
+            options={
+                'verbose_name': '住所と収集地区の対応',
+                'verbose_name_plural': '住所と収集地区の対応表',
+                'unique_together': {('politician', 'prefix')},
+            },
+        ),
+    ]
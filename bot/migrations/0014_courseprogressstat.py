@@ -0,0 +1,50 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_initial_stats(apps, schema_editor):
+    UserProgress = apps.get_model('bot', 'UserProgress')
+    CourseProgressStat = apps.get_model('bot', 'CourseProgressStat')
+    db_alias = schema_editor.connection.alias
+    rows = (
+        UserProgress.objects.using(db_alias)
+        .values('politician_id', 'current_course_id', 'last_completed_order')
+        .annotate(residents=models.Count('pk'))
+    )
+    CourseProgressStat.objects.using(db_alias).bulk_create([
+        CourseProgressStat(
+            politician_id=row['politician_id'],
+            course_id=row['current_course_id'],
+            last_completed_order=row['last_completed_order'],
+            residents=row['residents'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0013_addressdistrict'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseProgressStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_completed_order', models.IntegerField(verbose_name='確認済みのステップ（順番）')),
+                ('residents', models.IntegerField(default=0, verbose_name='人数')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress_stats', to='bot.course', verbose_name='案内')),
+                ('politician', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_stats', to='bot.politician', verbose_name='自治会')),
+            ],
+            options={
+                'verbose_name': '案内の進捗集計',
+                'verbose_name_plural': '案内の進捗集計',
+                'unique_together': {('politician', 'course', 'last_completed_order')},
+            },
+        ),
+        migrations.RunPython(build_initial_stats, migrations.RunPython.noop),
+    ]
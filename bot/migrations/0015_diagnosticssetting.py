@@ -0,0 +1,30 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:50
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0014_courseprogressstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagnosticsSetting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slow_request_ms', models.PositiveIntegerField(default=1000, help_text='これより時間のかかったリクエストの内訳（段階ごとの時間・SQL）をログに出します。0なら記録しない', verbose_name='遅いリクエストとして記録する時間（ミリ秒）')),
+                ('profile_enabled', models.BooleanField(default=False, verbose_name='プロファイラを使う')),
+                ('profile_percent', models.PositiveSmallIntegerField(default=100, help_text='対象のリクエストのうち、この割合だけをプロファイルします', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)], verbose_name='プロファイルする割合（%）')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('profile_politician', models.ForeignKey(blank=True, help_text='空欄ならすべてのリクエストが対象', null=True, on_delete=django.db.models.deletion.SET_NULL, to='bot.politician', verbose_name='プロファイルする自治会')),
+            ],
+            options={
+                'verbose_name': '診断設定',
+                'verbose_name_plural': '診断設定',
+            },
+        ),
+    ]
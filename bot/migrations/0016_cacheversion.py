@@ -0,0 +1,26 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0015_diagnosticssetting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='例：regions、course:12', max_length=100, unique=True, verbose_name='対象')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='版')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': 'キャッシュの版',
+                'verbose_name_plural': 'キャッシュの版',
+            },
+        ),
+    ]
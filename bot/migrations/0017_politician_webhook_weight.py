@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:58
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0016_cacheversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='politician',
+            name='webhook_weight',
+            field=models.PositiveSmallIntegerField(default=1, help_text='メッセージが集中した時、他の自治会と比べて何倍ずつ処理するか（通常は1）', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(10)], verbose_name='処理の重み'),
+        ),
+    ]
@@ -1,5 +1,21 @@
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 
+# ゴミ収集の地区（市町村＋地区）。市町村・地区の文字は GarbageCalendar と完全に一致させる必要があります
+class Region(models.Model):
+    code = models.SlugField("地区コード", max_length=50, unique=True)
+    municipality = models.CharField("市町村", max_length=50)
+    district = models.CharField("地区", max_length=50)
+
+    class Meta:
+        verbose_name = "ゴミ収集地区"
+        verbose_name_plural = "ゴミ収集地区一覧"
+        unique_together = ('municipality', 'district')
+        ordering = ['municipality', 'district']
+
+    def __str__(self):
+        return f"{self.municipality}：{self.district}"
+
 class Politician(models.Model):
     name = models.CharField("自治会名", max_length=100)
     slug = models.SlugField("スラグ（URL用）", unique=True)
@@ -10,14 +26,22 @@ class Politician(models.Model):
     ai_model_name = models.CharField(max_length=50, default="gpt-4o")
     system_prompt = models.TextField(blank=True, null=True)
     
-    # ゴミ収集地区グループ
-    GOMI_REGION_CHOICES = [
-        ('miyazaki_kita_a', '宮崎市：北A地区'),
-        ('miyazaki_kita_b', '宮崎市：北B地区'),
-        ('miyazaki_minami_a', '宮崎市：南A地区'),
-        ('miyazaki_minami_b', '宮崎市：南B地区'),
-    ]
-    gomi_region = models.CharField("ゴミ収集地区グループ", max_length=50, choices=GOMI_REGION_CHOICES, blank=True, null=True)
+    # ゴミ収集地区グループ（Region.code で参照。DB上の列は従来どおり gomi_region）
+    gomi_region = models.ForeignKey(
+        'Region',
+        to_field='code',
+        db_column='gomi_region',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        verbose_name="ゴミ収集地区グループ",
+    )
+
+    # webhook の処理の順番（bot/scheduler.py）。2なら他の自治会の2倍ずつ続けて処理する
+    webhook_weight = models.PositiveSmallIntegerField(
+        "処理の重み", default=1, validators=[MinValueValidator(1), MaxValueValidator(10)],
+        help_text="メッセージが集中した時、他の自治会と比べて何倍ずつ処理するか（通常は1）"
+    )
 
     # 中間テーブル経由の多対多関係
     courses = models.ManyToManyField('Course', through='CourseAssignment', blank=True)
@@ -29,6 +53,21 @@ class Politician(models.Model):
         verbose_name = "自治会"
         verbose_name_plural = "自治会一覧"    
 
+# 住所（町名・班名）の先頭一致で住民ごとのゴミ収集地区を決める対応表
+# 1つの自治会が複数の収集地区にまたがる場合に使います（bot/addresses.py）
+class AddressDistrict(models.Model):
+    politician = models.ForeignKey(Politician, on_delete=models.CASCADE, related_name='address_districts', verbose_name="自治会")
+    prefix = models.CharField("町名・班名", max_length=100, help_text="登録住所の先頭がこの文字で始まる住民に適用（例：北町1丁目、3班）")
+    region = models.ForeignKey(Region, to_field='code', on_delete=models.CASCADE, verbose_name="ゴミ収集地区")
+
+    class Meta:
+        verbose_name = "住所と収集地区の対応"
+        verbose_name_plural = "住所と収集地区の対応表"
+        unique_together = ('politician', 'prefix')
+
+    def __str__(self):
+        return f"{self.prefix} → {self.region_id}"
+
 class Course(models.Model):
     # politicianとの直接の紐付け（ForeignKey）を削除
     title = models.CharField("案内タイトル", max_length=200)
@@ -84,6 +123,19 @@ class UserProgress(models.Model):
     class Meta:
         unique_together = ('line_user_id', 'current_course')
 
+# 案内ごとの進捗の分布（自治会×案内×どのステップまで確認したか → 人数）
+# UserProgress を数え直さずに「何人が最後まで確認したか」を出すための集計です（bot/course_stats.py）
+class CourseProgressStat(models.Model):
+    politician = models.ForeignKey(Politician, on_delete=models.CASCADE, related_name='course_stats', verbose_name="自治会")
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='progress_stats', verbose_name="案内")
+    last_completed_order = models.IntegerField("確認済みのステップ（順番）")
+    residents = models.IntegerField("人数", default=0)
+
+    class Meta:
+        verbose_name = "案内の進捗集計"
+        verbose_name_plural = "案内の進捗集計"
+        unique_together = ('politician', 'course', 'last_completed_order')
+
 class MessageLog(models.Model):
     member = models.ForeignKey('members.AiMember', on_delete=models.CASCADE)
     role = models.CharField(max_length=10)
@@ -107,4 +159,114 @@ class GarbageCalendar(models.Model):
         ordering = ['collection_date']
 
     def __str__(self):
-        return f"【{self.municipality} {self.district}】{self.collection_date.strftime('%Y/%m/%d')} : {self.garbage_type}"
\ No newline at end of file
+        return f"【{self.municipality} {self.district}】{self.collection_date.strftime('%Y/%m/%d')} : {self.garbage_type}"
+
+# LINE送信キューで送れなかったメッセージの記録
+class OutboundDeadLetter(models.Model):
+    KIND_CHOICES = [
+        ('reply', '応答'),
+        ('push', 'プッシュ'),
+    ]
+    politician = models.ForeignKey(Politician, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="自治会")
+    kind = models.CharField("種別", max_length=10, choices=KIND_CHOICES)
+    target = models.CharField("送信先（replyToken / ユーザーID）", max_length=255)
+    payload = models.TextField("メッセージ(JSON)")
+    status_code = models.IntegerField("HTTPステータス", null=True, blank=True)
+    error = models.TextField("エラー内容", blank=True)
+    attempts = models.PositiveIntegerField("試行回数", default=0)
+    created_at = models.DateTimeField("記録日時", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "送信失敗メッセージ"
+        verbose_name_plural = "送信失敗メッセージ一覧"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.status_code} ({self.created_at:%Y/%m/%d %H:%M})"
+
+
+# 「毎週月・木 可燃」「第2・第4水曜 資源」のような繰り返しの収集ルール
+# 日付ごとの行（GarbageCalendar）を持たず、表示の時にその期間だけ展開します（bot/garbage.py）
+class GarbageRule(models.Model):
+    municipality = models.CharField(max_length=50, verbose_name="市町村")
+    district = models.CharField(max_length=50, verbose_name="地区")
+    garbage_type = models.CharField(max_length=100, verbose_name="ゴミ種別")
+    weekdays = models.CharField(
+        "曜日", max_length=7,
+        help_text="収集する曜日を並べて入力（例：月木）"
+    )
+    nth_weeks = models.CharField(
+        "第n週", max_length=20, blank=True,
+        help_text="空欄なら毎週。第2・第4なら「2,4」"
+    )
+    valid_from = models.DateField("適用開始日", blank=True, null=True)
+    valid_until = models.DateField("適用終了日", blank=True, null=True)
+    notes = models.TextField(blank=True, null=True, verbose_name="注意事項等")
+
+    class Meta:
+        verbose_name = "ゴミ収集ルール"
+        verbose_name_plural = "ゴミ収集ルール"
+        indexes = [
+            models.Index(fields=['municipality', 'district'], name='bot_garbagerule_area_idx'),
+        ]
+
+    def __str__(self):
+        nth = f"第{self.nth_weeks.replace(',', '・')}" if self.nth_weeks else "毎週"
+        return f"【{self.municipality} {self.district}】{nth}{self.weekdays} : {self.garbage_type}"
+
+
+# 祝日・年末年始などで収集日が休み・振替になる日
+class GarbageRuleException(models.Model):
+    rule = models.ForeignKey(GarbageRule, related_name='exceptions', on_delete=models.CASCADE, verbose_name="収集ルール")
+    date = models.DateField("対象日（休み）")
+    replacement_date = models.DateField("振替日", blank=True, null=True, help_text="空欄ならその日は収集なし")
+    notes = models.TextField(blank=True, null=True, verbose_name="注意事項等")
+
+    class Meta:
+        verbose_name = "収集ルールの例外日"
+        verbose_name_plural = "収集ルールの例外日"
+        unique_together = ('rule', 'date')
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.rule} {self.date.strftime('%Y/%m/%d')}"
+
+
+# 遅いリクエストの記録とプロファイラの切り替え（1行だけ使います。変更は数秒で全プロセスに反映 bot/diagnostics.py）
+class DiagnosticsSetting(models.Model):
+    slow_request_ms = models.PositiveIntegerField(
+        "遅いリクエストとして記録する時間（ミリ秒）", default=1000,
+        help_text="これより時間のかかったリクエストの内訳（段階ごとの時間・SQL）をログに出します。0なら記録しない"
+    )
+    profile_enabled = models.BooleanField("プロファイラを使う", default=False)
+    profile_politician = models.ForeignKey(
+        Politician, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="プロファイルする自治会",
+        help_text="空欄ならすべてのリクエストが対象"
+    )
+    profile_percent = models.PositiveSmallIntegerField(
+        "プロファイルする割合（%）", default=100,
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        help_text="対象のリクエストのうち、この割合だけをプロファイルします"
+    )
+    updated_at = models.DateTimeField("更新日時", auto_now=True)
+
+    class Meta:
+        verbose_name = "診断設定"
+        verbose_name_plural = "診断設定"
+
+    def __str__(self):
+        return "診断設定"
+
+
+# キャッシュの版番号。管理画面などで変更があると上がり、各プロセスはこれを見て手元のキャッシュを捨てます（bot/caching.py）
+class CacheVersion(models.Model):
+    name = models.CharField("対象", max_length=100, unique=True, help_text="例：regions、course:12")
+    version = models.PositiveBigIntegerField("版", default=0)
+    updated_at = models.DateTimeField("更新日時", auto_now=True)
+
+    class Meta:
+        verbose_name = "キャッシュの版"
+        verbose_name_plural = "キャッシュの版"
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
@@ -0,0 +1,318 @@
+"""
+LINEへの送信キュー
+チャネル（アクセストークン）ごとにワーカーを分け、トークンバケットで送信ペースを守ります。
+プッシュの 429 / 5xx は時間を置いて再送し、諦めたものは OutboundDeadLetter に記録します。
+返信（reply）は返信トークンが1回限り・有効期限も短いため再送せず、fallback_to があればプッシュに切り替えて届けます。
+"""
+import heapq
+import itertools
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from linebot.exceptions import LineBotApiError
+from linebot.http_client import RequestsHttpClient
+from linebot.models import Error
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINT = 'https://api.line.me'
+REPLY_PATH = '/v2/bot/message/reply'
+PUSH_PATH = '/v2/bot/message/push'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class TokenBucket:
+    """1秒あたり rate 件、最大 capacity 件まで溜められるトークンバケット"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def wait_time(self):
+        """1件送るまでに待つべき秒数（0なら即送信可）"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class LineClient:
+    """LINE の送信APIに、組み立て済みのJSONをそのまま送るだけの薄いクライアント"""
+
+    def __init__(self, access_token, endpoint=''):
+        self.endpoint = endpoint or DEFAULT_ENDPOINT
+        self.headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
+        self.http_client = RequestsHttpClient(timeout=_setting('LINE_OUTBOUND_TIMEOUT', 5))
+
+    def post(self, path, body):
+        response = self.http_client.post(self.endpoint + path, headers=dict(self.headers), data=body)
+        if 200 <= response.status_code < 300:
+            return
+        try:
+            error = Error.new_from_json_dict(response.json)
+        except ValueError:
+            error = Error(message=response.text[:200])
+        raise LineBotApiError(
+            status_code=response.status_code,
+            headers=dict(response.headers.items()),
+            request_id=response.headers.get('X-Line-Request-Id'),
+            error=error,
+        )
+
+
+class OutboundJob:
+    __slots__ = ('politician_id', 'kind', 'target', 'messages_json', 'fallback_to', 'attempts', 'enqueued_at')
+
+    def __init__(self, politician_id, kind, target, messages_json, fallback_to=None):
+        self.politician_id = politician_id
+        self.kind = kind
+        self.target = target
+        self.messages_json = messages_json
+        # 返信に失敗した時にプッシュで送る相手（LINEユーザーID）
+        self.fallback_to = fallback_to
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+    def body(self):
+        key = 'replyToken' if self.kind == 'reply' else 'to'
+        return '{"%s":%s,"messages":%s}' % (key, json.dumps(self.target), self.messages_json)
+
+    def path(self):
+        return REPLY_PATH if self.kind == 'reply' else PUSH_PATH
+
+
+def serialize_messages(messages):
+    """SDKのSendMessage（またはそのリスト）を送信用JSON文字列にする"""
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    return json.dumps([m.as_json_dict() for m in messages], ensure_ascii=False)
+
+
+def is_retryable(job, error):
+    # 返信トークンは使い捨てなので、返信は再送しない
+    if job.kind == 'reply':
+        return False
+    status_code = getattr(error, 'status_code', None)
+    # 通信エラー（ステータスなし）も一時的な失敗として扱う
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+def push_fallback(job, error):
+    """
+    失敗した返信を、同じ内容のプッシュに切り替える（fallback_to が無ければ None）
+    通信エラーでは LINE 側に届いている可能性があるので、二重に送らないよう切り替えない
+    """
+    if job.kind != 'reply' or not job.fallback_to or getattr(error, 'status_code', None) is None:
+        return None
+    metrics.inc('line_outbound_fallbacks_total')
+    return OutboundJob(job.politician_id, 'push', job.fallback_to, job.messages_json)
+
+
+def backoff_delay(attempts, error=None):
+    """再送までの待ち時間。Retry-After があればそれを優先する"""
+    if getattr(error, 'headers', None):
+        retry_after = error.headers.get('Retry-After') or error.headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    base = _setting('LINE_OUTBOUND_BACKOFF_BASE', 0.5)
+    cap = _setting('LINE_OUTBOUND_BACKOFF_MAX', 30.0)
+    delay = min(cap, base * (2 ** (attempts - 1)))
+    return delay * (0.5 + random.random() / 2)
+
+
+def deliver(client, job):
+    """1件送信する。成功で None、失敗でその例外を返す"""
+    job.attempts += 1
+    started = time.monotonic()
+    try:
+        client.post(job.path(), job.body().encode('utf-8'))
+    except LineBotApiError as e:
+        metrics.inc('line_outbound_errors_total', kind=job.kind, status=str(e.status_code))
+        return e
+    except Exception as e:
+        metrics.inc('line_outbound_errors_total', kind=job.kind, status='network')
+        return e
+    finally:
+        # 失敗した時（タイムアウトを含む）の待ち時間も記録する
+        metrics.observe('line_api_seconds', time.monotonic() - started, kind=job.kind)
+    metrics.observe('line_outbound_queue_seconds', time.monotonic() - job.enqueued_at, kind=job.kind)
+    metrics.inc('line_outbound_sent_total', kind=job.kind)
+    return None
+
+
+def dead_letter(job, error):
+    # 循環importを避けるためここで読み込む
+    from .models import OutboundDeadLetter
+
+    metrics.inc('line_outbound_dead_letters_total', kind=job.kind)
+    status_code = getattr(error, 'status_code', None)
+    message = getattr(getattr(error, 'error', None), 'message', None) or str(error)
+    try:
+        # ワーカースレッドは長生きなので、切れた接続を掴んだままにしない
+        close_old_connections()
+        OutboundDeadLetter.objects.create(
+            politician_id=job.politician_id,
+            kind=job.kind,
+            target=job.target,
+            payload=job.messages_json,
+            status_code=status_code,
+            error=message[:1000],
+            attempts=job.attempts,
+        )
+    except Exception:
+        logger.exception("デッドレターの保存に失敗しました (politician=%s)", job.politician_id)
+
+
+class ChannelWorker(threading.Thread):
+    """1チャネル分の送信を担当するスレッド。他チャネルの待ちには影響されない"""
+
+    def __init__(self, access_token, registry):
+        super().__init__(daemon=True, name='line-outbound')
+        self.access_token = access_token
+        self.registry = registry
+        self.queue = queue.Queue()
+        self.retries = []
+        self._seq = itertools.count()
+        self.client = registry.client(access_token)
+        self.bucket = TokenBucket(
+            _setting('LINE_OUTBOUND_RATE', 100),
+            _setting('LINE_OUTBOUND_BURST', 20),
+        )
+
+    def _next_job(self, idle_timeout):
+        if self.retries:
+            due, _, job = self.retries[0]
+            wait = due - time.monotonic()
+            if wait <= 0:
+                heapq.heappop(self.retries)
+                return job
+            try:
+                return self.queue.get(timeout=wait)
+            except queue.Empty:
+                heapq.heappop(self.retries)
+                return job
+        return self.queue.get(timeout=idle_timeout)
+
+    def run(self):
+        idle_timeout = _setting('LINE_OUTBOUND_IDLE_SECONDS', 300)
+        max_attempts = _setting('LINE_OUTBOUND_MAX_ATTEMPTS', 5)
+        while True:
+            try:
+                job = self._next_job(idle_timeout)
+            except queue.Empty:
+                if self.registry.retire(self):
+                    return
+                continue
+
+            wait = self.bucket.wait_time()
+            if wait > 0:
+                metrics.inc('line_outbound_throttled_total')
+                time.sleep(wait)
+                self.bucket.wait_time()
+            self.bucket.take()
+
+            error = deliver(self.client, job)
+            if error is None:
+                continue
+            push = push_fallback(job, error)
+            if push is not None:
+                self.schedule(push, backoff_delay(1, error))
+            elif is_retryable(job, error) and job.attempts < max_attempts:
+                metrics.inc('line_outbound_retries_total', kind=job.kind)
+                self.schedule(job, backoff_delay(job.attempts, error))
+            else:
+                dead_letter(job, error)
+
+    def schedule(self, job, delay):
+        heapq.heappush(self.retries, (time.monotonic() + delay, next(self._seq), job))
+
+
+class OutboundRegistry:
+    """アクセストークン → ChannelWorker の対応表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._workers = {}
+
+    def client(self, access_token):
+        return LineClient(access_token, _setting('LINE_API_ENDPOINT', ''))
+
+    def submit(self, access_token, job):
+        with self._lock:
+            worker = self._workers.get(access_token)
+            if worker is None:
+                worker = self._workers[access_token] = ChannelWorker(access_token, self)
+                worker.start()
+            worker.queue.put(job)
+        metrics.inc('line_outbound_enqueued_total', kind=job.kind)
+
+    def retire(self, worker):
+        """暇になったワーカーを片付ける。キューが空の時だけ True"""
+        with self._lock:
+            if not worker.queue.empty() or worker.retries:
+                return False
+            if self._workers.get(worker.access_token) is worker:
+                del self._workers[worker.access_token]
+            return True
+
+    def depth(self):
+        with self._lock:
+            return {token[-6:]: w.queue.qsize() + len(w.retries) for token, w in self._workers.items()}
+
+
+registry = OutboundRegistry()
+
+
+def _send(politician, kind, target, messages, fallback_to=None):
+    if isinstance(messages, str):
+        messages_json = messages
+    else:
+        messages_json = serialize_messages(messages)
+    job = OutboundJob(politician.pk, kind, target, messages_json, fallback_to)
+
+    # テストやベンチマーク用：その場で送信する（再送はしない）
+    if _setting('LINE_OUTBOUND_SYNC', False):
+        client = registry.client(politician.line_access_token)
+        error = deliver(client, job)
+        push = error and push_fallback(job, error)
+        if push is not None:
+            job, error = push, deliver(client, push)
+        if error is not None:
+            dead_letter(job, error)
+        return
+
+    registry.submit(politician.line_access_token, job)
+
+
+def send_reply(politician, reply_token, messages, fallback_to=None):
+    """
+    応答メッセージをキューに積む（Webhook内からはこれを使う）
+    必ず届けたいものは fallback_to に住民のLINEユーザーIDを渡すと、返信に失敗した時にプッシュで送る
+    """
+    _send(politician, 'reply', reply_token, messages, fallback_to)
+
+
+def send_push(politician, to, messages):
+    """プッシュメッセージをキューに積む"""
+    _send(politician, 'push', to, messages)
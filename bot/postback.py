@@ -0,0 +1,46 @@
+"""
+ボタンのpostbackデータ
+「c1:<操作>:<ID>...」の短い形式で、先頭の c1 が形式のバージョンです。
+形式を変えるときはバージョンを上げ、古いボタンも decode() で読めるようにしてください。
+"""
+
+VERSION = "c1"
+
+# 操作コード → 案内の操作名（views の course_action に渡す名前）
+COURSE_ACTIONS = {
+    "s": "教材開始",
+    "n": "教材次へ",
+    "p": "教材進捗",
+    "e": "教材終了",
+    "r": "教材復習",
+}
+LIST_PAGE = "l"
+
+_CODES = {name: code for code, name in COURSE_ACTIONS.items()}
+
+
+def encode(code, *ids):
+    return ":".join([VERSION, code] + [str(i) for i in ids])
+
+
+def course(action, course_id, content_id=None):
+    """案内の操作ボタン用。action は「教材開始」などの操作名"""
+    if content_id is None:
+        return encode(_CODES[action], course_id)
+    return encode(_CODES[action], course_id, content_id)
+
+
+def list_page(page):
+    return encode(LIST_PAGE, page)
+
+
+def decode(data):
+    """(操作コード, [ID...]) を返す。読めないデータは None"""
+    parts = data.split(":")
+    if len(parts) < 3 or parts[0] != VERSION:
+        return None
+    try:
+        ids = [int(p) for p in parts[2:]]
+    except ValueError:
+        return None
+    return parts[1], ids
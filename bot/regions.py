@@ -0,0 +1,48 @@
+"""
+ゴミ収集地区のプロセス内インデックス
+Region の全件を「コード → (市町村, 地区)」の辞書で持ち、メッセージごとのDB問い合わせをなくします。
+初回の参照時に読み込み、Region が変更されたら（ほかのプロセスでの変更も bot/caching.py 経由で）作り直します。
+"""
+import threading
+
+from django.db import DEFAULT_DB_ALIAS
+
+from . import caching
+from .models import Region
+
+VERSION = "regions"
+
+_lock = threading.Lock()
+_index = None
+
+
+def _load():
+    return {code: (municipality, district) for code, municipality, district in Region.objects.values_list('code', 'municipality', 'district')}
+
+
+def lookup(code):
+    """地区コードから (市町村, 地区) を返す。未登録・未設定なら None"""
+    global _index
+    if not code:
+        return None
+    caching.check()
+    index = _index
+    if index is None:
+        with _lock:
+            if _index is None:
+                _index = _load()
+            index = _index
+    return index.get(code)
+
+
+def _drop(part=None):
+    global _index
+    with _lock:
+        _index = None
+
+
+def invalidate(using=DEFAULT_DB_ALIAS):
+    caching.bump(VERSION, using=using)
+
+
+caching.on_change(VERSION, _drop)
@@ -0,0 +1,174 @@
+"""
+webhook の処理を自治会ごとに順番に回すスケジューラ
+署名を確かめた webhook は自治会ごとのキューに積んですぐ 200 を返し、決まった数のワーカーが
+自治会を順番に（重みの分だけ続けて）取り出して処理します。1つの自治会が同時に使えるワーカーは
+WEBHOOK_TENANT_CONCURRENCY までなので、一斉配信で大量のメッセージが届いた自治会があっても、
+ほかの自治会の返信は待たされません。同じ住民（keys）の処理は同時に動かさず、届いた順に1件ずつ処理します。
+WEBHOOK_SYNC=True ならキューを使わずその場で処理します（テスト・計測用）。
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import diagnostics, metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class TenantQueue:
+    __slots__ = ('name', 'jobs', 'running', 'busy', 'weight', 'credit')
+
+    def __init__(self, name):
+        self.name = name
+        self.jobs = deque()
+        self.running = 0
+        # 処理中の住民（keys）
+        self.busy = set()
+        self.weight = 1
+        self.credit = 0
+
+    def take(self):
+        """
+        処理中の住民を含まない、いちばん古い処理を取り出す。無ければ None
+        先に積まれて待っている処理と同じ住民の処理も追い越さない
+        """
+        waiting = set()
+        for i, job in enumerate(self.jobs):
+            keys = job[2]
+            if self.busy.isdisjoint(keys) and waiting.isdisjoint(keys):
+                del self.jobs[i]
+                return job
+            waiting.update(keys)
+        return None
+
+
+class TenantScheduler:
+    """
+    自治会ごとのキューを重み付きラウンドロビンで回す
+    workers: ワーカースレッドの数、tenant_concurrency: 1つの自治会が同時に使えるワーカーの数
+    """
+
+    def __init__(self, workers, tenant_concurrency, close_connections=True):
+        self.workers = workers
+        self.tenant_concurrency = tenant_concurrency
+        self.close_connections = close_connections
+        self._cond = threading.Condition()
+        self._tenants = {}
+        # 処理待ちがある自治会の順番（先頭から取り出す）
+        self._ring = deque()
+        self._threads = []
+
+    def submit(self, tenant, func, weight=1, keys=()):
+        """tenant のキューに func を積む。keys（住民のID）が重なる処理は、積んだ順に1件ずつ動かす"""
+        with self._cond:
+            queue = self._tenants.get(tenant)
+            if queue is None:
+                queue = self._tenants[tenant] = TenantQueue(tenant)
+            queue.weight = max(1, weight)
+            if not queue.jobs:
+                self._ring.append(queue)
+            queue.jobs.append((func, time.monotonic(), frozenset(keys)))
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, daemon=True, name='webhook-worker')
+                self._threads.append(thread)
+                thread.start()
+            self._cond.notify()
+        metrics.inc('webhook_jobs_enqueued_total', politician=tenant)
+
+    def _pick(self):
+        """次に処理する (自治会のキュー, 関数, 積んだ時刻, 住民)。上限・処理中の住民で取り出せなければ None"""
+        for _ in range(len(self._ring)):
+            queue = self._ring[0]
+            job = queue.take() if queue.running < self.tenant_concurrency else None
+            if job is None:
+                self._ring.rotate(-1)
+                continue
+            if queue.credit <= 0:
+                queue.credit = queue.weight
+            queue.credit -= 1
+            func, enqueued_at, keys = job
+            queue.running += 1
+            queue.busy.update(keys)
+            if not queue.jobs:
+                self._ring.popleft()
+                queue.credit = 0
+            elif queue.credit <= 0:
+                self._ring.rotate(-1)
+            return queue, func, enqueued_at, keys
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                picked = self._pick()
+                while picked is None:
+                    self._cond.wait()
+                    picked = self._pick()
+            queue, func, enqueued_at, keys = picked
+            waited = time.monotonic() - enqueued_at
+            metrics.observe('webhook_queue_seconds', waited, politician=queue.name)
+            if self.close_connections:
+                close_old_connections()
+            try:
+                # 応答した後の処理も、遅ければ記録・対象ならプロファイルする（bot/diagnostics.py）
+                with diagnostics.traced(queue.name, job='webhook', queued_ms=round(waited * 1000, 2)):
+                    func()
+            except Exception:
+                metrics.inc('webhook_job_errors_total', politician=queue.name)
+                logger.exception("webhook の処理に失敗しました (politician=%s)", queue.name)
+            finally:
+                if self.close_connections:
+                    close_old_connections()
+                with self._cond:
+                    queue.running -= 1
+                    queue.busy.difference_update(keys)
+                    if not queue.jobs and not queue.running:
+                        self._tenants.pop(queue.name, None)
+                    # 上限・処理中の住民で止まっていた処理を動かせるようになったので、待っているワーカーを起こす
+                    self._cond.notify_all()
+
+    def depth(self):
+        """{自治会: (処理待ち, 処理中)}"""
+        with self._cond:
+            return {name: (len(q.jobs), q.running) for name, q in self._tenants.items()}
+
+    def wait_idle(self, timeout=None):
+        """すべての処理が終わるまで待つ（テスト・計測用）。終わったら True"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._tenants:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+
+scheduler = TenantScheduler(
+    _setting('WEBHOOK_WORKERS', 8),
+    _setting('WEBHOOK_TENANT_CONCURRENCY', 4),
+)
+
+
+def _depth_gauge(index):
+    return lambda: [({'politician': name}, counts[index]) for name, counts in sorted(scheduler.depth().items())]
+
+
+metrics.gauge('webhook_queue_depth', _depth_gauge(0))
+metrics.gauge('webhook_running', _depth_gauge(1))
+
+
+def submit(politician, func, keys=()):
+    """webhook の処理を自治会のキューに積む（WEBHOOK_SYNC なら、その場で処理する）。keys は含まれる住民のID"""
+    if _setting('WEBHOOK_SYNC', False):
+        func()
+        return
+    scheduler.submit(politician.slug, func, weight=politician.webhook_weight, keys=keys)
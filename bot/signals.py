@@ -0,0 +1,69 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from members.models import AiMember
+
+from . import addresses, course_stats, courses, diagnostics, garbage, regions
+from .models import AddressDistrict, Course, CourseAssignment, CourseContent, DiagnosticsSetting, GarbageRule, GarbageRuleException, Region, UserProgress
+
+
+# 案内のタイトル変更・割り当ての追加/削除で、一覧カルーセルを作り直す
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=CourseAssignment)
+@receiver(post_delete, sender=CourseAssignment)
+def invalidate_course_list(sender, using, **kwargs):
+    courses.invalidate_course_list(using)
+
+
+# ステップの追加・並べ替え・削除で、その案内のインデックスを捨てる
+@receiver(post_save, sender=CourseContent)
+@receiver(post_delete, sender=CourseContent)
+def invalidate_course_contents(sender, instance, using, **kwargs):
+    courses.course_changed(instance.course_id, using)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def invalidate_course_title(sender, instance, using, **kwargs):
+    courses.course_changed(instance.pk, using)
+
+
+@receiver(post_save, sender=GarbageRule)
+@receiver(post_delete, sender=GarbageRule)
+@receiver(post_save, sender=GarbageRuleException)
+@receiver(post_delete, sender=GarbageRuleException)
+def invalidate_garbage_rules(sender, using, **kwargs):
+    garbage.invalidate_rules(using)
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def invalidate_regions(sender, using, **kwargs):
+    regions.invalidate(using)
+
+
+@receiver(post_save, sender=AddressDistrict)
+@receiver(post_delete, sender=AddressDistrict)
+def invalidate_address_districts(sender, instance, using, **kwargs):
+    addresses.invalidate(instance.politician_id, using)
+
+
+# 住所が管理画面で直された場合に備えて、住民ごとの地区を捨てる
+@receiver(post_save, sender=AiMember)
+@receiver(post_delete, sender=AiMember)
+def forget_member_region(sender, instance, **kwargs):
+    addresses.forget_member(instance.pk)
+
+
+# 進捗が消えた住民を集計から外す（案内・自治会ごと消えた場合は集計も一緒に消えている）
+@receiver(post_delete, sender=UserProgress)
+def remove_progress_stat(sender, instance, **kwargs):
+    course_stats.record(instance.politician_id, instance.current_course_id, instance.last_completed_order, None)
+
+
+# 診断設定は保存したプロセスではすぐ反映（ほかのプロセスは diagnostics.SETTINGS_TTL 秒以内に読み直す）
+@receiver(post_save, sender=DiagnosticsSetting)
+@receiver(post_delete, sender=DiagnosticsSetting)
+def reload_diagnostics(sender, **kwargs):
+    diagnostics.reload()
@@ -0,0 +1,143 @@
+"""
+webhook を外部につながずに動かすための部品（テストと負荷試験で使用）
+- 署名付きの LINE webhook 本文を作る
+- LINE の返信API・OpenAI の代わりに応答するローカルサーバー（応答までの待ち時間を指定可能）
+"""
+import base64
+import hashlib
+import hmac
+import http.server
+import json
+import threading
+import time
+import uuid
+
+
+def signature(channel_secret, body):
+    digest = hmac.new(channel_secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def _event(event_type, line_user_id, **extra):
+    return {
+        'type': event_type,
+        'mode': 'active',
+        'timestamp': int(time.time() * 1000),
+        'webhookEventId': uuid.uuid4().hex,
+        'deliveryContext': {'isRedelivery': False},
+        'replyToken': uuid.uuid4().hex,
+        'source': {'type': 'user', 'userId': line_user_id},
+        **extra,
+    }
+
+
+def text_event(line_user_id, text):
+    return _event('message', line_user_id, message={'type': 'text', 'id': uuid.uuid4().hex[:16], 'text': text, 'quoteToken': 'q'})
+
+
+def postback_event(line_user_id, data):
+    return _event('postback', line_user_id, postback={'data': data})
+
+
+def follow_event(line_user_id):
+    return _event('follow', line_user_id, follow={'isUnblocked': False})
+
+
+def webhook_body(*events):
+    return json.dumps({'destination': 'Ubench', 'events': list(events)}, ensure_ascii=False)
+
+
+def post_webhook(client, politician, *events):
+    """テスト用クライアントで署名付きの webhook を送る"""
+    body = webhook_body(*events)
+    return client.post(
+        f'/bot/webhook/{politician.slug}/',
+        body,
+        content_type='application/json',
+        HTTP_X_LINE_SIGNATURE=signature(politician.line_channel_secret, body),
+    )
+
+
+class FakeServer:
+    """
+    ローカルで動く簡易HTTPサーバー。受けたリクエストを calls に記録し、latency 秒待ってから応答します
+    respond(path, body) を上書きして (ステータス, 応答JSON) を返します
+    """
+    latency = 0.0
+
+    def __init__(self, latency=None):
+        if latency is not None:
+            self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+                with fake._lock:
+                    fake.calls.append((self.path, body))
+                if fake.latency:
+                    time.sleep(fake.latency)
+                status, payload = fake.respond(self.path, body)
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def respond(self, path, body):
+        return 200, {}
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeLineServer(FakeServer):
+    """LINE の返信・プッシュAPIの代わり。送られたメッセージは messages() で確認できます"""
+
+    def messages(self):
+        return [json.loads(body)['messages'] for _, body in list(self.calls)]
+
+
+class FakeOpenAIServer(FakeServer):
+    """OpenAI の chat.completions の代わり。決まった文を返します"""
+    answer = "次の可燃ごみの日は水曜日です。"
+
+    def respond(self, path, body):
+        request = json.loads(body or '{}')
+        return 200, {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'gpt-4o'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.answer},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        }
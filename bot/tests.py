@@ -1,3 +1,1345 @@
-from django.test import TestCase
+import functools
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.db.utils import load_backend
+from django.templatetags.static import static
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from linebot.exceptions import LineBotApiError
+from linebot.models import Error, TextSendMessage
+
+from core.paginator import EstimatedCountPaginator
+from members import state as member_state
+from members.models import AiMember
+
+from . import addresses, bubbles, caching, course_stats, courses, dbutils, diagnostics, flex, garbage, metrics, outbound, postback, regions, views, warmup
+from .flex import FlexSizeError, FlexTemplate, RawSlot, Slot
+from .admin import GarbageCalendarResource
+from .management.commands import copy_sqlite_to_postgres, import_garbage_calendar
+from .models import AddressDistrict, CacheVersion, Course, CourseAssignment, CourseContent, DiagnosticsSetting, GarbageCalendar, GarbageRule, GarbageRuleException, MessageLog, OutboundDeadLetter, Politician, Region, UserProgress
+from . import scheduler as scheduler_module
+from .scheduler import TenantScheduler
+from .testing import FakeLineServer, FakeOpenAIServer, follow_event, post_webhook, postback_event, text_event, webhook_body
+
+
+class ScriptedLineServer(FakeLineServer):
+    """パスごとに決めたステータスを順に返し、使い切ったら 200 を返す LINE の代わり"""
+
+    def __init__(self):
+        super().__init__()
+        self.script = {}
+
+    def respond(self, path, body):
+        statuses = self.script.get(path)
+        if statuses:
+            return statuses.pop(0), {'message': "失敗しました"}
+        return 200, {}
+
+
+class OutboundTests(TestCase):
+    """送信キュー（bot/outbound.py）の再送・プッシュへの切り替え・デッドレター"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.line = cls.enterClassContext(ScriptedLineServer())
+        cls.enterClassContext(override_settings(LINE_API_ENDPOINT=cls.line.url, LINE_OUTBOUND_BACKOFF_BASE=0.01))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.politician = Politician.objects.create(name="テスト自治会", slug="test", line_channel_secret="s", line_access_token="outbound-test")
+
+    def setUp(self):
+        self.line.reset()
+        self.line.script.clear()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def wait_for_calls(self, count):
+        deadline = time.monotonic() + 5
+        while len(self.line.calls) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # 余分な送信が無いことも確かめる
+        time.sleep(0.1)
+        return [(path, json.loads(body)) for path, body in self.line.calls]
+
+    def test_push_is_retried_until_delivered(self):
+        self.line.script[outbound.PUSH_PATH] = [500, 429]
+        outbound.send_push(self.politician, "U1", TextSendMessage(text="お知らせ"))
+        calls = self.wait_for_calls(3)
+        self.assertEqual([path for path, _ in calls], [outbound.PUSH_PATH] * 3)
+        self.assertEqual({body['to'] for _, body in calls}, {"U1"})
+        self.assertEqual(metrics.snapshot()['counters'][('line_outbound_retries_total', (('kind', 'push'),))], 2)
+
+    def test_failed_reply_is_not_retried_but_pushed(self):
+        self.line.script[outbound.REPLY_PATH] = [500]
+        outbound.send_reply(self.politician, "token1", TextSendMessage(text="登録完了"), fallback_to="U1")
+        (reply_path, reply_body), (push_path, push_body) = self.wait_for_calls(2)
+        self.assertEqual((reply_path, reply_body['replyToken']), (outbound.REPLY_PATH, "token1"))
+        self.assertEqual((push_path, push_body['to']), (outbound.PUSH_PATH, "U1"))
+        self.assertEqual(push_body['messages'], reply_body['messages'])
+
+    @override_settings(LINE_OUTBOUND_SYNC=True)
+    def test_failed_reply_without_fallback_is_dead_lettered(self):
+        self.line.script[outbound.REPLY_PATH] = [400]
+        outbound.send_reply(self.politician, "token1", TextSendMessage(text="こんにちは"))
+        self.assertEqual(len(self.line.calls), 1)
+        dead = OutboundDeadLetter.objects.get()
+        self.assertEqual((dead.kind, dead.target, dead.status_code, dead.attempts), ('reply', "token1", 400, 1))
+        self.assertEqual(dead.error, "失敗しました")
+
+    @override_settings(LINE_OUTBOUND_SYNC=True, LINE_API_ENDPOINT='http://127.0.0.1:1')
+    def test_network_error_is_timed_and_not_pushed(self):
+        outbound.send_reply(self.politician, "token1", TextSendMessage(text="こんにちは"), fallback_to="U1")
+        # LINE 側に届いている可能性があるので、プッシュには切り替えない
+        dead = OutboundDeadLetter.objects.get()
+        self.assertEqual((dead.kind, dead.status_code), ('reply', None))
+        self.assertEqual(metrics.snapshot()['histograms'][('line_api_seconds', (('kind', 'reply'),))]['count'], 1)
+
+    @override_settings(LINE_OUTBOUND_BACKOFF_BASE=1, LINE_OUTBOUND_BACKOFF_MAX=4)
+    def test_backoff_prefers_retry_after_and_is_capped(self):
+        error = LineBotApiError(429, {'Retry-After': '3'}, error=Error(message="too many"))
+        self.assertEqual(outbound.backoff_delay(1, error), 3.0)
+        self.assertTrue(0.5 <= outbound.backoff_delay(1) <= 1)
+        self.assertTrue(2 <= outbound.backoff_delay(10) <= 4)
+
+
+class FlexTemplateTests(SimpleTestCase):
+
+    def test_render_fills_slots_like_json_dumps(self):
+        template = FlexTemplate(Slot("alt"), {
+            "type": "bubble",
+            "body": {"type": "box", "layout": "vertical", "contents": RawSlot("rows")},
+            "footer": {"type": "text", "text": Slot("text")},
+        })
+        rows = flex.join_array([flex.text_message("1行目"), flex.text_message("2行目")])
+        text = template.render(alt="お知らせ", rows=rows, text='引用符" と改行\nを含む')
+        self.assertEqual(json.loads(text), {
+            "type": "flex", "altText": "お知らせ",
+            "contents": {
+                "type": "bubble",
+                "body": {"type": "box", "layout": "vertical", "contents": [{"type": "text", "text": "1行目"}, {"type": "text", "text": "2行目"}]},
+                "footer": {"type": "text", "text": '引用符" と改行\nを含む'},
+            },
+        })
+
+    def test_view_templates_render_valid_json(self):
+        message = json.loads(bubbles.PROGRESS_SAVED.render(next_data="a=1", end_data="a=2"))
+        buttons = message['contents']['footer']['contents']
+        self.assertEqual([b['action']['data'] for b in buttons], ["a=1", "a=2"])
+
+    def test_limits_are_checked_when_compiled(self):
+        bubble = {"type": "bubble", "body": {"type": "box", "layout": "vertical", "contents": []}}
+        with self.assertRaises(FlexSizeError):
+            FlexTemplate("あ" * (flex.MAX_ALT_TEXT + 1), bubble)
+        with self.assertRaises(FlexSizeError):
+            FlexTemplate("一覧", {"type": "carousel", "contents": [bubble] * (flex.MAX_CAROUSEL_BUBBLES + 1)})
+        FlexTemplate("あ" * flex.MAX_ALT_TEXT, {"type": "carousel", "contents": [bubble] * flex.MAX_CAROUSEL_BUBBLES})
+
+    def test_limits_are_checked_when_rendered(self):
+        template = FlexTemplate("お知らせ", {"type": "bubble", "body": {"type": "text", "text": Slot("text")}})
+        template.render(text="あ" * 10_000)
+        # 日本語は1文字3バイトなので、30KBを超える
+        with self.assertRaises(FlexSizeError):
+            template.render(text="あ" * 11_000)
+        bubble = flex.dumps({"type": "bubble"})
+        with self.assertRaises(FlexSizeError):
+            flex.join_bubbles([bubble] * (flex.MAX_CAROUSEL_BUBBLES + 1))
+        with self.assertRaises(FlexSizeError):
+            flex.join_bubbles([flex.dumps({"type": "bubble", "body": {"type": "text", "text": "あ" * 11_000}})])
+        with self.assertRaises(FlexSizeError):
+            flex.messages(*[flex.text_message("こんにちは")] * (flex.MAX_MESSAGES + 1))
+
+
+@override_settings(CACHE_VERSION_CHECK_SECONDS=3600)
+class CourseListTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.politician = Politician.objects.create(name="テスト自治会", slug="test", line_channel_secret="s", line_access_token="t")
+        for i in range(25):
+            course = Course.objects.create(title=f"案内{i + 1}")
+            CourseAssignment.objects.create(politician=cls.politician, course=course, order=i)
+
+    def setUp(self):
+        cache.clear()
+        caching.forget()
+        self.addCleanup(caching.forget)
+
+    def page(self, page):
+        messages = json.loads(courses.get_course_list_payload(self.politician, page))
+        return messages[0]['contents']['contents']
+
+    def test_paginate(self):
+        self.assertEqual(courses.paginate(12, 1), (0, 12, 1))
+        self.assertEqual(courses.paginate(25, 1), (0, 11, 3))
+        self.assertEqual(courses.paginate(25, 3), (22, 25, 3))
+        self.assertEqual(courses.paginate(25, 0), (0, 11, 3))
+        self.assertEqual(courses.paginate(25, 99), (22, 25, 3))
+
+    def test_pages_link_to_the_next_page(self):
+        first = self.page(1)
+        self.assertEqual(len(first), flex.MAX_CAROUSEL_BUBBLES)
+        self.assertEqual(first[0]['body']['contents'][1]['text'], "案内1")
+        self.assertEqual(first[-1]['footer']['contents'][0]['action']['data'], postback.list_page(2))
+        last = self.page(3)
+        self.assertEqual([b['body']['contents'][1]['text'] for b in last], ["案内23", "案内24", "案内25"])
+
+    def test_list_is_loaded_with_one_query_and_then_cached(self):
+        caching.check()
+        with self.assertNumQueries(1):
+            self.page(1)
+        with self.assertNumQueries(0):
+            self.page(2)
+
+    def test_out_of_range_pages_share_the_last_page_entry(self):
+        self.assertEqual(courses.get_course_list_payload(self.politician, 999), courses.get_course_list_payload(self.politician, 3))
+        self.assertIsNone(cache.get(caching.make_key(courses.LIST_NAMESPACE, self.politician.pk, "page", 999)))
+        self.assertIsNotNone(cache.get(caching.make_key(courses.LIST_NAMESPACE, self.politician.pk, "page", 3)))
+
+    def test_parse_list_command(self):
+        commands = ["案内一覧"]
+        self.assertEqual(courses.parse_list_command("案内一覧", commands), ("案内一覧", 1))
+        self.assertEqual(courses.parse_list_command("案内一覧:2", commands), ("案内一覧", 2))
+        self.assertIsNone(courses.parse_list_command("案内一覧:二", commands))
+        self.assertIsNone(courses.parse_list_command("イベント", commands))
+
+
+@override_settings(CACHE_VERSION_CHECK_SECONDS=3600)
+class CourseIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.politician = Politician.objects.create(name="テスト自治会", slug="test", line_channel_secret="s", line_access_token="t")
+        cls.course = Course.objects.create(title="防災の案内")
+        cls.other = Course.objects.create(title="ほかの自治会の案内")
+        CourseAssignment.objects.create(politician=cls.politician, course=cls.course)
+        # order は飛び飛びでもよい
+        cls.steps = [CourseContent.objects.create(course=cls.course, order=order, title=f"ステップ{order}") for order in (1, 3, 7)]
+
+    def setUp(self):
+        cache.clear()
+        caching.forget()
+        courses.invalidate_course_index()
+        self.addCleanup(caching.forget)
+
+    def test_steps_are_found_by_order_and_id(self):
+        index = courses.get_course_index(self.course.pk)
+        self.assertEqual(index.next_after(0).title, "ステップ1")
+        self.assertEqual(index.next_after(1).title, "ステップ3")
+        self.assertEqual(index.next_after(5).title, "ステップ7")
+        self.assertIsNone(index.next_after(7))
+        self.assertEqual([c.title for c in index.completed(3)], ["ステップ1", "ステップ3"])
+        self.assertEqual(index.content(self.steps[2].pk).order, 7)
+        self.assertIsNone(index.content(0))
+        self.assertEqual(index.last_order, 7)
+
+    def test_index_is_loaded_once(self):
+        caching.check()
+        with self.assertNumQueries(2):
+            index = courses.get_course_index(self.course.pk)
+        with self.assertNumQueries(0):
+            self.assertIs(courses.get_course_index(self.course.pk), index)
+        self.assertIsNone(courses.get_course_index(0))
+
+    def test_only_assigned_courses_are_resolved(self):
+        self.assertEqual(courses.resolve_course(self.politician, str(self.course.pk)), self.course.pk)
+        self.assertEqual(courses.resolve_course(self.politician, self.course.pk), self.course.pk)
+        self.assertIsNone(courses.resolve_course(self.politician, str(self.other.pk)))
+        # 旧形式（タイトル）のボタン
+        self.assertEqual(courses.resolve_course(self.politician, "防災の案内"), self.course.pk)
+        self.assertIsNone(courses.resolve_course(self.politician, "ほかの自治会の案内"))
+
+
+class PostbackTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(postback.course("教材進捗", 3, 9), "c1:p:3:9")
+        self.assertEqual(postback.decode(postback.course("教材進捗", 3, 9)), ("p", [3, 9]))
+        self.assertEqual(postback.decode(postback.course("教材開始", 3)), ("s", [3]))
+        self.assertEqual(postback.decode(postback.list_page(2)), (postback.LIST_PAGE, [2]))
+
+    def test_unknown_versions_and_broken_data_are_rejected(self):
+        for data in ("c0:s:3", "c2:s:3", "c1:s", "c1:s:abc", "教材開始:防災の案内", ""):
+            with self.subTest(data=data):
+                self.assertIsNone(postback.decode(data))
+
+    def test_bench_flex_compares_equivalent_payloads(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('bench_flex', number=1, days=3, stdout=out, stderr=err)
+        self.assertEqual(err.getvalue(), "")
+        self.assertIn("案内カルーセル(12件)", out.getvalue())
+
+
+class RegistrationFlowTests(TestCase):
+    """webhook を通した初回登録（名前 → 住所）"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.line = cls.enterClassContext(FakeLineServer())
+        cls.enterClassContext(override_settings(LINE_API_ENDPOINT=cls.line.url, LINE_OUTBOUND_SYNC=True, WEBHOOK_SYNC=True))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.politician = Politician.objects.create(name="テスト自治会", slug="test", line_channel_secret="s", line_access_token="t")
+
+    def setUp(self):
+        self.line.reset()
+        cache.clear()
+        caching.forget()
+        self.addCleanup(caching.forget)
+
+    def send(self, event):
+        self.line.reset()
+        self.assertEqual(post_webhook(self.client, self.politician, event).status_code, 200)
+        return [m['text'] for messages in self.line.messages() for m in messages if m['type'] == 'text']
+
+    def test_name_then_address(self):
+        self.assertIn("お名前", self.send(follow_event("U1"))[0])
+        self.assertEqual(self.send(text_event("U1", "こんにちは")), ["姓と名の間にスペースを入れてください。"])
+        self.assertEqual(self.send(text_event("U1", "宮崎 太郎")), ["班名（〇〇班）または部屋番号をお願いします。"])
+        self.assertEqual(self.send(text_event("U1", "北町1丁目 3班")), ["登録完了！ご活用ください。"])
+        member = AiMember.objects.get(pk="U1")
+        self.assertEqual((member.real_name, member.address, member.registration_step), ("宮崎 太郎", "北町1丁目 3班", 3))
+        self.assertEqual(member.politician, self.politician)
+        # 登録後のメッセージはコマンドとして扱われ、名前・住所は変わらない
+        self.assertTrue(self.send(text_event("U1", "お問い合わせ"))[0].startswith("ご不明な点やご相談は"))
+        member.refresh_from_db()
+        self.assertEqual((member.real_name, member.address), ("宮崎 太郎", "北町1丁目 3班"))
+
+    def test_registered_member_is_not_read_again(self):
+        AiMember.objects.create(line_user_id="U2", registration_step=3)
+        self.send(text_event("U2", "お問い合わせ"))
+        with CaptureQueriesContext(connection) as ctx:
+            self.send(text_event("U2", "お問い合わせ"))
+        self.assertFalse([q['sql'] for q in ctx if 'members_aimember' in q['sql']])
+
+    def test_step_changed_by_another_process_is_seen(self):
+        AiMember.objects.create(line_user_id="U2", registration_step=3, real_name="宮崎 太郎")
+        self.send(text_event("U2", "お問い合わせ"))
+        # ほかのプロセス（管理画面・別のワーカー）で名前待ちに戻され、そのプロセスが版を上げた
+        AiMember.objects.filter(pk="U2").update(registration_step=1)
+        if not CacheVersion.objects.filter(name=member_state.NAMESPACE).update(version=F('version') + 1):
+            CacheVersion.objects.create(name=member_state.NAMESPACE, version=1)
+        caching.check(force=True)
+        self.assertEqual(self.send(text_event("U2", "日向 花子")), ["班名（〇〇班）または部屋番号をお願いします。"])
+        self.assertEqual(AiMember.objects.get(pk="U2").real_name, "日向 花子")
+
+    def test_saving_or_following_again_resets_the_cached_step(self):
+        member = AiMember.objects.create(line_user_id="U2", registration_step=3)
+        self.send(text_event("U2", "お問い合わせ"))
+        member.registration_step = 2
+        member.save()
+        self.assertEqual(self.send(text_event("U2", "北町1丁目")), ["登録完了！ご活用ください。"])
+        # 登録済みの住民が友だち追加をやり直すと、最初から登録し直す
+        self.send(follow_event("U2"))
+        self.assertEqual(self.send(text_event("U2", "こんにちは")), ["姓と名の間にスペースを入れてください。"])
+
+    def test_member_created_by_message_belongs_to_tenant(self):
+        # 友だち追加のイベントを受け取れなかった住民も、最初のメッセージでこの自治会の住民になる
+        self.send(text_event("U3", "こんにちは"))
+        self.assertEqual(AiMember.objects.get(pk="U3").politician, self.politician)
+
+
+class ImportGarbageCalendarTests(TestCase):
+
+    def setUp(self):
+        self.dir = self.enterContext(tempfile.TemporaryDirectory())
+
+    def write_csv(self, *lines, name='calendar.csv', header="日付,市町村,地区,ごみ種別,注意事項"):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            f.write("\n".join([header] + list(lines)) + "\n")
+        return path
+
+    def run_import(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_garbage_calendar', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def rows(self):
+        return list(GarbageCalendar.objects.order_by('collection_date', 'garbage_type').values_list('collection_date', 'garbage_type', 'notes'))
+
+    def test_imports_in_batches_and_upserts(self):
+        path = self.write_csv(
+            "2026/04/01,宮崎市,北A地区,可燃ごみ,",
+            "2026-04-02,宮崎市,北A地区,資源ごみ,朝8時まで",
+            "2026/04/03 00:00:00,宮崎市,北A地区,可燃ごみ,",
+        )
+        out, _ = self.run_import(path, '--batch-size', '2')
+        self.assertIn("取り込み完了: 3行（反映 3 / エラー 0）", out)
+        self.assertEqual(self.rows(), [
+            (date(2026, 4, 1), "可燃ごみ", None),
+            (date(2026, 4, 2), "資源ごみ", "朝8時まで"),
+            (date(2026, 4, 3), "可燃ごみ", None),
+        ])
+        # 同じ市町村・地区・日付・種別は上書き（ファイル内の重複は後の行）
+        self.run_import(self.write_csv(
+            "2026/04/01,宮崎市,北A地区,可燃ごみ,雨天中止",
+            "2026/04/01,宮崎市,北A地区,可燃ごみ,祝日も収集",
+            name='update.csv',
+        ))
+        self.assertEqual(GarbageCalendar.objects.count(), 3)
+        self.assertEqual(GarbageCalendar.objects.get(collection_date=date(2026, 4, 1)).notes, "祝日も収集")
+
+    def test_columns_missing_from_the_file_are_kept(self):
+        self.run_import(self.write_csv("2026/04/01,宮崎市,北A地区,可燃ごみ,8時までに出す"))
+        # 管理画面の形式（注意事項の列が無い）で取り込み直しても、注意事項は消えない
+        self.run_import(self.write_csv(
+            "2026/04/01,宮崎市,北A地区,可燃ごみ,袋は2つまで",
+            "2026/04/02,宮崎市,北A地区,資源ごみ,",
+            name='admin.csv', header="日付,市町村,地区,ごみ種別,その他",
+        ))
+        row = GarbageCalendar.objects.get(collection_date=date(2026, 4, 1))
+        self.assertEqual((row.notes, row.other), ("8時までに出す", "袋は2つまで"))
+        self.assertEqual(GarbageCalendar.objects.count(), 2)
+        # 英語の列名（notes）でも注意事項として読む
+        self.run_import(self.write_csv("2026/04/01,宮崎市,北A地区,可燃ごみ,雨天中止", name='en.csv', header="日付,市町村,地区,ごみ種別,notes"))
+        row.refresh_from_db()
+        self.assertEqual((row.notes, row.other), ("雨天中止", "袋は2つまで"))
+
+    def test_only_required_columns_adds_new_rows(self):
+        self.run_import(self.write_csv("2026/04/01,宮崎市,北A地区,可燃ごみ,8時までに出す"))
+        self.run_import(self.write_csv("2026/04/01,宮崎市,北A地区,可燃ごみ", "2026/04/02,宮崎市,北A地区,可燃ごみ", name='min.csv', header="日付,市町村,地区,ごみ種別"))
+        self.assertEqual(self.rows(), [(date(2026, 4, 1), "可燃ごみ", "8時までに出す"), (date(2026, 4, 2), "可燃ごみ", None)])
+
+    def test_admin_export_uses_the_same_columns(self):
+        GarbageCalendar.objects.create(municipality="宮崎市", district="北A地区", collection_date=date(2026, 4, 1), garbage_type="可燃ごみ", notes="8時までに出す")
+        headers = GarbageCalendarResource().export().headers
+        self.assertIn("注意事項", headers)
+        self.assertTrue(set(headers) <= set(import_garbage_calendar.COLUMNS) | {"id"}, headers)
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        path = self.write_csv(
+            "2026/04/01,宮崎市,北A地区,可燃ごみ,",
+            "4月2日,宮崎市,北A地区,可燃ごみ,",
+            "2026/04/03,宮崎市,,可燃ごみ,",
+        )
+        out, err = self.run_import(path)
+        self.assertIn("反映 1 / エラー 2", out)
+        self.assertIn("calendar.csv:3: 日付の形式が不正です: 4月2日", err)
+        self.assertIn("calendar.csv:4: district が空です", err)
+        self.assertEqual(GarbageCalendar.objects.count(), 1)
+
+    def test_dry_run_writes_nothing(self):
+        out, _ = self.run_import(self.write_csv("2026/04/01,宮崎市,北A地区,可燃ごみ,"), '--dry-run')
+        self.assertIn("検証完了", out)
+        self.assertFalse(GarbageCalendar.objects.exists())
+
+    def test_missing_required_column(self):
+        path = os.path.join(self.dir, 'broken.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("日付,市町村,ごみ種別\n2026/04/01,宮崎市,可燃ごみ\n")
+        with self.assertRaisesMessage(CommandError, "必須の列がありません: 地区"):
+            self.run_import(path)
+
+
+@override_settings(CACHE_VERSION_CHECK_SECONDS=3600)
+class GarbageScheduleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        area = {'municipality': "宮崎市", 'district': "北A地区"}
+        cls.burnable = GarbageRule.objects.create(**area, garbage_type="可燃ごみ", weekdays="月木", valid_until=date(2026, 4, 27))
+        GarbageRuleException.objects.create(rule=cls.burnable, date=date(2026, 4, 13))
+        GarbageRuleException.objects.create(rule=cls.burnable, date=date(2026, 4, 16), replacement_date=date(2026, 4, 18), notes="振替")
+        GarbageRule.objects.create(**area, garbage_type="資源ごみ", weekdays="水", nth_weeks="2・4")
+        GarbageRule.objects.create(municipality="宮崎市", district="南A地区", garbage_type="プラスチック", weekdays="火")
+        GarbageCalendar.objects.create(**area, collection_date=date(2026, 4, 22), garbage_type="資源ごみ", notes="臨時")
+        GarbageCalendar.objects.create(**area, collection_date=date(2026, 4, 25), garbage_type="不燃ごみ")
+
+    def setUp(self):
+        cache.clear()
+        caching.forget()
+        self.addCleanup(caching.forget)
+
+    def schedule(self):
+        return [
+            (item.collection_date.day, item.garbage_type, item.notes)
+            for item in garbage.get_schedule("宮崎市", "北A地区", date(2026, 4, 1), date(2026, 4, 30))
+        ]
+
+    def test_rules_are_expanded_with_skips_moves_and_explicit_days(self):
+        self.assertEqual(self.schedule(), [
+            (2, "可燃ごみ", None),
+            (6, "可燃ごみ", None),
+            (8, "資源ごみ", None),
+            (9, "可燃ごみ", None),
+            # 13日は休み、16日は18日に振替
+            (18, "可燃ごみ", "振替"),
+            (20, "可燃ごみ", None),
+            # 個別に登録された日はそちらを優先する
+            (22, "資源ごみ", "臨時"),
+            (23, "可燃ごみ", None),
+            (25, "不燃ごみ", None),
+            # 30日は適用終了日の後
+            (27, "可燃ごみ", None),
+        ])
+
+    def test_parse_rule_fields(self):
+        self.assertEqual(garbage.parse_weekdays("月木"), {0, 3})
+        self.assertEqual(garbage.parse_nth_weeks("2・4"), {2, 4})
+        self.assertEqual(garbage.parse_nth_weeks("1, 3"), {1, 3})
+
+    def test_rules_are_cached_until_changed(self):
+        caching.check()
+        self.schedule()
+        # ルールはキャッシュから、日付ごとの登録だけを読む
+        with self.assertNumQueries(1):
+            self.schedule()
+        GarbageRuleException.objects.create(rule=self.burnable, date=date(2026, 4, 2))
+        self.assertNotIn((2, "可燃ごみ", None), self.schedule())
+
+
+@override_settings(CACHE_VERSION_CHECK_SECONDS=3600)
+class RegionTests(TestCase):
+
+    def setUp(self):
+        caching.forget()
+        regions.invalidate()
+        self.addCleanup(caching.forget)
+
+    def test_initial_regions_are_created_by_the_migration(self):
+        self.assertEqual(
+            list(Region.objects.filter(code__startswith='miyazaki_').values_list('code', flat=True).order_by('code')),
+            ['miyazaki_kita_a', 'miyazaki_kita_b', 'miyazaki_minami_a', 'miyazaki_minami_b'],
+        )
+
+    def test_lookup_is_served_from_memory(self):
+        self.assertEqual(regions.lookup('miyazaki_kita_a'), ("宮崎市", "北A地区"))
+        with self.assertNumQueries(0):
+            self.assertEqual(regions.lookup('miyazaki_minami_b'), ("宮崎市", "南B地区"))
+            self.assertIsNone(regions.lookup('unknown'))
+            self.assertIsNone(regions.lookup(None))
+
+    def test_saved_region_is_seen_immediately(self):
+        regions.lookup('miyazaki_kita_a')
+        Region.objects.create(code='nichinan', municipality="日南市", district="中央地区")
+        self.assertEqual(regions.lookup('nichinan'), ("日南市", "中央地区"))
+        Region.objects.get(code='nichinan').delete()
+        self.assertIsNone(regions.lookup('nichinan'))
+
+
+@override_settings(CACHE_VERSION_CHECK_SECONDS=3600)
+class AddressDistrictTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.politician = Politician.objects.create(
+            name="テスト自治会", slug="test", line_channel_secret="s", line_access_token="t", gomi_region_id='miyazaki_kita_a',
+        )
+        for prefix, code in (("北町", 'miyazaki_kita_b'), ("北町1丁目", 'miyazaki_minami_a'), ("南町", 'miyazaki_minami_b')):
+            AddressDistrict.objects.create(politician=cls.politician, prefix=prefix, region_id=code)
+        AiMember.objects.create(line_user_id="U1", address="北町１丁目 ３班")
+        AiMember.objects.create(line_user_id="U2", address="東町5")
+
+    def setUp(self):
+        cache.clear()
+        caching.forget()
+        addresses.invalidate(self.politician.pk)
+        self.addCleanup(caching.forget)
+
+    def test_longest_prefix_wins(self):
+        trie = addresses.build_trie([("北町", 'a'), ("北町1丁目", 'b'), ("北町1丁目3班", 'c')])
+        self.assertEqual(addresses.match(trie, "北町2丁目"), 'a')
+        self.assertEqual(addresses.match(trie, "北町1丁目5班"), 'b')
+        # 全角数字・空白の違いは吸収する
+        self.assertEqual(addresses.match(trie, "北町１丁目 ３班"), 'c')
+        self.assertIsNone(addresses.match(trie, "南町"))
+        self.assertIsNone(addresses.match(trie, None))
+
+    def test_member_region_falls_back_to_the_tenant_region(self):
+        self.assertEqual(addresses.member_region(self.politician, "U1"), 'miyazaki_minami_a')
+        self.assertEqual(addresses.member_region(self.politician, "U2"), 'miyazaki_kita_a')
+        with self.assertNumQueries(0):
+            self.assertEqual(addresses.member_region(self.politician, "U1"), 'miyazaki_minami_a')
+
+    def test_tenant_without_table_does_not_read_the_member(self):
+        other = Politician.objects.create(name="別の自治会", slug="other", line_channel_secret="s", line_access_token="t", gomi_region_id='miyazaki_kita_b')
+        addresses.get_trie(other.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(addresses.member_region(other, "U1"), 'miyazaki_kita_b')
+
+    def test_changes_to_the_table_or_address_are_applied(self):
+        self.assertEqual(addresses.member_region(self.politician, "U1"), 'miyazaki_minami_a')
+        AddressDistrict.objects.filter(prefix="北町1丁目").get().delete()
+        self.assertEqual(addresses.member_region(self.politician, "U1"), 'miyazaki_kita_b')
+        member = AiMember.objects.get(pk="U1")
+        member.address = "南町2"
+        member.save()
+        self.assertEqual(addresses.member_region(self.politician, "U1"), 'miyazaki_minami_b')
+
+
+class CopySqliteToPostgresTests(SimpleTestCase):
+
+    def test_models_come_after_the_models_they_reference(self):
+        ordered = copy_sqlite_to_postgres.copy_order()
+        position = {model: i for i, model in enumerate(ordered)}
+        for model in ordered:
+            for field in model._meta.concrete_fields:
+                target = field.related_model
+                if field.is_relation and target is not model:
+                    self.assertLess(position[target], position[model], f"{model._meta.label}.{field.name}")
+        # 自動生成の多対多テーブルも含める
+        self.assertIn(User.groups.through, position)
+
+    def test_timestamps_are_kept_only_while_copying(self):
+        field = UserProgress._meta.get_field('updated_at')
+        with dbutils.keep_timestamps(UserProgress):
+            self.assertFalse(field.auto_now)
+        self.assertTrue(field.auto_now)
+
+    def test_target_must_be_postgresql(self):
+        with self.assertRaisesMessage(CommandError, "PostgreSQL ではありません"):
+            call_command('copy_sqlite_to_postgres', 'db.sqlite3')
+
+
+class SqliteTunedOptionsTests(SimpleTestCase):
+
+    def test_new_connections_use_wal_and_busy_timeout(self):
+        workdir = self.enterContext(tempfile.TemporaryDirectory())
+        config = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(workdir, 'tuned.sqlite3'), 'OPTIONS': dict(settings.SQLITE_TUNED_OPTIONS)},
+        })[DEFAULT_DB_ALIAS]
+        # テスト用のDBとは別の、一時ファイルのDBに直接つなぐ
+        wrapper = load_backend(config['ENGINE']).DatabaseWrapper(config, 'tuned')
+        wrapper.connect()
+        self.addCleanup(wrapper.close)
+        self.assertEqual(wrapper.connection.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(wrapper.connection.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.assertEqual(wrapper.connection.execute('PRAGMA busy_timeout').fetchone()[0], settings.SQLITE_BUSY_TIMEOUT * 1000)
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+
+
+class SqliteContentionBenchTests(TestCase):
+
+    def test_bench_writes_cache_versions_to_its_own_database(self):
+        before = list(CacheVersion.objects.values_list('name', 'version'))
+        out = io.StringIO()
+        # 計測用DB（コマンドの中で作られる別名）へのスレッドからの接続を、この間だけ許す
+        with mock.patch.object(type(self), 'databases', self.databases | {'bench_tuned'}):
+            call_command('bench_sqlite_contention', '--residents', '2', '--ops', '3', '--mode', 'tuned', stdout=out)
+        self.assertIn("[tuned]", out.getvalue())
+        self.assertIn("ロックエラー 0", out.getvalue())
+        # 計測用DBへの保存で上がる版は計測用DBに書かれ、このDBの版は変わらない
+        self.assertEqual(list(CacheVersion.objects.values_list('name', 'version')), before)
+
+
+class ArchiveOldRowsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        member = AiMember.objects.create(line_user_id="U1")
+        now = timezone.now()
+        for days in (400, 390, 10):
+            log = MessageLog.objects.create(member=member, role='user', text=f"{days}日前")
+            MessageLog.objects.filter(pk=log.pk).update(created_at=now - timedelta(days=days))
+        today = timezone.localdate()
+        GarbageCalendar.objects.create(municipality="宮崎市", district="北A地区", collection_date=today - timedelta(days=200), garbage_type="可燃ごみ")
+        GarbageCalendar.objects.create(municipality="宮崎市", district="北A地区", collection_date=today, garbage_type="可燃ごみ")
+
+    def setUp(self):
+        self.dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(ARCHIVE_DIR=self.dir))
+
+    def run_command(self, *args):
+        out = io.StringIO()
+        call_command('archive_old_rows', *args, '--sleep', '0', stdout=out)
+        return out.getvalue()
+
+    def test_old_rows_are_moved_in_chunks_and_restored(self):
+        created = dict(MessageLog.objects.values_list('text', 'created_at'))
+        deleted = []
+        receiver = lambda sender, instance, **kwargs: deleted.append(instance.text)
+        post_delete.connect(receiver, sender=MessageLog)
+        self.addCleanup(post_delete.disconnect, receiver, sender=MessageLog)
+
+        out = self.run_command('--chunk-size', '1')
+        self.assertIn("messagelog: 2件を退避しました（2チャンク", out)
+        self.assertIn("garbagecalendar: 1件を退避しました", out)
+        self.assertEqual(list(MessageLog.objects.values_list('text', flat=True)), ["10日前"])
+        self.assertEqual(GarbageCalendar.objects.count(), 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.dir, 'messagelog'))), 2)
+        # 削除はシグナルを通る
+        self.assertEqual(sorted(deleted), ["390日前", "400日前"])
+
+        out = self.run_command('--restore', '--table', 'messagelog')
+        self.assertIn("2件を復元しました", out)
+        self.assertEqual(dict(MessageLog.objects.values_list('text', 'created_at')), created)
+
+    def test_restore_only_the_requested_period(self):
+        self.run_command('--table', 'messagelog')
+        since = timezone.localdate() - timedelta(days=395)
+        self.run_command('--restore', '--table', 'messagelog', '--since', since.isoformat())
+        self.assertEqual(sorted(MessageLog.objects.values_list('text', flat=True)), ["10日前", "390日前"])
+
+    def test_dry_run_and_max_chunks(self):
+        self.assertIn("messagelog: 2件が退避の対象です（365日より前）", self.run_command('--dry-run'))
+        self.assertEqual(MessageLog.objects.count(), 3)
+        self.run_command('--table', 'messagelog', '--chunk-size', '1', '--max-chunks', '1')
+        self.assertEqual(MessageLog.objects.count(), 2)
+
+
+class CourseStatsTests(TestCase):
+    """進捗の集計（bot/course_stats.py）を webhook で進めながら確かめる"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        line = cls.enterClassContext(FakeLineServer())
+        cls.enterClassContext(override_settings(LINE_API_ENDPOINT=line.url, LINE_OUTBOUND_SYNC=True, WEBHOOK_SYNC=True))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.politician = Politician.objects.create(name="テスト自治会", slug="test", line_channel_secret="s", line_access_token="t")
+        cls.course = Course.objects.create(title="防災の案内")
+        CourseAssignment.objects.create(politician=cls.politician, course=cls.course)
+        cls.steps = [CourseContent.objects.create(course=cls.course, order=i + 1, title=f"ステップ{i + 1}") for i in range(3)]
+        AiMember.objects.bulk_create([AiMember(line_user_id=uid, registration_step=3) for uid in ("U1", "U2", "U3")])
+
+    def press(self, uid, action, *ids):
+        response = post_webhook(self.client, self.politician, postback_event(uid, postback.course(action, self.course.pk, *ids)))
+        self.assertEqual(response.status_code, 200)
+
+    def histogram(self):
+        return course_stats.histograms(politician_id=self.politician.pk).get((self.politician.pk, self.course.pk), {})
+
+    def test_incremental_counts_match_a_rebuild(self):
+        for uid in ("U1", "U2", "U3"):
+            self.press(uid, "教材開始")
+        self.press("U1", "教材進捗", self.steps[0].pk)
+        self.press("U1", "教材進捗", self.steps[1].pk)
+        # 同じボタンの二重押しは数えない
+        self.press("U1", "教材進捗", self.steps[1].pk)
+        self.press("U2", "教材進捗", self.steps[2].pk)
+        UserProgress.objects.get(line_user_id="U3").delete()
+
+        self.assertEqual(self.histogram(), {2: 1, 3: 1})
+        self.assertEqual(course_stats.summarize(self.histogram(), last_order=3), course_stats.Summary(2, 1, {2: 1, 3: 1}))
+        out = io.StringIO()
+        call_command('rebuild_course_stats', stdout=out)
+        self.assertIn("進捗集計を作り直しました（2行）", out.getvalue())
+        self.assertEqual(self.histogram(), {2: 1, 3: 1})
+
+
+class AdminQueryCountTests(TestCase):
+    """一覧・編集画面のクエリ数が行数に比例して増えないことを確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.politician = Politician.objects.create(name="テスト自治会", slug="test", line_channel_secret="s", line_access_token="t")
+        cls.course = Course.objects.create(title="防災の案内")
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx)
+
+    def assertConstantQueries(self, url, add_rows):
+        add_rows(0, 3)
+        # 初回だけ読み込まれるもの（ContentType など）を除くため、一度開いてから数える
+        self.count_queries(url)
+        few = self.count_queries(url)
+        add_rows(3, 30)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_userprogress_changelist(self):
+        def add_rows(start, end):
+            for i in range(start, end):
+                course = Course.objects.create(title=f"案内{i}")
+                UserProgress.objects.create(line_user_id=f"U{i}", politician=self.politician, current_course=course)
+        self.assertConstantQueries('/admin/bot/userprogress/', add_rows)
+
+    def test_messagelog_changelist(self):
+        def add_rows(start, end):
+            for i in range(start, end):
+                member = AiMember.objects.create(line_user_id=f"U{i}", real_name=f"住民{i}")
+                MessageLog.objects.create(member=member, role='user', text="こんにちは")
+        self.assertConstantQueries('/admin/bot/messagelog/', add_rows)
+
+    def test_course_change_page(self):
+        def add_rows(start, end):
+            for i in range(start, end):
+                CourseContent.objects.create(course=self.course, order=i + 1, title=f"ステップ{i}")
+        self.assertConstantQueries(f'/admin/bot/course/{self.course.pk}/change/', add_rows)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+
+    def test_estimates_only_unfiltered_large_tables(self):
+        for i in range(5):
+            AiMember.objects.create(line_user_id=f"U{i}", real_name=f"住民{i}")
+        AiMember.objects.filter(line_user_id="U0").delete()
+        with mock.patch.object(EstimatedCountPaginator, 'threshold', 1):
+            # 見積もりは削除分を数えない（SQLiteでは最大の行番号）
+            self.assertEqual(EstimatedCountPaginator(AiMember.objects.order_by('pk'), 10).count, 5)
+            self.assertEqual(EstimatedCountPaginator(AiMember.objects.filter(real_name__startswith="住民").order_by('pk'), 10).count, 4)
+        self.assertEqual(EstimatedCountPaginator(AiMember.objects.order_by('pk'), 10).count, 4)
+
+
+class CsvExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', password='pass', is_staff=True)
+        cls.politician = Politician.objects.create(name="テスト自治会", slug="test", line_channel_secret="s", line_access_token="t")
+        other = Politician.objects.create(name="別の自治会", slug="other", line_channel_secret="s", line_access_token="t")
+        course = Course.objects.create(title="防災の案内")
+        UserProgress.objects.create(line_user_id="U1", politician=cls.politician, current_course=course, last_completed_order=2)
+        UserProgress.objects.create(line_user_id="U2", politician=other, current_course=course)
+        # U3 は別の自治会の住民だが、テスト自治会の案内も使ったことがある。U4 はまだ案内を使っていない
+        UserProgress.objects.create(line_user_id="U3", politician=cls.politician, current_course=course)
+        for uid, politician in (("U1", cls.politician), ("U2", other), ("U3", other), ("U4", cls.politician)):
+            MessageLog.objects.create(member=AiMember.objects.create(line_user_id=uid, politician=politician), role='user', text=f"{uid}です")
+
+    def export(self, name, **params):
+        response = self.client.get(f'/bot/export/{name}.csv', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode('utf-8-sig').splitlines()
+
+    def test_staff_only(self):
+        response = self.client.get('/bot/export/aimember.csv')
+        self.assertEqual(response.status_code, 302)
+
+    def test_filters_by_tenant_and_date(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.export('userprogress', politician='test'), [
+            "LINEユーザーID,自治会,案内,確認済みのステップ,更新日時",
+            f"U1,test,防災の案内,2,{timezone.localtime(UserProgress.objects.get(line_user_id='U1').updated_at):%Y-%m-%d %H:%M:%S}",
+            # 進捗は自治会ごとの行なので、別の自治会の住民でもこの自治会の案内の進捗は含める
+            f"U3,test,防災の案内,0,{timezone.localtime(UserProgress.objects.get(line_user_id='U3').updated_at):%Y-%m-%d %H:%M:%S}",
+        ])
+        self.assertEqual([row.split(",")[0] for row in self.export('messagelog', politician='test')[1:]], ["U1", "U4"])
+        self.assertEqual([row.split(",")[:2] for row in self.export('aimember', politician='test')[1:]], [["U1", "test"], ["U4", "test"]])
+        self.assertEqual(len(self.export('aimember')), 5)
+        self.assertEqual(len(self.export('aimember', until='2000-01-01')), 1)
+        self.assertEqual(self.client.get('/bot/export/aimember.csv', {'since': 'yesterday'}).status_code, 400)
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_prometheus_text(self):
+        metrics.inc('webhook_invalid_signature_total')
+        metrics.observe('webhook_event_seconds', 0.02, command='calendar')
+        metrics.observe('webhook_event_db_queries', 3, bounds=metrics.COUNT_BUCKETS, command='calendar')
+        text = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('# TYPE webhook_invalid_signature_total counter\nwebhook_invalid_signature_total 1\n', text)
+        self.assertIn('webhook_event_seconds_bucket{command="calendar",le="0.01"} 0\n', text)
+        self.assertIn('webhook_event_seconds_bucket{command="calendar",le="0.025"} 1\n', text)
+        self.assertIn('webhook_event_db_queries_bucket{command="calendar",le="3"} 1\n', text)
+        self.assertIn('webhook_event_db_queries_count{command="calendar"} 1\n', text)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((metrics.percentile(values, 50), metrics.percentile(values, 99), metrics.percentile(values, 100)), (51, 100, 100))
+        self.assertEqual(metrics.percentile([], 50), 0.0)
+
+    def test_token_required(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer \u00e9').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_not_served_without_token(self):
+        # DEBUG の有無に関係なく、トークンを設定していなければ公開しない
+        for debug in (False, True):
+            with self.subTest(debug=debug), override_settings(DEBUG=debug):
+                self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+class CommandBudgetTests(TestCase):
+    """
+    views.COMMAND_BUDGETS の上限（SQLの回数・処理時間）を超えていないか、コマンドごとに webhook を送って確認する
+    LINE・OpenAI はローカルの代わりのサーバーに向けるため、外部には接続しません
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        line = cls.enterClassContext(FakeLineServer())
+        openai = cls.enterClassContext(FakeOpenAIServer())
+        cls.enterClassContext(override_settings(
+            LINE_API_ENDPOINT=line.url,
+            LINE_OUTBOUND_SYNC=True,
+            WEBHOOK_SYNC=True,
+            OPENAI_BASE_URL=f'{openai.url}/v1',
+            # 計測の途中で版番号の確認（bot/caching.py）が入らないようにする
+            CACHE_VERSION_CHECK_SECONDS=3600,
+        ))
+        # 診断設定（bot/diagnostics.py）の読み直しも計測に入らないようにする
+        cls.enterClassContext(mock.patch.object(diagnostics, 'SETTINGS_TTL', 3600))
+        # 本番では起動直後に裏で読み込む（bot/warmup.py）ため、openai などの初回 import も計測から外す
+        warmup.preload()
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.get(code='miyazaki_kita_a')
+        cls.politician = Politician.objects.create(
+            name="テスト自治会", slug="test", line_channel_secret="s", line_access_token="t",
+            openai_api_key="sk-test", gomi_region=region,
+        )
+        today = timezone.localdate()
+        GarbageCalendar.objects.bulk_create([
+            GarbageCalendar(municipality=region.municipality, district=region.district,
+                            collection_date=today + timedelta(days=d), garbage_type="可燃ごみ")
+            for d in range(0, 30, 3)
+        ])
+        cls.course = Course.objects.create(title="防災の案内")
+        CourseAssignment.objects.create(politician=cls.politician, course=cls.course)
+        cls.steps = [CourseContent.objects.create(course=cls.course, order=i + 1, title=f"ステップ{i + 1}") for i in range(3)]
+        AiMember.objects.bulk_create([AiMember(line_user_id=f"U{i}", registration_step=3) for i in range(2)])
+
+    def scenarios(self):
+        """コマンド名 → 住民IDを受け取り (準備のイベント, 計測するイベント) を返す関数"""
+        course_id = self.course.pk
+        return {
+            'follow': lambda uid: ([], [follow_event(f"N{uid}")]),
+            'registration': lambda uid: (
+                [follow_event(f"R{uid}")],
+                [text_event(f"R{uid}", "こんにちは"), text_event(f"R{uid}", "宮崎 太郎"), text_event(f"R{uid}", "北町1丁目")],
+            ),
+            'calendar': lambda uid: ([], [text_event(uid, "ゴミ出しカレンダー")]),
+            'events': lambda uid: ([], [text_event(uid, "イベント")]),
+            'contact': lambda uid: ([], [text_event(uid, "お問い合わせ")]),
+            'course_list': lambda uid: ([], [text_event(uid, "案内一覧"), postback_event(uid, postback.list_page(1))]),
+            'course_text': lambda uid: ([], [text_event(uid, f"教材開始:{course_id}")]),
+            'course_postback': lambda uid: ([], [
+                postback_event(uid, postback.course("教材開始", course_id)),
+                postback_event(uid, postback.course("教材進捗", course_id, self.steps[0].pk)),
+                postback_event(uid, postback.course("教材次へ", course_id)),
+                postback_event(uid, postback.course("教材復習", course_id)),
+            ]),
+            'ai': lambda uid: ([], [text_event(uid, "明日は何のごみの日ですか？")]),
+        }
+
+    def reset_caches(self):
+        cache.clear()
+        regions.invalidate()
+        courses.invalidate_course_index()
+        addresses.invalidate(self.politician.pk)
+        caching.forget()
+        diagnostics.reload()
+        diagnostics.current()
+
+    def run_events(self, events):
+        """webhook を1件ずつ送り、(SQLの回数, 秒) の最大を返す"""
+        most_queries = most_seconds = 0
+        for event in events:
+            with CaptureQueriesContext(connection) as ctx:
+                began = time.perf_counter()
+                response = post_webhook(self.client, self.politician, event)
+                elapsed = time.perf_counter() - began
+            self.assertEqual(response.status_code, 200)
+            most_queries = max(most_queries, len(ctx))
+            most_seconds = max(most_seconds, elapsed)
+        return most_queries, most_seconds
+
+    def test_every_budget_has_a_scenario(self):
+        self.assertEqual(set(self.scenarios()), set(views.COMMAND_BUDGETS))
+
+    def test_commands_stay_within_budget(self):
+        for name, scenario in self.scenarios().items():
+            budget = views.COMMAND_BUDGETS[name]
+            with self.subTest(command=name):
+                metrics.reset()
+                self.reset_caches()
+                prepare, measured = scenario("U0")
+                self.run_events(prepare)
+                self.reset_caches()
+                queries, seconds = self.run_events(measured)
+                self.assertLessEqual(queries, budget.queries, f"{name}: キャッシュが空の状態でSQLが {queries} 回")
+                self.assertLessEqual(seconds, budget.seconds, f"{name}: {seconds:.3f}秒かかりました")
+
+                prepare, measured = scenario("U1")
+                # 登録済みの住民の登録状態（members/state.py）も読み込み済みにしておく
+                self.run_events([text_event("U1", "お問い合わせ")] + prepare)
+                queries, seconds = self.run_events(measured)
+                self.assertLessEqual(queries, budget.cached_queries, f"{name}: キャッシュが温まった状態でSQLが {queries} 回")
+                self.assertLessEqual(seconds, budget.seconds, f"{name}: {seconds:.3f}秒かかりました")
+
+                # 想定したコマンドとして処理されたか（views の計測ラベルで確認）
+                commands = {dict(labels).get('command') for (metric, labels) in metrics.snapshot()['histograms'] if metric == 'webhook_event_seconds'}
+                self.assertIn(name, commands)
+
+
+class DiagnosticsTests(TestCase):
+    """遅いリクエストの記録とプロファイラ（LINE の代わりのサーバーを遅くして確かめる）"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        line = cls.enterClassContext(FakeLineServer(latency=0.05))
+        cls.profile_dir = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.enterClassContext(override_settings(
+            LINE_API_ENDPOINT=line.url, LINE_OUTBOUND_SYNC=True, WEBHOOK_SYNC=True, PROFILE_DIR=cls.profile_dir,
+        ))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.politician = Politician.objects.create(
+            name="診断用自治会", slug='diag', line_channel_secret='secret', line_access_token='token',
+        )
+        cls.other = Politician.objects.create(
+            name="別の自治会", slug='diag-other', line_channel_secret='secret', line_access_token='token',
+        )
+        AiMember.objects.create(line_user_id='U0', registration_step=3)
+
+    def setUp(self):
+        diagnostics.reload()
+        self.addCleanup(diagnostics.reload)
+
+    def contact(self, politician):
+        response = post_webhook(self.client, politician, text_event('U0', "お問い合わせ"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_slow_request_is_logged_with_breakdown(self):
+        DiagnosticsSetting.objects.create(pk=1, slow_request_ms=10)
+        with self.assertLogs('bot.slow_request', 'WARNING') as logs:
+            self.contact(self.politician)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['politician'], 'diag')
+        self.assertEqual([c['command'] for c in record['commands']], ['contact'])
+        self.assertGreaterEqual(record['stages']['reply'], 50)
+        self.assertEqual(record['db']['count'], len(record['queries']))
+        self.assertTrue(any('bot_politician' in q['sql'] for q in record['queries']))
+        self.assertIsNone(record['profile'])
+
+    def test_fast_request_is_not_logged(self):
+        DiagnosticsSetting.objects.create(pk=1, slow_request_ms=10_000)
+        with self.assertNoLogs('bot.slow_request'):
+            self.contact(self.politician)
+
+    def test_settings_query_failure_does_not_fail_the_request(self):
+        DiagnosticsSetting.objects.create(pk=1, slow_request_ms=10, profile_enabled=True, profile_politician=self.politician)
+        before = set(os.listdir(self.profile_dir))
+        with mock.patch.object(DiagnosticsSetting.objects, 'select_related', side_effect=DatabaseError("locked")):
+            setting = diagnostics.current()
+            self.contact(self.politician)
+        # 既定の設定で動き、プロファイラは使わない
+        self.assertEqual(setting.slow_request_ms, DiagnosticsSetting._meta.get_field('slow_request_ms').default)
+        self.assertFalse(setting.profile_enabled)
+        self.assertEqual(set(os.listdir(self.profile_dir)), before)
+
+    def test_profiles_only_the_chosen_politician(self):
+        DiagnosticsSetting.objects.create(pk=1, slow_request_ms=0, profile_enabled=True, profile_politician=self.politician)
+        self.contact(self.other)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+        self.contact(self.politician)
+        files = os.listdir(self.profile_dir)
+        self.assertEqual(len(files), 1)
+        self.assertIn('_diag_', files[0])
+        with open(os.path.join(self.profile_dir, files[0]), encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        # 「関数;関数;… 回数」の形式で、webhook の処理が含まれている
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertTrue(count.isdigit())
+        self.assertTrue(any('callback (bot/views.py' in line for line in lines))
+
+
+@override_settings(WEBHOOK_SYNC=False)
+class AsyncWebhookDiagnosticsTests(TransactionTestCase):
+    """キューに積んだ webhook の処理（ワーカーのスレッドが別の接続で読むので、データは確定させる）"""
+    serialized_rollback = True
+
+    def setUp(self):
+        line = self.enterContext(FakeLineServer(latency=0.05))
+        self.enterContext(override_settings(LINE_API_ENDPOINT=line.url, LINE_OUTBOUND_SYNC=True))
+        self.politician = Politician.objects.create(
+            name="診断用自治会", slug='diag', line_channel_secret='secret', line_access_token='token',
+        )
+        AiMember.objects.create(line_user_id='U0', registration_step=3)
+        DiagnosticsSetting.objects.create(pk=1, slow_request_ms=10)
+        diagnostics.reload()
+        self.addCleanup(diagnostics.reload)
+        self.scheduler = TenantScheduler(workers=2, tenant_concurrency=1)
+        self.enterContext(mock.patch.object(scheduler_module, 'scheduler', self.scheduler))
+
+    def test_slow_job_is_logged_from_the_worker(self):
+        with self.assertLogs('bot.slow_request', 'WARNING') as logs:
+            response = post_webhook(self.client, self.politician, text_event('U0', "お問い合わせ"))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(self.scheduler.wait_idle(5))
+        records = [json.loads(r.getMessage()) for r in logs.records]
+        job = next(r for r in records if r.get('job') == 'webhook')
+        self.assertEqual(job['politician'], 'diag')
+        self.assertEqual([c['command'] for c in job['commands']], ['contact'])
+        self.assertGreaterEqual(job['stages']['reply'], 50)
+        self.assertTrue(any('members_aimember' in q['sql'] for q in job['queries']))
+
+
+class WarmupTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_preload_imports_views_and_heavy_modules(self):
+        timings = warmup.preload()
+        self.assertEqual(set(timings), {'urls', *warmup.HEAVY_MODULES})
+        for name in warmup.HEAVY_MODULES:
+            self.assertIn(name, sys.modules)
+        histograms = metrics.snapshot()['histograms']
+        self.assertIn(('startup_preload_seconds', (('module', 'urls'),)), histograms)
+
+    @override_settings(WARMUP_ON_START=False)
+    def test_start_can_be_disabled(self):
+        self.assertIsNone(warmup.start())
+
+
+class CacheVersionTests(TestCase):
+    """ほかのプロセスでの変更（CacheVersion の版が上がる）を、手元のキャッシュが拾うか"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(title="防災の案内")
+        cls.other_course = Course.objects.create(title="ごみの出し方")
+        CourseContent.objects.create(course=cls.course, order=1, title="ステップ1")
+
+    def setUp(self):
+        caching.forget()
+        regions.invalidate()
+        courses.invalidate_course_index()
+        self.addCleanup(caching.forget)
+
+    def bump_elsewhere(self, name):
+        """ほかのプロセスが bump() した状態を作る（このプロセスの手元の版・キャッシュはそのまま）"""
+        rows = CacheVersion.objects.filter(name=name)
+        if not rows.update(version=F('version') + 1):
+            CacheVersion.objects.create(name=name, version=1)
+
+    def test_region_index_is_rebuilt_after_change_elsewhere(self):
+        Region.objects.create(code='version-test', municipality="計測市", district="北地区")
+        self.assertEqual(regions.lookup('version-test'), ("計測市", "北地区"))
+        # シグナルを通らない変更は、版が上がるまで手元のインデックスに反映されない
+        Region.objects.filter(code='version-test').update(district="南地区")
+        caching.check(force=True)
+        self.assertEqual(regions.lookup('version-test'), ("計測市", "北地区"))
+
+        self.bump_elsewhere(regions.VERSION)
+        caching.check(force=True)
+        self.assertEqual(regions.lookup('version-test'), ("計測市", "南地区"))
+
+    def test_only_the_changed_course_is_dropped(self):
+        index = courses.get_course_index(self.course.pk)
+        other = courses.get_course_index(self.other_course.pk)
+        self.bump_elsewhere(f'{courses.INDEX_VERSION}:{self.course.pk}')
+        caching.check(force=True)
+        self.assertIsNot(courses.get_course_index(self.course.pk), index)
+        self.assertIs(courses.get_course_index(self.other_course.pk), other)
+
+    def test_keys_change_with_version(self):
+        key = caching.make_key(courses.LIST_NAMESPACE, 1)
+        self.bump_elsewhere(courses.LIST_NAMESPACE)
+        caching.check(force=True)
+        self.assertNotEqual(caching.make_key(courses.LIST_NAMESPACE, 1), key)
+
+    def test_local_bump_applies_immediately(self):
+        index = courses.get_course_index(self.course.pk)
+        CourseContent.objects.create(course=self.course, order=2, title="ステップ2")
+        self.assertEqual(courses.get_course_index(self.course.pk).orders, [1, 2])
+        self.assertIsNot(courses.get_course_index(self.course.pk), index)
+
+    @override_settings(CACHE_VERSION_CHECK_SECONDS=60)
+    def test_versions_are_read_at_most_once_per_interval(self):
+        with self.assertNumQueries(1):
+            caching.check()
+            caching.check()
+            caching.make_key(courses.LIST_NAMESPACE, 1)
+
+
+class TenantSchedulerTests(SimpleTestCase):
+
+    def setUp(self):
+        # 順番だけを確かめるテストなので、ワーカーが読む診断設定はDBを使わず既定値にする
+        self.enterContext(mock.patch.object(diagnostics, 'current', return_value=DiagnosticsSetting(pk=1)))
+
+    def run_jobs(self, scheduler, jobs):
+        """ワーカーを1件目で止めている間にすべて積み、流した後の処理順を返す"""
+        started, gate = threading.Event(), threading.Event()
+        order = []
+
+        def hold():
+            started.set()
+            gate.wait(5)
+
+        scheduler.submit('gate', hold)
+        self.assertTrue(started.wait(5))
+        for tenant, name, *weight in jobs:
+            scheduler.submit(tenant, functools.partial(order.append, name), *weight)
+        gate.set()
+        self.assertTrue(scheduler.wait_idle(5))
+        return order
+
+    def test_tenants_are_served_round_robin(self):
+        scheduler = TenantScheduler(workers=1, tenant_concurrency=1, close_connections=False)
+        jobs = [('big', 'big1'), ('big', 'big2'), ('big', 'big3'), ('big', 'big4'), ('small', 'small1'), ('small', 'small2')]
+        self.assertEqual(self.run_jobs(scheduler, jobs), ['big1', 'small1', 'big2', 'small2', 'big3', 'big4'])
+
+    def test_weight_gives_consecutive_turns(self):
+        scheduler = TenantScheduler(workers=1, tenant_concurrency=1, close_connections=False)
+        jobs = [('big', 'big1', 2), ('big', 'big2', 2), ('big', 'big3', 2), ('big', 'big4', 2), ('small', 'small1'), ('small', 'small2')]
+        self.assertEqual(self.run_jobs(scheduler, jobs), ['big1', 'big2', 'small1', 'big3', 'big4', 'small2'])
+
+    def test_busy_tenant_cannot_take_every_worker(self):
+        scheduler = TenantScheduler(workers=2, tenant_concurrency=1, close_connections=False)
+        gate = threading.Event()
+        done = threading.Event()
+        scheduler.submit('big', lambda: gate.wait(5))
+        scheduler.submit('big', lambda: None)
+        scheduler.submit('small', done.set)
+        # 集中した自治会の1件目が終わらなくても、ほかの自治会は2つ目のワーカーで処理される
+        self.assertTrue(done.wait(5))
+        self.assertEqual(scheduler.depth()['big'], (1, 1))
+        gate.set()
+        self.assertTrue(scheduler.wait_idle(5))
+        self.assertEqual(scheduler.depth(), {})
+
+    def test_same_user_runs_in_order_while_others_proceed(self):
+        scheduler = TenantScheduler(workers=4, tenant_concurrency=4, close_connections=False)
+        gate, other_done = threading.Event(), threading.Event()
+        order = []
+
+        def first():
+            gate.wait(5)
+            order.append('U1-1')
+
+        scheduler.submit('t', first, keys={'U1'})
+        scheduler.submit('t', functools.partial(order.append, 'U1U2'), keys={'U1', 'U2'})
+        scheduler.submit('t', functools.partial(order.append, 'U2'), keys={'U2'})
+        scheduler.submit('t', other_done.set, keys={'U3'})
+        # 空いているワーカーがあっても、U1 の2件目と、それより後に積んだ U2 の処理は待つ。U3 は先に進む
+        self.assertTrue(other_done.wait(5))
+        self.assertEqual(order, [])
+        self.assertEqual(scheduler.depth()['t'][0], 2)
+        gate.set()
+        self.assertTrue(scheduler.wait_idle(5))
+        self.assertEqual(order, ['U1-1', 'U1U2', 'U2'])
+
+    def test_webhook_users(self):
+        body = webhook_body(follow_event('U1'), text_event('U2', "こんにちは"), text_event('U1', "お問い合わせ"))
+        self.assertEqual(views.source_users(body), {'U1', 'U2'})
+        self.assertEqual(views.source_users('{"events": [{"type": "unfollow"}]}'), set())
+        self.assertEqual(views.source_users('not json'), set())
+
+    def test_queue_depth_is_exported(self):
+        metrics_text = metrics.render_prometheus()
+        self.assertIn('# TYPE webhook_queue_depth gauge', metrics_text)
+        self.assertIn('# TYPE webhook_running gauge', metrics_text)
+
+
+class StaticFilesTests(TestCase):
+    """collectstatic で作ったハッシュ付き・圧縮済みのファイルを、アプリから返せるか"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.enterClassContext(override_settings(STATIC_ROOT=cls.root))
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_hashed_url_is_served_compressed_with_long_cache(self):
+        url = static('admin/css/base.css')
+        self.assertRegex(url, r'^/static/admin/css/base\.[0-9a-f]{12}\.css$')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        with open(os.path.join(self.root, url[len('/static/'):]), 'rb') as f:
+            self.assertEqual(body, f.read())
+
+        # 圧縮版と元のファイルは別の ETag。送られた ETag が、選んだ形式のものと一致する時だけ 304
+        plain = self.client.get(url)
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+        self.assertTrue(response['ETag'].endswith('-gzip"'))
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=f'W/{response["ETag"]}').status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=plain['ETag']).status_code, 304)
+
+    def test_encodings_refused_with_q_zero_are_not_sent(self):
+        url = static('admin/css/base.css')
+        for accept, expected in (
+            ('gzip;q=0', None),
+            ('gzip;q=0, identity', None),
+            ('*;q=0, gzip;q=0', None),
+            ('br;q=0, *', 'gzip'),
+            ('deflate, GZIP;q=0.8', 'gzip'),
+            ('gzip, br', 'br'),
+        ):
+            with self.subTest(accept=accept):
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING=accept)
+                self.assertEqual(response.get('Content-Encoding'), expected)
+
+    def test_plain_request_and_unhashed_name(self):
+        response = self.client.get('/static/admin/css/base.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=300')
+
+    def test_files_changed_without_restart_are_rechecked(self):
+        # ほかのテストが使う STATIC_ROOT を変えないよう、別の一時ディレクトリで確かめる
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(STATIC_ROOT=root))
+        path = os.path.join(root, 'app.css')
+        with open(path, 'w') as f:
+            f.write("body { color: red; }\n" * 50)
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(b"stale"))
+        first = self.client.get('/static/app.css', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+
+        # collectstatic で中身が変わり、圧縮版は作られなかった
+        os.remove(path + '.gz')
+        with open(path, 'w') as f:
+            f.write("body { color: blue; }\n")
+        second = self.client.get('/static/app.css', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', second)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(b''.join(second.streaming_content), b"body { color: blue; }\n")
+
+        os.remove(path)
+        self.assertEqual(self.client.get('/static/app.css').status_code, 404)
+
+    def test_outside_static_root_is_not_served(self):
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/static/admin/css/base.css.gz').status_code, 404)
+
+    def test_report_shows_bytes_saved(self):
+        out = io.StringIO()
+        call_command('static_report', top=3, stdout=out)
+        self.assertRegex(out.getvalue(), r'ファイル  元の大きさ [\d,]+KB → 送る大きさ [\d,]+KB（[\d,]+KB・\d+% 減）')
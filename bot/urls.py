@@ -1,9 +1,12 @@
 from django.urls import path
 from . import views
 from bot import views
+from bot import exports
 
 urlpatterns = [
     # 最終的なURLは https://aikouenkai.jp/bot/callback/ になります
     # path('callback/', views.callback, name='callback'),
     path('webhook/<slug:politician_slug>/', views.callback, name='callback'),
+    # 管理者向けCSV出力（例: /bot/export/messagelog.csv?politician=xxx&since=2025-04-01）
+    path('export/<str:name>.csv', exports.export_csv, name='export_csv'),
 ]
\ No newline at end of file
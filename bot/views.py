@@ -1,33 +1,93 @@
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import get_object_or_404
-from linebot import LineBotApi, WebhookHandler
+from linebot import WebhookHandler
 from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage, FlexSendMessage, FollowEvent
+from linebot.models import MessageEvent, TextMessage, TextSendMessage, FollowEvent, PostbackEvent
 from django.utils import timezone
 from datetime import timedelta
-from openai import OpenAI
+from collections import namedtuple
+import functools
+import hmac
+import json
 import time
 import re
 import traceback
 
-from .models import Politician, Event, Course, CourseContent, UserProgress, CourseAssignment, GarbageCalendar
-from members.models import AiMember
+from .models import Politician, UserProgress
+from . import addresses, bubbles, course_stats, courses, flex, garbage, metrics, outbound, postback, regions, scheduler
+from members import state as member_state
+from events.carousel import get_events_payload
 
-# ★Excelに入力した「市町村」と「地区」の文字と完全に一致させる必要があります
-REGION_MAP = {
-    'miyazaki_kita_a': ('宮崎市', '北A地区'),
-    'miyazaki_kita_b': ('宮崎市', '北B地区'),
-    'miyazaki_minami_a': ('宮崎市', '南A地区'),
-    'miyazaki_minami_b': ('宮崎市', '南B地区'),
+# 案内の進行ボタンから送られてくるコマンド
+COURSE_ACTIONS = ("教材開始:", "教材進捗:", "教材次へ:", "教材終了:", "教材復習:")
+
+# ★ コマンドごとの上限（1回の webhook で発行するSQLの回数と処理時間）
+#   queries: キャッシュが空の状態（起動直後の版番号の読み込み bot/caching.py を含む）、
+#   cached_queries: キャッシュが温まった状態で、ほかのコマンドを使ったことのある住民が初めてそのコマンドを使った場合
+#   （登録済みの住民の登録状態はキャッシュにあるので、住民の行は読まない）、
+#   seconds: 処理時間（外部APIの待ち時間を除く）。いずれも webhook 1件あたりの最大
+#   bot/tests.py の CommandBudgetTests で確認しています。処理を変えて回数が増える場合は、理由を確かめてからここを直してください
+Budget = namedtuple('Budget', 'queries cached_queries seconds')
+COMMAND_BUDGETS = {
+    'follow': Budget(9, 8, 0.25),
+    'registration': Budget(4, 3, 0.25),
+    'calendar': Budget(7, 2, 0.25),
+    'events': Budget(4, 1, 0.25),
+    'contact': Budget(3, 1, 0.25),
+    'course_list': Budget(4, 1, 0.25),
+    'course_text': Budget(15, 8, 0.25),
+    'course_postback': Budget(10, 7, 0.25),
+    'ai': Budget(7, 2, 1.0),
 }
 
+def source_users(body):
+    """webhook に含まれる住民のID（同じ住民のイベントは、キューでも届いた順に1件ずつ処理する）"""
+    try:
+        events = json.loads(body).get('events', [])
+    except (ValueError, AttributeError):
+        return frozenset()
+    return frozenset(
+        event['source']['userId'] for event in events
+        if isinstance(event, dict) and isinstance(event.get('source'), dict) and event['source'].get('userId')
+    )
+
+
 @csrf_exempt
 def callback(request, politician_slug):
-    politician = get_object_or_404(Politician, slug=politician_slug)
-    line_bot_api = LineBotApi(politician.line_access_token)
+    started = time.perf_counter()
+    with metrics.timer('webhook_stage_seconds', stage='tenant'):
+        politician = get_object_or_404(Politician, slug=politician_slug)
     handler = WebhookHandler(politician.line_channel_secret)
 
+    # 返信は送信キュー経由（チャネルごとのペース制御。必ず届けたいものは fallback_to でプッシュに切り替え）
+    def reply(reply_token, messages, fallback_to=None):
+        with metrics.timer('webhook_stage_seconds', stage='reply'):
+            outbound.send_reply(politician, reply_token, messages, fallback_to=fallback_to)
+
+    # ★ 計測：イベントごとの処理時間・SQLの回数と時間を、どのコマンドだったか（command）別に集計する
+    queries = metrics.QueryCounter()
+    current = {}
+
+    def command(name):
+        current['command'] = name
+
+    def measured(func):
+        @functools.wraps(func)
+        def wrapper(event):
+            current['command'] = 'other'
+            began, count, seconds = time.perf_counter(), queries.count, queries.seconds
+            try:
+                return func(event)
+            finally:
+                name = current['command']
+                metrics.observe('webhook_event_seconds', time.perf_counter() - began, command=name)
+                metrics.observe('webhook_event_db_queries', queries.count - count, bounds=metrics.COUNT_BUCKETS, command=name)
+                metrics.observe('webhook_event_db_seconds', queries.seconds - seconds, command=name)
+        return wrapper
+
     signature = request.META.get('HTTP_X_LINE_SIGNATURE', '')
     body = request.body.decode('utf-8')
 
@@ -41,21 +101,20 @@ def callback(request, politician_slug):
         return "#8E8E93" # グレー（その他）
 
     # 💡【AI用】裏でAIに渡すためのテキストカレンダー
-    def get_db_schedule_text():
+    def get_db_schedule_text(region_code):
         now_jst = timezone.localtime(timezone.now())
         today = now_jst.date()
-        muni_dist = REGION_MAP.get(politician.gomi_region)
+        muni_dist = regions.lookup(region_code)
         
         if not muni_dist:
             return "未設定", "未設定", "※地区情報が設定されていません。"
         
         muni_name, dist_name = muni_dist
-        schedules = GarbageCalendar.objects.filter(
-            municipality=muni_name, district=dist_name,
-            collection_date__gte=today, collection_date__lte=today + timedelta(days=30)
-        ).order_by('collection_date')
-        
-        if schedules.exists():
+        # 収集ルールの展開分と個別登録分をまとめて取得（bot/garbage.py）
+        with metrics.timer('webhook_stage_seconds', stage='garbage_schedule'):
+            schedules = garbage.get_schedule(muni_name, dist_name, today, today + timedelta(days=30))
+
+        if schedules:
             weekdays = ["月", "火", "水", "木", "金", "土", "日"]
             lines = []
             for s in schedules:
@@ -67,21 +126,19 @@ def callback(request, politician_slug):
         return muni_name, dist_name, "※直近30日の収集予定は登録されていません。"
 
     # 💡【人間用】LINE画面に表示する美しいビジュアルカレンダー（同日まとめ対応版）
-    def get_flex_schedule():
+    def get_flex_schedule(region_code):
         now_jst = timezone.localtime(timezone.now())
         today = now_jst.date()
-        muni_dist = REGION_MAP.get(politician.gomi_region)
+        muni_dist = regions.lookup(region_code)
         
         if not muni_dist:
             return TextSendMessage(text="※地区情報が設定されていません。")
         
         muni_name, dist_name = muni_dist
-        schedules = GarbageCalendar.objects.filter(
-            municipality=muni_name, district=dist_name,
-            collection_date__gte=today, collection_date__lte=today + timedelta(days=30)
-        ).order_by('collection_date')
+        with metrics.timer('webhook_stage_seconds', stage='garbage_schedule'):
+            schedules = garbage.get_schedule(muni_name, dist_name, today, today + timedelta(days=30))
 
-        if not schedules.exists():
+        if not schedules:
             return TextSendMessage(text=f"【{muni_name} {dist_name}】\n直近30日の収集予定は登録されていません。")
 
         # ★【新規追加】日付ごとに同じ日のスケジュールをひとまとめにする
@@ -92,68 +149,45 @@ def callback(request, politician_slug):
             grouped_schedules[s.collection_date].append(s)
 
         weekdays = ["月", "火", "水", "木", "金", "土", "日"]
-        contents = []
-        
-        # ★まとめられた日付ごとにループを回す
+        rows = []
+
+        # ★まとめられた日付ごとにループを回す（部品はコンパイル済みテンプレートに差し込むだけ）
         for date_obj, items in grouped_schedules.items():
             w = weekdays[date_obj.weekday()]
             date_str = f"{date_obj.month}/{date_obj.day}({w})"
-            
+
             # ゴミの種類を横並びにするためのテキスト（span）のリストを作成
             spans = []
             for i, item in enumerate(items):
-                color = get_garbage_color(item.garbage_type)
-                spans.append({"type": "span", "text": item.garbage_type, "color": color, "weight": "bold"})
-                
+                spans.append(bubbles.GARBAGE_SPAN.render(text=item.garbage_type, color=get_garbage_color(item.garbage_type)))
+
                 # 注意書きがあれば小さく追加
                 if item.notes:
-                    spans.append({"type": "span", "text": f"({item.notes})", "color": "#888888", "size": "xs"})
-                
+                    spans.append(bubbles.GARBAGE_NOTE_SPAN.render(text=f"({item.notes})"))
+
                 # 最後のアイテムでなければ区切り文字（ / ）を入れる
                 if i < len(items) - 1:
-                    spans.append({"type": "span", "text": " / ", "color": "#CCCCCC"})
-            
-            # 1日分の行を作成
-            row = {
-                "type": "box",
-                "layout": "horizontal",
-                "spacing": "sm",
-                "margin": "md",
-                "contents": [
-                    {"type": "text", "text": date_str, "size": "sm", "weight": "bold", "color": "#555555", "flex": 3},
-                    {"type": "text", "contents": spans, "size": "sm", "flex": 5, "wrap": True} # ←ここでspanを表示
-                ]
-            }
-            contents.append(row)
-            contents.append({"type": "separator", "margin": "md"})
-
-        # ビジュアルパネルの大枠を組み立てる
-        bubble = {
-            "type": "bubble",
-            "size": "mega",
-            "header": {
-                "type": "box", "layout": "vertical", "backgroundColor": "#1DB446",
-                "contents": [
-                    {"type": "text", "text": "📅 ゴミ収集カレンダー", "weight": "bold", "size": "lg", "color": "#FFFFFF"},
-                    {"type": "text", "text": f"{muni_name} {dist_name}（直近30日）", "size": "xs", "color": "#E5F7ED", "margin": "sm"}
-                ]
-            },
-            "body": {
-                "type": "box", "layout": "vertical", "spacing": "sm",
-                "contents": contents
-            }
-        }
-        return FlexSendMessage(alt_text="ゴミ出しカレンダー", contents=bubble)
-
-    def get_ai_response(user_text):
+                    spans.append(bubbles.GARBAGE_SEPARATOR_SPAN)
+
+            rows.append(bubbles.GARBAGE_ROW.render(date=date_str, spans=flex.join_array(spans)))
+            rows.append(bubbles.GARBAGE_ROW_SEPARATOR)
+
+        return flex.messages(bubbles.GARBAGE_CALENDAR.render(
+            subtitle=f"{muni_name} {dist_name}（直近30日）",
+            rows=flex.join_array(rows),
+        ))
+
+    def get_ai_response(user_text, region_code):
         if not politician.openai_api_key: return "AI設定未完了"
-        client = OpenAI(api_key=politician.openai_api_key.strip())
+        # openai は読み込みに0.5秒ほどかかるので、使う時に読み込む（起動直後に bot/warmup.py が裏で読み込んでおく）
+        from openai import OpenAI
+        client = OpenAI(api_key=politician.openai_api_key.strip(), base_url=settings.OPENAI_BASE_URL)
         
         now_jst = timezone.localtime(timezone.now())
         today = now_jst.date()
         weekday_str = ["月", "火", "水", "木", "金", "土", "日"][now_jst.weekday()]
         
-        muni_name, dist_name, schedule_text = get_db_schedule_text()
+        muni_name, dist_name, schedule_text = get_db_schedule_text(region_code)
         
         # 💡【修正】Windows特有の文字化けエラーを防ぐため、年月日の作り方を安全な形式に変更しました
         today_str = f"{today.year}年{today.month:02d}月{today.day:02d}日"
@@ -171,236 +205,249 @@ def callback(request, politician_slug):
         )
         
         try:
-            response = client.chat.completions.create(
-                model=politician.ai_model_name,
-                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_text}]
-            )
+            with metrics.timer('webhook_stage_seconds', stage='openai'):
+                response = client.chat.completions.create(
+                    model=politician.ai_model_name,
+                    messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_text}]
+                )
             return response.choices[0].message.content
         except Exception as e: return f"AIエラー: {str(e)}"
 
+    # 💡 案内の進行（開始・次へ・進捗・終了・復習）
+    def course_action(reply_token, line_user_id, action, course_id, content_id=None, order=None):
+        index = courses.get_course_index(course_id) if course_id else None
+        if not index:
+            reply(reply_token, TextSendMessage(text="情報が見つかりませんでした。"))
+            return
+
+        # 進捗の取得・作成（マルチテナント対応済）
+        progress, created = UserProgress.objects.get_or_create(
+            line_user_id=line_user_id,
+            current_course_id=index.course_id,
+            defaults={'politician': politician, 'last_completed_order': 0}
+        )
+        if created:
+            course_stats.record(progress.politician_id, index.course_id, None, progress.last_completed_order)
+
+        # --- 終了処理 ---
+        if action == "教材終了":
+            reply_text = f"☕ ご確認お疲れ様でした！\n『{index.title}』の続きは、メニューからいつでも再開できます。"
+            reply(reply_token, TextSendMessage(text=reply_text))
+            return
+
+        # --- 復習（見返し）処理 ---
+        if action == "教材復習":
+            completed_contents = index.completed(progress.last_completed_order)
+
+            if not completed_contents:
+                reply(reply_token, TextSendMessage(text="まだ見返せる案内がありません。まずは確認を進めましょう！"))
+                return
+
+            reply_text = f"📚 『{index.title}』の確認リストです\n\n"
+            for content in completed_contents:
+                reply_text += f"■ {content.title}\n"
+                if content.video_url:
+                    reply_text += f"🎬 {content.video_url}\n"
+                reply_text += "\n"
+
+            reply_text += "何度でも見返して確認できます✨"
+            reply(reply_token, TextSendMessage(text=reply_text))
+            return
+
+        # --- 進捗の保存処理 ---
+        if action == "教材進捗":
+            if content_id is not None:
+                content = index.content(content_id)
+                if content is None:
+                    reply(reply_token, TextSendMessage(text="情報が見つかりませんでした。"))
+                    return
+                order = content.order
+            if order is not None and progress.last_completed_order < order:
+                previous = progress.last_completed_order
+                progress.last_completed_order = order
+                # 同じボタンが二重に押されても集計を二重に動かさないよう、読んだ値のままの行だけ更新する
+                updated = UserProgress.objects.filter(pk=progress.pk, last_completed_order=previous).update(
+                    last_completed_order=order, updated_at=timezone.now(),
+                )
+                if updated:
+                    course_stats.record(progress.politician_id, index.course_id, previous, order)
+
+            if index.next_after(progress.last_completed_order):
+                reply(reply_token, flex.messages(bubbles.PROGRESS_SAVED.render(
+                    next_data=postback.course("教材次へ", index.course_id),
+                    end_data=postback.course("教材終了", index.course_id),
+                )))
+            else:
+                reply_text = f"🎉 おめでとうございます！\n『{index.title}』の全ご案内が完了しました！"
+                reply(reply_token, TextSendMessage(text=reply_text))
+            return
+
+        # --- 開始・次へ の処理 ---
+        if action == "教材開始" or action == "教材次へ":
+            next_content = index.next_after(progress.last_completed_order)
+
+            if next_content:
+                # テキストメッセージの作成
+                msg_text = f"📖 【{next_content.title}】\n\n{next_content.message_text}"
+                if next_content.video_url:
+                    msg_text += f"\n\n🎬 参考動画はこちら:\n{next_content.video_url}"
+
+                # 本文と「確認完了」ボタンをまとめて送る
+                progress_data = postback.course("教材進捗", index.course_id, next_content.id)
+                reply(reply_token, flex.messages(
+                    flex.text_message(msg_text),
+                    bubbles.STEP_BUTTONS.render(done_data=progress_data, skip_data=progress_data),
+                ))
+            else:
+                reply(reply_token, flex.messages(bubbles.COURSE_COMPLETED.render(
+                    message=f"すでに『{index.title}』を最後まで確認済みです！\n\n復習リストから過去の案内を再確認できます。",
+                    review_data=postback.course("教材復習", index.course_id),
+                )))
+
     @handler.add(FollowEvent)
+    @measured
     def handle_follow(event):
-        member, _ = AiMember.objects.get_or_create(line_user_id=event.source.user_id)
-        member.registration_step = 0
-        member.save()
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"【{politician.name}】へようこそ！お名前（姓名）を入力してください。"))
+        command('follow')
+        member_state.set_registration_step(event.source.user_id, member_state.STEP_GREETING, politician=politician)
+        reply(event.reply_token, TextSendMessage(text=f"【{politician.name}】へようこそ！お名前（姓名）を入力してください。"))
 
     @handler.add(MessageEvent, message=TextMessage)
+    @measured
     def handle_text_message(event):
         try:
             user_text = event.message.text.strip()
             line_user_id = event.source.user_id
-            member, _ = AiMember.objects.get_or_create(line_user_id=line_user_id)
-
-            if member.registration_step < 3:
-                if member.registration_step == 0:
-                    member.registration_step = 1
-                    member.save()
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text="姓と名の間にスペースを入れてください。"))
-                elif member.registration_step == 1:
-                    member.real_name = user_text
-                    member.registration_step = 2
-                    member.save()
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text="班名（〇〇班）または部屋番号をお願いします。"))
-                elif member.registration_step == 2:
-                    member.address = user_text
-                    member.registration_step = 3
-                    member.save()
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text="登録完了！ご活用ください。"))
+            # 登録済みの住民はキャッシュから読む（members/state.py）
+            step = member_state.get_registration_step(line_user_id, politician)
+
+            if step < member_state.STEP_REGISTERED:
+                command('registration')
+                # 変更する項目だけを書き込む
+                if step == member_state.STEP_GREETING:
+                    member_state.set_registration_step(line_user_id, member_state.STEP_NAME)
+                    reply(event.reply_token, TextSendMessage(text="姓と名の間にスペースを入れてください。"))
+                elif step == member_state.STEP_NAME:
+                    member_state.set_registration_step(line_user_id, member_state.STEP_ADDRESS, real_name=user_text)
+                    reply(event.reply_token, TextSendMessage(text="班名（〇〇班）または部屋番号をお願いします。"))
+                elif step == member_state.STEP_ADDRESS:
+                    member_state.set_registration_step(line_user_id, member_state.STEP_REGISTERED, address=user_text)
+                    # 住所から住民ごとのゴミ収集地区を決めておく（対応表がある自治会のみ）
+                    addresses.assign_member(politician, line_user_id, user_text)
+                    reply(event.reply_token, TextSendMessage(text="登録完了！ご活用ください。"), fallback_to=line_user_id)
                 return
-            
+
             # ▼ ゴミ出しカレンダーが押された時、ビジュアルパネル（Flex Message）をそのまま返す
             if user_text == "ゴミ出しカレンダー":
-                flex_msg = get_flex_schedule()
-                line_bot_api.reply_message(event.reply_token, flex_msg)
+                command('calendar')
+                flex_msg = get_flex_schedule(addresses.member_region(politician, line_user_id))
+                reply(event.reply_token, flex_msg)
+                return
+
+            # ▼ これから開催されるイベントの一覧（カルーセル・キャッシュ済みJSONをそのまま返す）
+            if user_text == "イベント":
+                command('events')
+                reply(event.reply_token, get_events_payload(politician))
                 return
 
             # 💡【今回ここを新規追加します】
             if user_text == "お問い合わせ":
+                command('contact')
                 # ↓ご自身のメールアドレスに書き換えてください
                 contact_email = "winwinmiyazaki@miyazaki-catv.ne.jp" 
                 msg = f"ご不明な点やご相談は、以下のメールアドレスまでお気軽にお問い合わせください。\n\n✉️ {contact_email}\n\n※送信の際は、お名前と地区名を添えていただけますとスムーズです。"
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=msg))
+                reply(event.reply_token, TextSendMessage(text=msg))
                 return
 
             # (前略) お問い合わせやゴミ出しカレンダーの処理...
 
             # ▼ 💡【変更】教材一覧の表示（カルーセル）
-            if user_text in ["案内一覧", "教材一覧", "ルール確認"]:
-                # CourseAssignment（自治会に紐づいた案内）を取得
-                assignments = CourseAssignment.objects.filter(politician=politician).order_by('id')
-                if not assignments.exists():
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text="現在、案内（教材）は準備中です。"))
+            # （件数が多い自治会は「案内一覧:2」のようにページ送り）
+            list_command = courses.parse_list_command(user_text, ["案内一覧", "教材一覧", "ルール確認"])
+            if list_command:
+                command('course_list')
+                # CourseAssignment（自治会に紐づいた案内）をJOIN1回で取得・描画済みのものはキャッシュから
+                payload = courses.get_course_list_payload(politician, page=list_command[1])
+                if payload is None:
+                    reply(event.reply_token, TextSendMessage(text="現在、案内（教材）は準備中です。"))
                     return
-                
-                contents = []
-                for a in assignments:
-                    course = a.course
-                    bubble = {
-                        "type": "bubble",
-                        "body": {
-                            "type": "box", "layout": "vertical",
-                            "contents": [
-                                {"type": "text", "text": "自治会のご案内", "color": "#1DB446", "size": "sm", "weight": "bold"},
-                                {"type": "text", "text": course.title, "weight": "bold", "size": "xl", "margin": "md", "wrap": True},
-                            ]
-                        },
-                        "footer": {
-                            "type": "box", "layout": "vertical",
-                            "contents": [
-                                {
-                                    "type": "button", "style": "primary", "color": "#1DB446",
-                                    "action": {"type": "message", "label": "確認を始める", "text": f"教材開始:{course.title}"}
-                                }
-                            ]
-                        }
-                    }
-                    contents.append(bubble)
-                flex_message = FlexSendMessage(alt_text="案内一覧", contents={"type": "carousel", "contents": contents})
-                line_bot_api.reply_message(event.reply_token, flex_message)
+                reply(event.reply_token, payload)
                 return
 
             # ▼ 💡【変更】学習（案内）のサイクル処理
-            if user_text.startswith("教材開始:") or user_text.startswith("教材進捗:") or user_text.startswith("教材次へ:") or user_text.startswith("教材終了:") or user_text.startswith("教材復習:"):
+            # 現在のボタンはpostback（handle_postback）。ここは以前に送ったテキスト形式のボタン用
+            if user_text.startswith(COURSE_ACTIONS):
+                command('course_text')
                 parts = user_text.split(":")
                 action = parts[0]
-                title = parts[1]
-                
-                course = Course.objects.filter(title=title).first()
-                if not course:
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text="情報が見つかりませんでした。"))
-                    return
+                course_id = courses.resolve_course(politician, parts[1]) if len(parts) > 1 else None
+                content_id = order = None
+                if action == "教材進捗" and len(parts) > 2 and parts[2].isdigit():
+                    # 旧形式（タイトル:順番）のボタンは順番、新形式はステップIDが入っている
+                    if parts[1].isdigit():
+                        content_id = int(parts[2])
+                    else:
+                        order = int(parts[2])
+                course_action(event.reply_token, line_user_id, action, course_id, content_id=content_id, order=order)
+                return
 
-                # 進捗の取得・作成（マルチテナント対応済）
-                progress, _ = UserProgress.objects.get_or_create(
-                    line_user_id=line_user_id,
-                    current_course=course,
-                    defaults={'politician': politician, 'last_completed_order': 0}
-                )
+            command('ai')
+            reply(event.reply_token, TextSendMessage(text=get_ai_response(user_text, addresses.member_region(politician, line_user_id))))
 
-                # --- 終了処理 ---
-                if action == "教材終了":
-                    reply_text = f"☕ ご確認お疲れ様でした！\n『{course.title}』の続きは、メニューからいつでも再開できます。"
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
-                    return
-
-                # --- 復習（見返し）処理 ---
-                if action == "教材復習":
-                    completed_contents = CourseContent.objects.filter(
-                        course=course,
-                        order__lte=progress.last_completed_order
-                    ).order_by('order')
-
-                    if not completed_contents.exists():
-                        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="まだ見返せる案内がありません。まずは確認を進めましょう！"))
-                        return
-                    
-                    reply_text = f"📚 『{course.title}』の確認リストです\n\n"
-                    for content in completed_contents:
-                        reply_text += f"■ {content.title}\n"
-                        if content.video_url:
-                            reply_text += f"🎬 {content.video_url}\n"
-                        reply_text += "\n"
-                    
-                    reply_text += "何度でも見返して確認できます✨"
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
-                    return
+        except Exception as e:
+            reply(event.reply_token, TextSendMessage(text=f"エラー: {str(e)}"))
 
-                # --- 進捗の保存処理 ---
-                if action == "教材進捗":
-                    completed_order = int(parts[2])
-                    if progress.last_completed_order < completed_order:
-                        progress.last_completed_order = completed_order
-                        progress.save()
-                    
-                    next_content = CourseContent.objects.filter(
-                        course=course,
-                        order__gt=progress.last_completed_order
-                    ).order_by('order').first()
-
-                    if next_content:
-                        bubble = {
-                            "type": "bubble",
-                            "body": {
-                                "type": "box", "layout": "vertical",
-                                "contents": [
-                                    {"type": "text", "text": "✅ 記録を保存しました", "weight": "bold", "color": "#1DB446", "size": "md"},
-                                    {"type": "text", "text": "続けて次の案内に進みますか？", "wrap": True, "size": "sm", "margin": "md"}
-                                ]
-                            },
-                            "footer": {
-                                "type": "box", "layout": "vertical", "spacing": "sm",
-                                "contents": [
-                                    {"type": "button", "style": "primary", "color": "#1DB446", "action": {"type": "message", "label": "次に進む", "text": f"教材次へ:{course.title}"}},
-                                    {"type": "button", "style": "secondary", "action": {"type": "message", "label": "一旦終了する", "text": f"教材終了:{course.title}"}}
-                                ]
-                            }
-                        }
-                        line_bot_api.reply_message(event.reply_token, FlexSendMessage(alt_text="次に進みますか？", contents=bubble))
-                    else:
-                        reply_text = f"🎉 おめでとうございます！\n『{course.title}』の全ご案内が完了しました！"
-                        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
-                    return
+    # ▼ ボタン（postback）からの操作。テキスト処理を通さず、案内の処理へ直接つなぐ
+    @handler.add(PostbackEvent)
+    @measured
+    def handle_postback(event):
+        try:
+            decoded = postback.decode(event.postback.data)
+            if decoded is None:
+                return
+            code, ids = decoded
 
-                # --- 開始・次へ の処理 ---
-                if action == "教材開始" or action == "教材次へ":
-                    next_content = CourseContent.objects.filter(
-                        course=course,
-                        order__gt=progress.last_completed_order
-                    ).order_by('order').first()
-
-                    if next_content:
-                        # テキストメッセージの作成
-                        msg_text = f"📖 【{next_content.title}】\n\n{next_content.message_text}"
-                        if next_content.video_url:
-                            msg_text += f"\n\n🎬 参考動画はこちら:\n{next_content.video_url}"
-                        
-                        text_msg = TextSendMessage(text=msg_text)
-                        
-                        # ボタン（FlexMessage）の作成
-                        bubble = {
-                            "type": "bubble",
-                            "body": {
-                                "type": "box", "layout": "vertical",
-                                "contents": [{"type": "text", "text": "確認が終わったらボタンを押して記録しましょう👇", "wrap": True, "size": "sm", "color": "#666666"}]
-                            },
-                            "footer": {
-                                "type": "box", "layout": "horizontal", "spacing": "sm",
-                                "contents": [
-                                    {"type": "button", "style": "primary", "color": "#1DB446", "action": {"type": "message", "label": "確認完了", "text": f"教材進捗:{course.title}:{next_content.order}"}},
-                                    {"type": "button", "style": "secondary", "action": {"type": "message", "label": "スキップ", "text": f"教材進捗:{course.title}:{next_content.order}"}}
-                                ]
-                            }
-                        }
-                        flex_msg = FlexSendMessage(alt_text="確認完了ボタン", contents=bubble)
-                        line_bot_api.reply_message(event.reply_token, [text_msg, flex_msg])
-                    else:
-                        bubble = {
-                            "type": "bubble",
-                            "body": {
-                                "type": "box", "layout": "vertical",
-                                "contents": [
-                                    {"type": "text", "text": "🎉 すべて確認済みです", "weight": "bold", "color": "#1DB446", "size": "md"},
-                                    {"type": "text", "text": f"すでに『{course.title}』を最後まで確認済みです！\n\n復習リストから過去の案内を再確認できます。", "wrap": True, "size": "sm", "margin": "md"}
-                                ]
-                            },
-                            "footer": {
-                                "type": "box", "layout": "vertical", "spacing": "sm",
-                                "contents": [
-                                    {"type": "button", "style": "primary", "color": "#1DB446", "action": {"type": "message", "label": "復習リストを見る", "text": f"教材復習:{course.title}"}}
-                                ]
-                            }
-                        }
-                        line_bot_api.reply_message(event.reply_token, FlexSendMessage(alt_text="全確認完了", contents=bubble))
-                    return
+            if code == postback.LIST_PAGE:
+                command('course_list')
+                payload = courses.get_course_list_payload(politician, page=ids[0])
+                if payload is not None:
+                    reply(event.reply_token, payload)
+                return
 
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=get_ai_response(user_text)))
+            action = postback.COURSE_ACTIONS.get(code)
+            if action is None:
+                return
+            command('course_postback')
+            course_id = courses.resolve_course(politician, ids[0])
+            content_id = ids[1] if len(ids) > 1 else None
+            course_action(event.reply_token, event.source.user_id, action, course_id, content_id=content_id)
 
         except Exception as e:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"エラー: {str(e)}"))
+            reply(event.reply_token, TextSendMessage(text=f"エラー: {str(e)}"))
 
+    def process():
+        with connection.execute_wrapper(queries):
+            handler.handle(body, signature)
+
+    # 署名だけはここで確かめ、処理は自治会ごとのキューに積んですぐに応答する（bot/scheduler.py）
     try:
-        handler.handle(body, signature)
+        if not handler.parser.signature_validator.validate(body, signature):
+            raise InvalidSignatureError
+        scheduler.submit(politician, process, keys=source_users(body))
     except InvalidSignatureError:
+        metrics.inc('webhook_invalid_signature_total')
         return HttpResponseBadRequest()
+    finally:
+        metrics.observe('webhook_request_seconds', time.perf_counter() - started)
     return HttpResponse("OK")
+
+
+# Prometheus から読み取る /metrics（METRICS_TOKEN の Bearer トークンが必要。未設定なら公開しない）
+# IIS の中継を通るため接続元は常に localhost になり、IPアドレスでは制限できない
+def metrics_view(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token:
+        raise Http404
+    # WSGI のヘッダーは latin-1 の文字列なので、非ASCIIの文字が来ても比べられるようバイト列で比べる
+    if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', '').encode('latin-1'), f'Bearer {token}'.encode()):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
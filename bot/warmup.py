@@ -0,0 +1,56 @@
+"""
+起動直後の下準備（core/wsgi.py から呼びます）
+Django は URL の設定（とそこから読み込む bot/views.py など）を最初のリクエストで読み込み、
+openai は AI の応答を作る時に初めて読み込みます。IIS の再起動直後に届いた webhook がこの待ち時間を
+払わなくて済むよう、別スレッドで先に読み込んでおきます（サーバーの待ち受け開始は遅らせません）。
+WARMUP_ON_START=False で無効にできます。
+"""
+import importlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.urls import get_resolver
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# 使う時に読み込んでいる重いライブラリ
+HEAVY_MODULES = ('openai',)
+
+
+def preload():
+    """URLの設定（ビュー一式）と重いライブラリを読み込む。かかった秒数を {名前: 秒} で返す"""
+    timings = {}
+    started = time.perf_counter()
+    get_resolver().url_patterns
+    timings['urls'] = time.perf_counter() - started
+    for name in HEAVY_MODULES:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            logger.warning("起動時の読み込みに失敗しました: %s", name)
+            continue
+        timings[name] = time.perf_counter() - started
+    for name, seconds in timings.items():
+        metrics.observe('startup_preload_seconds', seconds, module=name)
+    return timings
+
+
+def _run():
+    try:
+        preload()
+    except Exception:
+        logger.exception("起動時の読み込みに失敗しました")
+
+
+def start():
+    """別スレッドで preload() を始める（WARMUP_ON_START=False なら何もしない）"""
+    if not getattr(settings, 'WARMUP_ON_START', True):
+        return None
+    thread = threading.Thread(target=_run, name='warmup', daemon=True)
+    thread.start()
+    return thread
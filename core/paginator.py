@@ -0,0 +1,41 @@
+"""
+管理画面の一覧用ページ送り
+住民や会話ログのような大きなテーブルでは COUNT(*) だけで数秒かかるため、
+絞り込みの無い一覧はDBの統計情報から件数を見積もります（絞り込み時は正確に数えます）。
+"""
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimate_count(model, using):
+    """テーブル全体の見積もり件数。見積もれないDBでは None"""
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == 'sqlite':
+            # 削除された行の分だけ多めになるが、ページ送りの目安には十分
+            cursor.execute(f"SELECT MAX(_ROWID_) FROM {table}")
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL で一度も ANALYZE されていないテーブルは -1 になる
+    if not row or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    # 見積もりがこれ未満の小さなテーブルは正確に数える
+    threshold = 100_000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimate_count(self.object_list.model, self.object_list.db)
+            if estimate is not None and estimate >= self.threshold:
+                return estimate
+        return super().count
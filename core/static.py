@@ -0,0 +1,204 @@
+"""
+静的ファイル（管理画面のCSS・JSなど）の配信
+- collectstatic で内容のハッシュ付きの名前（base.1a2b3c4d.css）と、圧縮済みの .gz / .br を作っておく
+  （.br は brotli が入っている環境のみ）
+- StaticFilesMiddleware が STATIC_ROOT から直接返す。ハッシュ付きの名前は内容が変わらないので1年キャッシュさせ、
+  ブラウザが対応していれば圧縮済みのファイルをそのまま送る
+圧縮でどれだけ減ったかは manage.py static_report で確認できます。
+"""
+import gzip
+import mimetypes
+import os
+import stat as stat_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+
+try:
+    import brotli
+except ImportError:  # brotli が無い環境では .gz だけ作る
+    brotli = None
+
+# 圧縮すると小さくなる種類（画像・フォントの多くは圧縮済み）
+COMPRESSIBLE = ('.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico', '.ttf', '.otf', '.eot')
+# 元の大きさのこの割合より小さくならなければ、圧縮版は作らない
+MIN_RATIO = 0.95
+# ブラウザが選べる圧縮形式（優先する順）
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+SHORT = 'public, max-age=300'
+
+
+def compress(path):
+    """path の .gz（と .br）を作る。作ったファイルの一覧を返す"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    written = []
+    for suffix, compressed in variants:
+        if len(compressed) >= len(data) * MIN_RATIO:
+            continue
+        with open(path + suffix, 'wb') as f:
+            f.write(compressed)
+        written.append(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ハッシュ付きの名前に加えて、圧縮済みのファイルも collectstatic で作る"""
+    # manifest に無いファイルも、元の名前で返せるようにする
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        names = set(self.hashed_files) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE) and self.exists(name):
+                compress(self.path(name))
+
+    def url(self, name, force=False):
+        # 本番も DEBUG=True で動かしているため、collectstatic 済みなら DEBUG に関係なくハッシュ付きの名前を使う
+        if not self.hashed_files:
+            return StaticFilesStorage.url(self, name)
+        return super().url(name, force=True)
+
+
+class StaticFile:
+    __slots__ = ('path', 'content_type', 'size', 'mtime_ns', 'etags', 'last_modified', 'encodings', 'immutable')
+
+    def __init__(self, path, name, immutable, stat):
+        self.path = path
+        self.content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type in ('application/javascript', 'image/svg+xml'):
+            self.content_type += '; charset=utf-8'
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.last_modified = http_date(stat.st_mtime)
+        self.encodings = [(encoding, path + suffix) for encoding, suffix in ENCODINGS if os.path.isfile(path + suffix)]
+        # 中身（バイト列）が違うので、圧縮形式ごとに別の ETag にする
+        base = f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+        self.etags = {None: f'"{base}"', **{encoding: f'"{base}-{encoding}"' for encoding, _ in self.encodings}}
+        self.immutable = immutable
+
+    def choose(self, accept_encoding):
+        """ブラウザが受け取れる圧縮版 (形式, パス)。無ければ (None, 元のパス)"""
+        accepted = parse_accept_encoding(accept_encoding)
+        candidates = [
+            (accepted.get(encoding, accepted.get('*', 0)), i, encoding, path)
+            for i, (encoding, path) in enumerate(self.encodings)
+        ]
+        # q値の大きい形式、同じなら ENCODINGS の順。q=0 は「受け取れない」
+        for q, _, encoding, path in sorted(candidates, key=lambda c: (-c[0], c[1])):
+            if q > 0:
+                return encoding, path
+        return None, self.path
+
+
+def parse_accept_encoding(header):
+    """Accept-Encoding を {形式: q値} にする（q を省略したら 1、読めない q は 0）"""
+    accepted = {}
+    for part in header.split(','):
+        coding, *params = [item.strip() for item in part.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """STATIC_URL 以下のリクエストを STATIC_ROOT のファイルで返す（STATIC_SERVE=False なら何もしない）"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.files = {}
+
+    def __call__(self, request):
+        prefix = urlsplit(settings.STATIC_URL).path
+        if not prefix.startswith('/'):
+            prefix = '/' + prefix
+        if (
+            not getattr(settings, 'STATIC_SERVE', True)
+            or request.method not in ('GET', 'HEAD')
+            or not request.path_info.startswith(prefix)
+        ):
+            return self.get_response(request)
+        name = request.path_info[len(prefix):]
+        static_file = self.find(name)
+        if static_file is None:
+            return self.get_response(request)
+        try:
+            return self.serve(request, static_file)
+        except FileNotFoundError:
+            # 調べてから開くまでの間に collectstatic で消された（圧縮版だけ消えた場合は調べ直して返す）
+            self.files.pop(name, None)
+            static_file = self.find(name)
+            if static_file is None:
+                return self.get_response(request)
+            try:
+                return self.serve(request, static_file)
+            except FileNotFoundError:
+                return self.get_response(request)
+
+    def find(self, name):
+        """
+        name のファイル。調べた結果は覚えておくが、毎回 stat して大きさ・更新時刻が変わっていたら調べ直す
+        （再起動せずに collectstatic しても、古い ETag・圧縮版を返さない）
+        """
+        if not settings.STATIC_ROOT or not name or name.endswith(('.gz', '.br')):
+            return None
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.files.pop(name, None)
+            return None
+        static_file = self.files.get(name)
+        if static_file is not None and (static_file.size, static_file.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            return static_file
+        if not stat_module.S_ISREG(stat.st_mode):
+            return None
+        hashed_names = getattr(staticfiles_storage, 'hashed_files', {}).values()
+        static_file = self.files[name] = StaticFile(path, name, immutable=name in hashed_names, stat=stat)
+        return static_file
+
+    def serve(self, request, static_file):
+        encoding, path = static_file.choose(request.headers.get('Accept-Encoding', ''))
+        etag = static_file.etags[encoding]
+        headers = {
+            'Cache-Control': IMMUTABLE if static_file.immutable else SHORT,
+            'ETag': etag,
+            'Last-Modified': static_file.last_modified,
+        }
+        if static_file.encodings:
+            headers['Vary'] = 'Accept-Encoding'
+        # If-None-Match は弱い比較（W/ は無視する）
+        if_none_match = {tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+        if etag in if_none_match or '*' in if_none_match:
+            return HttpResponseNotModified(headers=headers)
+        response = FileResponse(open(path, 'rb'), content_type=static_file.content_type, headers=headers)
+        # 圧縮版のファイル名（.gz）をダウンロード名として渡さない
+        response.headers.pop('Content-Disposition', None)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        return response
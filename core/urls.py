@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path
 from django.urls import path, include
 from django.http import HttpResponse # ★追加1：画面に文字を出す部品
+from bot import views as bot_views
 
 # ★追加2：簡単な表示機能を作る
 def index(request):
@@ -27,5 +28,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     # botアプリのurls.pyを読み込む設定を追加
     path('bot/', include('bot.urls')),
+    # 処理時間などの計測値（Prometheus形式）
+    path('metrics', bot_views.metrics_view, name='metrics'),
     path('', index), # ★追加3：空っぽ（トップページ）の行き先を指定
 ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# 最初の webhook を待たせないよう、ビューと重いライブラリを裏で読み込んでおく（bot/warmup.py）
+from bot import warmup  # noqa: E402
+
+warmup.start()
@@ -4,6 +4,8 @@ from .models import Event
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
     # 一覧画面で表示する項目
-    list_display = ('title', 'start_time', 'location', 'is_active')
+    list_display = ('title', 'politician', 'start_time', 'location', 'is_active')
+    list_filter = ('is_active', 'politician')
+    list_select_related = ('politician',)
     # 日付の新しい順に並べる
     ordering = ('-start_time',)
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""
+住民向け「イベント」コマンドのカルーセル
+自治会ごとに送信用JSONまで組み立てた状態でキャッシュし、
+イベントの保存・削除時と、次のイベントの開始時刻に作り直します
+"""
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils import timezone
+from linebot.models import FlexSendMessage, TextSendMessage
+
+from bot import caching
+from bot.outbound import serialize_messages
+
+from .models import Event
+
+CACHE_NAMESPACE = "events"
+MAX_BUBBLES = 10
+# 開始時刻がずっと先でも、この秒数で一度は作り直す
+MAX_CACHE_SECONDS = 60 * 60
+
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+
+
+def upcoming_events(politician, now=None):
+    now = now or timezone.now()
+    return list(
+        Event.objects.filter(is_active=True, start_time__gte=now)
+        .filter(Q(politician=politician) | Q(politician__isnull=True))
+        .order_by('start_time')[:MAX_BUBBLES]
+    )
+
+
+def build_bubble(event):
+    start = timezone.localtime(event.start_time)
+    date_str = f"{start.month}/{start.day}({WEEKDAYS[start.weekday()]}) {start:%H:%M}〜"
+    body = [
+        {"type": "text", "text": "イベントのお知らせ", "color": "#1DB446", "size": "sm", "weight": "bold"},
+        {"type": "text", "text": event.title, "weight": "bold", "size": "xl", "margin": "md", "wrap": True},
+        {"type": "text", "text": f"📅 {date_str}", "size": "sm", "margin": "md", "color": "#555555"},
+        {"type": "text", "text": f"📍 {event.location}", "size": "sm", "color": "#555555", "wrap": True},
+    ]
+    if event.description:
+        body.append({"type": "text", "text": event.description[:200], "size": "sm", "margin": "md", "wrap": True})
+
+    buttons = []
+    if event.url:
+        buttons.append({"type": "button", "style": "primary", "color": "#1DB446", "action": {"type": "uri", "label": "詳しく見る", "uri": event.url}})
+    if event.video_url:
+        buttons.append({"type": "button", "style": "secondary", "action": {"type": "uri", "label": "動画を見る", "uri": event.video_url}})
+
+    bubble = {
+        "type": "bubble",
+        "body": {"type": "box", "layout": "vertical", "contents": body},
+    }
+    if buttons:
+        bubble["footer"] = {"type": "box", "layout": "vertical", "spacing": "sm", "contents": buttons}
+    return bubble
+
+
+def render(events):
+    if not events:
+        return serialize_messages(TextSendMessage(text="現在、予定されているイベントはありません。"))
+    carousel = {"type": "carousel", "contents": [build_bubble(e) for e in events]}
+    return serialize_messages(FlexSendMessage(alt_text="イベント情報", contents=carousel))
+
+
+def get_events_payload(politician):
+    """送信用JSON（messages配列）を返す。キャッシュがあればDBには問い合わせない"""
+    key = caching.make_key(CACHE_NAMESPACE, politician.pk)
+    payload = cache.get(key)
+    if payload is not None:
+        return payload
+
+    now = timezone.now()
+    events = upcoming_events(politician, now)
+    payload = render(events)
+
+    # 先頭のイベントが始まったら一覧から外れるので、その時刻で期限切れにする
+    timeout = MAX_CACHE_SECONDS
+    if events:
+        timeout = max(1, min(timeout, int((events[0].start_time - now).total_seconds()) + 1))
+    cache.set(key, payload, timeout)
+    return payload
+
+
+def invalidate(using=DEFAULT_DB_ALIAS):
+    caching.bump(CACHE_NAMESPACE, using=using)
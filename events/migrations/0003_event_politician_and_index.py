@@ -0,0 +1,24 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_outbounddeadletter'),
+        ('events', '0002_event_video_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='politician',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='upcoming_events', to='bot.politician', verbose_name='自治会'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['is_active', 'start_time'], name='events_active_start_idx'),
+        ),
+    ]
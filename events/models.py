@@ -1,6 +1,15 @@
 from django.db import models
 
 class Event(models.Model):
+    # 未設定の場合はすべての自治会に表示されます
+    politician = models.ForeignKey(
+        'bot.Politician',
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        verbose_name="自治会",
+        related_name="upcoming_events",
+    )
     title = models.CharField("イベント名", max_length=100)
     start_time = models.DateTimeField("開始日時")
     location = models.CharField("場所", max_length=100, default="未定")
@@ -26,4 +35,8 @@ class Event(models.Model):
 
     class Meta:
         verbose_name = "イベント情報"
-        verbose_name_plural = "イベント情報一覧"
\ No newline at end of file
+        verbose_name_plural = "イベント情報一覧"
+        # 「公開中かつこれから開催」の検索用
+        indexes = [
+            models.Index(fields=['is_active', 'start_time'], name='events_active_start_idx'),
+        ]
\ No newline at end of file
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Event
+from . import carousel
+
+
+# 「全自治会向け」のイベントもあるため、自治会単位ではなくまとめて作り直す
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def invalidate_event_carousel(sender, using, **kwargs):
+    carousel.invalidate(using)
@@ -1,3 +1,57 @@
+import json
+from datetime import timedelta
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from bot import caching
+from bot.models import Politician
+
+from . import carousel
+from .models import Event
+
+
+@override_settings(CACHE_VERSION_CHECK_SECONDS=3600)
+class EventCarouselTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.politician = Politician.objects.create(name="テスト自治会", slug="test", line_channel_secret="s", line_access_token="t")
+        other = Politician.objects.create(name="別の自治会", slug="other", line_channel_secret="s", line_access_token="t")
+        now = timezone.now()
+        Event.objects.create(politician=cls.politician, title="防災訓練", start_time=now + timedelta(days=2))
+        Event.objects.create(title="夏祭り", start_time=now + timedelta(days=1))
+        Event.objects.create(politician=other, title="別の自治会の清掃", start_time=now + timedelta(days=1))
+        Event.objects.create(title="終わった集まり", start_time=now - timedelta(days=1))
+        Event.objects.create(title="非公開の集まり", start_time=now + timedelta(days=1), is_active=False)
+
+    def setUp(self):
+        cache.clear()
+        caching.forget()
+        self.addCleanup(caching.forget)
+
+    def titles(self):
+        messages = json.loads(carousel.get_events_payload(self.politician))
+        return [bubble['body']['contents'][1]['text'] for bubble in messages[0]['contents']['contents']]
+
+    def test_lists_upcoming_events_for_the_tenant_in_order(self):
+        self.assertEqual(self.titles(), ["夏祭り", "防災訓練"])
+
+    def test_second_request_is_served_from_cache(self):
+        payload = carousel.get_events_payload(self.politician)
+        with self.assertNumQueries(0):
+            self.assertEqual(carousel.get_events_payload(self.politician), payload)
+
+    def test_saving_an_event_rebuilds_the_carousel(self):
+        self.titles()
+        Event.objects.create(title="餅つき大会", start_time=timezone.now() + timedelta(hours=1))
+        self.assertEqual(self.titles(), ["餅つき大会", "夏祭り", "防災訓練"])
+        Event.objects.filter(title="夏祭り").get().delete()
+        self.assertEqual(self.titles(), ["餅つき大会", "防災訓練"])
 
-# Create your tests here.
+    def test_no_events_is_a_text_message(self):
+        Event.objects.all().delete()
+        messages = json.loads(carousel.get_events_payload(self.politician))
+        self.assertEqual(messages, [{'type': 'text', 'text': "現在、予定されているイベントはありません。"}])
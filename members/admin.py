@@ -1,12 +1,26 @@
 from django.contrib import admin
+from django.db.models import Q
+
+from core.paginator import EstimatedCountPaginator
 from .models import AiMember
 
 @admin.register(AiMember)
 class AiMemberAdmin(admin.ModelAdmin):
     list_display = ('line_user_id', 'real_name', 'current_level', 'is_approved', 'created_at')
     list_editable = ('is_approved', 'current_level') # 一覧画面でそのまま編集可能に
-    search_fields = ('real_name', 'line_user_id', 'address')
-    list_filter = ('current_level', 'is_approved')
+    # LINEユーザーIDは完全一致、氏名・住所は前方一致（索引が使える検索だけにする）
+    search_fields = ('=line_user_id', '^real_name', '^address')
+    list_filter = ('politician', 'current_level', 'is_approved')
+    # 住民が多い自治会でも一覧がすぐ開くよう、全件数は見積もりで済ませる
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # 標準の検索は大文字小文字を無視した LIKE になり索引が効かないため、そのままの文字で探す
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(Q(line_user_id=term) | Q(real_name__startswith=term) | Q(address__startswith=term)), False
 
 # members/admin.py の抜粋例
 def generate_lesson_action(modeladmin, request, queryset):
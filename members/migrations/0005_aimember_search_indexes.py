@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0004_alter_aimember_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aimember',
+            name='address',
+            field=models.TextField(blank=True, db_index=True, verbose_name='住所'),
+        ),
+        migrations.AlterField(
+            model_name='aimember',
+            name='real_name',
+            field=models.CharField(blank=True, db_index=True, max_length=100, verbose_name='氏名（本人申告）'),
+        ),
+    ]
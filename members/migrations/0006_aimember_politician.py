@@ -0,0 +1,36 @@
+# Generated by Django 6.0.2 on 2026-10-19 19:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def assign_existing_members(apps, schema_editor):
+    # 既存の住民は、案内の進捗がある自治会が1つだけの場合に限りその自治会の住民にする
+    AiMember = apps.get_model('members', 'AiMember')
+    UserProgress = apps.get_model('bot', 'UserProgress')
+    db_alias = schema_editor.connection.alias
+    single = (
+        UserProgress.objects.using(db_alias).values('line_user_id')
+        .annotate(tenants=Count('politician', distinct=True), politician_id=Min('politician'))
+        .filter(tenants=1)
+    )
+    for row in single.iterator():
+        AiMember.objects.using(db_alias).filter(pk=row['line_user_id']).update(politician_id=row['politician_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0017_politician_webhook_weight'),
+        ('members', '0005_aimember_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aimember',
+            name='politician',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='members', to='bot.politician', verbose_name='自治会'),
+        ),
+        migrations.RunPython(assign_existing_members, migrations.RunPython.noop),
+    ]
@@ -18,10 +18,12 @@ class AiMember(models.Model):
     real_name = models.CharField(
         max_length=100, 
         blank=True, 
+        db_index=True,
         verbose_name="氏名（本人申告）"
     )
     address = models.TextField(
         blank=True, 
+        db_index=True,
         verbose_name="住所"
     )
     phone_number = models.CharField(
@@ -30,6 +32,17 @@ class AiMember(models.Model):
         verbose_name="電話番号"
     )
     
+    # 友だち追加・登録を行ったLINE公式アカウントの自治会
+    # （LINEユーザーIDはチャネルの提供元ごとに異なるため、住民は1つの自治会に属する）
+    politician = models.ForeignKey(
+        'bot.Politician',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='members',
+        verbose_name="自治会"
+    )
+
     # 既存自治会名簿との紐付け用
     existing_member_id = models.CharField(
         max_length=100, 
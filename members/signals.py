@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import state
+from .models import AiMember
+
+
+# 管理画面などで登録ステップが変わった・住民が消された場合に、全プロセスのキャッシュを捨てる
+# （新しく作られた住民や、登録ステップを含まない保存ではキャッシュは古くならない）
+@receiver(post_save, sender=AiMember)
+def forget_member_state(sender, created, update_fields, using, **kwargs):
+    if created or (update_fields is not None and 'registration_step' not in update_fields):
+        return
+    state.forget(using)
+
+
+@receiver(post_delete, sender=AiMember)
+def forget_deleted_member_state(sender, using, **kwargs):
+    state.forget(using)
@@ -0,0 +1,64 @@
+"""
+住民の登録状態（registration_step）の読み書き
+登録済み（STEP_REGISTERED）の住民はキャッシュし、通常のメッセージではDBに問い合わせません。
+キーには版番号（bot/caching.py）を含めるので、管理画面での変更や、登録済みの住民を登録前に戻した時は
+bump() でほかのプロセスのキャッシュもまとめて無効にします。
+登録途中の住民はキャッシュせず、別のワーカーが処理しても食い違わないよう毎回DBから読みます。
+"""
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, IntegrityError
+from django.utils import timezone
+
+from bot import caching
+
+from .models import AiMember
+
+# registration_step の値（AiMember.registration_step の help_text 参照）
+STEP_GREETING = 0
+STEP_NAME = 1
+STEP_ADDRESS = 2
+STEP_REGISTERED = 3
+
+NAMESPACE = "member_step"
+CACHE_SECONDS = 60 * 60 * 24
+
+
+def _key(line_user_id):
+    return caching.make_key(NAMESPACE, line_user_id)
+
+
+def get_registration_step(line_user_id, politician=None):
+    """登録ステップを返す。初めての住民はここで（politician の住民として）作成される"""
+    key = _key(line_user_id)
+    if cache.get(key) == STEP_REGISTERED:
+        return STEP_REGISTERED
+    step = AiMember.objects.filter(pk=line_user_id).values_list('registration_step', flat=True).first()
+    if step is None:
+        try:
+            step = AiMember.objects.create(line_user_id=line_user_id, politician=politician).registration_step
+        except IntegrityError:
+            # 同時に届いた別のメッセージが先に作成した
+            step = AiMember.objects.values_list('registration_step', flat=True).get(pk=line_user_id)
+    if step == STEP_REGISTERED:
+        cache.set(key, step, CACHE_SECONDS)
+    return step
+
+
+def set_registration_step(line_user_id, step, **fields):
+    """登録ステップ（と必要な項目だけ）を更新する。行が無ければ作成する"""
+    rows = AiMember.objects.filter(pk=line_user_id)
+    if step < STEP_REGISTERED:
+        # 登録済みの住民を登録前に戻す（友だち追加のやり直しなど）場合は下の update_or_create で保存し、
+        # 保存のシグナル（members/signals.py）でほかのプロセスのキャッシュも捨てる
+        rows = rows.exclude(registration_step=STEP_REGISTERED)
+    if not rows.update(registration_step=step, updated_at=timezone.now(), **fields):
+        AiMember.objects.update_or_create(
+            line_user_id=line_user_id, defaults={'registration_step': step, **fields}
+        )
+    if step == STEP_REGISTERED:
+        cache.set(_key(line_user_id), step, CACHE_SECONDS)
+
+
+def forget(using=DEFAULT_DB_ALIAS):
+    """すべてのプロセスの登録状態のキャッシュを捨てる（住民は多いので、1人ずつではなく名前空間ごと）"""
+    caching.bump(NAMESPACE, using=using)
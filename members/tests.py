@@ -1,3 +1,41 @@
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from .models import AiMember
+
+
+class AiMemberAdminTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        AiMember.objects.create(line_user_id="U001", real_name="宮崎太郎", address="北町1丁目2-3")
+        AiMember.objects.create(line_user_id="U002", real_name="日向花子", address="南町4丁目")
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def search(self, term):
+        response = self.client.get('/admin/members/aimember/', {'q': term})
+        self.assertEqual(response.status_code, 200)
+        return [m.line_user_id for m in response.context['cl'].result_list]
+
+    def test_search_uses_exact_id_and_prefix_match(self):
+        self.assertEqual(self.search("U001"), ["U001"])
+        self.assertEqual(self.search("日向"), ["U002"])
+        self.assertEqual(self.search("北町"), ["U001"])
+        # 途中の文字だけでは探さない（前方一致のみ）
+        self.assertEqual(self.search("丁目"), [])
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get('/admin/members/aimember/')
+            return len(ctx)
+
+        count_queries()
+        few = count_queries()
+        AiMember.objects.bulk_create([AiMember(line_user_id=f"U1{i:02d}", real_name=f"住民{i}") for i in range(30)])
+        self.assertEqual(count_queries(), few)